@@ -1,9 +1,11 @@
 import json
 import re
 from collections import Counter, defaultdict
+from typing import Optional
 
 import pandas as pd
 from constants import OUTPUT_DIR
+from fuzzy_lookup import FuzzyIndex
 from tqdm import tqdm
 
 tqdm.pandas()
@@ -13,6 +15,7 @@ tqdm.pandas()
 # --------------------------------------------------------------------------------------
 # INFILE
 # OUTFILE
+# TOKENS_OUTFILE
 # SPECIAL_TOKENS
 # UNK
 
@@ -21,6 +24,10 @@ tqdm.pandas()
 # GLYPH_NAMES
 # GLYPH_NAME_TO_READINGS
 
+# FUZZY_FALLBACK
+# READING_INDEX
+# GLYPH_NAME_INDEX
+
 # NUMBERS_TO_MORPHEMES
 
 # SIGN_LIST_REPLACEMENTS
@@ -33,6 +40,7 @@ tqdm.pandas()
 
 INFILE = f"{OUTPUT_DIR}/3_cleaned_transliterations.csv"
 OUTFILE = f"{OUTPUT_DIR}/5_with_glyphs.csv"
+TOKENS_OUTFILE = f"{OUTPUT_DIR}/5_tokens.parquet"
 
 SPECIAL_TOKENS = {
     "<SURFACE>",
@@ -65,6 +73,14 @@ for reading, glyph_names in READING_TO_GLYPH_NAME.items():
 for k, v in GLYPH_NAME_TO_READINGS.items():
     GLYPH_NAME_TO_READINGS[k] = list(set(v))
 
+# Before giving up on a morpheme, look for a unique match among readings/glyph names
+# that differ only in spelling conventions (subscripts, ŋ/g) or by one edit (see
+# fuzzy_lookup.py). Off by default, as in the published dataset; when on, the
+# tokens it resolves are flagged in the token table (is_fuzzy).
+FUZZY_FALLBACK = False
+READING_INDEX = FuzzyIndex(READING_TO_GLYPH_NAME)
+GLYPH_NAME_INDEX = FuzzyIndex({name: [name] for name in GLYPH_NAMES})
+
 NUMBERS_TO_READINGS = {
     "1/2": "1/2(diš)",
     "1/3": "1/3(diš)",
@@ -229,6 +245,8 @@ unk_readings_sign_name = []
 unk_readings_num = []
 unk_reading_other = []
 
+fuzzy_matches = []
+
 
 glyph_names_not_in_map = []
 glyph_names_no_unicode = []
@@ -236,6 +254,22 @@ glyph_names_found_unicode = []
 
 glyph_to_observed_readings = {}
 
+# Long-form token table, one entry per (morpheme, glyph name, glyph) triple.
+# Kept as columns of plain lists while rows are processed,
+# then converted to a DataFrame with categorical (dictionary-encoded) columns.
+TOKEN_TABLE_COLUMNS = [
+    "tablet_id",
+    "line_no",
+    "wordform_idx",
+    "position",
+    "morpheme",
+    "glyph_name",
+    "glyph",
+    "is_special",
+    "is_fuzzy",
+]
+token_table: dict[str, list] = {column: [] for column in TOKEN_TABLE_COLUMNS}
+
 
 # --------------------------------------------------------------------------------------
 # ------------------------------- Main  ------------------------------------------------
@@ -294,6 +328,7 @@ def main():
 
     _print_glyph_count(df)
     _write(df, separate_genre_files=True)
+    _write_token_table(df)
     _save_glyph_to_observed_readings()
 
 
@@ -324,15 +359,36 @@ def _add_glyphs_to_row(row: pd.Series) -> pd.Series:
     glyph_names = ""
     glyphs = ""
 
+    line_no = 0
+    wordform_idx = 0
     for wordform in wordforms:
-        data = _get_wordform_glyph_data(wordform)  # [(morpheme, glyph_name, glyph), ]
-        transliteration += "-".join([morpheme for morpheme, _, _ in data]) + " "
-        glyph_names += " ".join([glyph_name for _, glyph_name, _ in data]) + " "
-        glyphs += "".join([glyph for _, _, glyph in data]) + " "
+        # [(morpheme, glyph_name, glyph, is_fuzzy), ]
+        data = _get_wordform_glyph_data(wordform)
+        transliteration += "-".join([morpheme for morpheme, _, _, _ in data]) + " "
+        glyph_names += " ".join([glyph_name for _, glyph_name, _, _ in data]) + " "
+        glyphs += "".join([glyph for _, _, glyph, _ in data]) + " "
+
+        # Record tokens for the long-form table
+        # (the newline token closes the line it is on)
+        for position, (morpheme, glyph_name, glyph, is_fuzzy) in enumerate(data):
+            token_table["tablet_id"].append(row["id"])
+            token_table["line_no"].append(line_no)
+            token_table["wordform_idx"].append(wordform_idx)
+            token_table["position"].append(position)
+            token_table["morpheme"].append(morpheme)
+            token_table["glyph_name"].append(glyph_name)
+            token_table["glyph"].append(glyph)
+            token_table["is_special"].append(morpheme in SPECIAL_TOKENS)
+            token_table["is_fuzzy"].append(is_fuzzy)
+        if wordform == "\n":
+            line_no += 1
+            wordform_idx = 0
+        else:
+            wordform_idx += 1
 
         # Record observed readings
         for item in data:
-            morpheme, _, glyph = item
+            morpheme, _, glyph, _ = item
             if morpheme in SPECIAL_TOKENS:
                 continue
             # morpheme_ = morpheme.replace("{", "").replace("}", "")
@@ -359,24 +415,24 @@ SWAP_GLYPH_NAMES = {
 }
 
 
-def _get_wordform_glyph_data(wordform: str) -> list[tuple[str, str, str]]:
+def _get_wordform_glyph_data(wordform: str) -> list[tuple[str, str, str, bool]]:
     if wordform in SPECIAL_TOKENS:
-        return [(wordform, wordform, wordform)]
+        return [(wordform, wordform, wordform, False)]
 
     # Break wordform into morphemes
     morphemes: list[str] = _split_wordform_into_morphemes(wordform)
 
     # Get possible glyph names for each morpheme
-    morphemes_and_possible_glyph_names: list[tuple[str, list[str]]] = [
-        _get_morpheme_glyph_names(m) for m in morphemes
+    morphemes_and_possible_glyph_names: list[tuple[str, list[str], bool]] = [
+        _get_morpheme_glyph_names_and_fuzzy(m) for m in morphemes
     ]
 
     # Only accept morphemes with exactly one glyph name
-    morphemes_and_glyph_names: list[tuple[str, str]] = []
-    for morpheme, possible_glyph_names in morphemes_and_possible_glyph_names:
+    morphemes_and_glyph_names: list[tuple[str, str, bool]] = []
+    for morpheme, possible_glyph_names, is_fuzzy in morphemes_and_possible_glyph_names:
         glyph_name = UNK if len(possible_glyph_names) != 1 else possible_glyph_names[0]
         morpheme = UNK if glyph_name == UNK else morpheme
-        morphemes_and_glyph_names.append((morpheme, glyph_name))
+        morphemes_and_glyph_names.append((morpheme, glyph_name, is_fuzzy))
 
         if glyph_name == UNK:
             unk_readings_all.append(morpheme)
@@ -384,8 +440,8 @@ def _get_wordform_glyph_data(wordform: str) -> list[tuple[str, str, str]]:
             non_unk_readings_all.append(morpheme)
 
     # Now get the glyphs
-    morphemes_glyph_names_and_glyphs: list[tuple[str, str, str]] = []
-    for morpheme, glyph_name in morphemes_and_glyph_names:
+    morphemes_glyph_names_and_glyphs: list[tuple[str, str, str, bool]] = []
+    for morpheme, glyph_name, is_fuzzy in morphemes_and_glyph_names:
         if glyph_name == "N":
             continue
 
@@ -393,13 +449,15 @@ def _get_wordform_glyph_data(wordform: str) -> list[tuple[str, str, str]]:
             glyph_name = SWAP_GLYPH_NAMES[glyph_name]
 
         if morpheme == UNK:
-            morphemes_glyph_names_and_glyphs.append((UNK, UNK, UNK))
+            morphemes_glyph_names_and_glyphs.append((UNK, UNK, UNK, False))
         else:
             unicode = _glyph_name_to_unicode(glyph_name)
             if unicode == UNK or "X" in unicode:
-                morphemes_glyph_names_and_glyphs.append((UNK, UNK, UNK))
+                morphemes_glyph_names_and_glyphs.append((UNK, UNK, UNK, False))
             else:
-                morphemes_glyph_names_and_glyphs.append((morpheme, glyph_name, unicode))
+                morphemes_glyph_names_and_glyphs.append(
+                    (morpheme, glyph_name, unicode, is_fuzzy)
+                )
 
     return morphemes_glyph_names_and_glyphs
 
@@ -437,6 +495,13 @@ def _split_wordform_into_morphemes(wf: str) -> list[str]:
 NUMERIC_PATTERN = re.compile(r"^\d+(/\d+)?(\.\d+)?(\s*\([^)]+\))?$")
 
 
+def _get_morpheme_glyph_names_and_fuzzy(morpheme: str) -> tuple[str, list[str], bool]:
+    """_get_morpheme_glyph_names, and whether the fuzzy fallback resolved it."""
+    num_fuzzy_matches = len(fuzzy_matches)
+    morpheme, glyph_names = _get_morpheme_glyph_names(morpheme)
+    return morpheme, glyph_names, len(fuzzy_matches) > num_fuzzy_matches
+
+
 def _get_morpheme_glyph_names(morpheme: str) -> tuple[str, list[str]]:
     # only want to do this when it stands on its own
     morpheme = "ŋeš₂" if morpheme == "geš₂" else morpheme
@@ -468,6 +533,11 @@ def _get_morpheme_glyph_names(morpheme: str) -> tuple[str, list[str]]:
         morpheme_ = morpheme.lower()
         if morpheme_.lower() in READING_TO_GLYPH_NAME:
             return UNK, READING_TO_GLYPH_NAME[morpheme_]
+        match = _fuzzy_lookup(GLYPH_NAME_INDEX, morpheme) or _fuzzy_lookup(
+            READING_INDEX, morpheme_
+        )
+        if match:
+            return UNK, [match[1]]
         # give up hope :/
         unk_readings_sign_name.append(morpheme)
         return UNK, []
@@ -488,10 +558,33 @@ def _get_morpheme_glyph_names(morpheme: str) -> tuple[str, list[str]]:
             if len(possible_readings) == 1:
                 return possible_readings[0], [glyph_name_]
 
+    is_determinative = morpheme.startswith("{") and morpheme.endswith("}")
+    match = _fuzzy_lookup(READING_INDEX, morpheme.replace("{", "").replace("}", ""))
+    if match:
+        reading, glyph_name = match
+        return ("{" + reading + "}" if is_determinative else reading), [glyph_name]
+
     unk_reading_other.append(morpheme)
     return morpheme, []
 
 
+def _fuzzy_lookup(index: FuzzyIndex, morpheme: str) -> Optional[tuple[str, str]]:
+    """
+    (matched key, glyph name) if the fuzzy index resolves the morpheme
+    to exactly one glyph name, otherwise None.
+    """
+    if not FUZZY_FALLBACK:
+        return None
+    matches = index.lookup(morpheme)
+    glyph_names = {name for names in matches.values() for name in names}
+    if len(glyph_names) != 1:
+        return None
+    # Several spellings of the same sign: keep the morpheme as written
+    key = next(iter(matches)) if len(matches) == 1 else morpheme
+    fuzzy_matches.append(f"{morpheme} -> {key}")
+    return key, glyph_names.pop()
+
+
 def _get_number_glyph_names(morpheme: str) -> tuple[str, list[str]]:
     if morpheme in READING_TO_GLYPH_NAME:
         return morpheme, READING_TO_GLYPH_NAME[morpheme]
@@ -554,6 +647,7 @@ def _print_reading_to_glyph_name_stats():
     _print_report(unk_readings_sign_name, "UNK SIGN NAMES")
     _print_report(unk_readings_num, "UNK NUMBERS")
     _print_report(unk_reading_other, "UNK OTHER")
+    _print_report(fuzzy_matches, "FUZZY MATCHES")
     print()
 
 
@@ -634,6 +728,27 @@ def _write(df: pd.DataFrame, separate_genre_files=False):
     df.to_csv(OUTFILE, index=False, encoding="utf-8")
 
 
+def _write_token_table(df: pd.DataFrame):
+    """
+    Write one row per token, restricted to the tablets that survived deduplication.
+    String columns are categorical so that parquet stores them dictionary-encoded;
+    period and genre are joined in so that corpus slices are plain column filters.
+    """
+    tokens_df = pd.DataFrame(token_table)
+    tokens_df = tokens_df.merge(
+        df[["id", "period", "genre"]], left_on="tablet_id", right_on="id"
+    )
+    tokens_df = tokens_df[["tablet_id", "period", "genre", *TOKEN_TABLE_COLUMNS[1:]]]
+
+    for key in ["tablet_id", "period", "genre", "morpheme", "glyph_name", "glyph"]:
+        tokens_df[key] = tokens_df[key].astype("category")
+    for key in ["line_no", "wordform_idx", "position"]:
+        tokens_df[key] = tokens_df[key].astype("int32")
+
+    print(f"Writing {len(tokens_df)} tokens to {TOKENS_OUTFILE}...")
+    tokens_df.to_parquet(TOKENS_OUTFILE, index=False)
+
+
 def _save_glyph_to_observed_readings():
     with open(
         f"{OUTPUT_DIR}/glyph_to_observed_readings.json", "w", encoding="utf-8"
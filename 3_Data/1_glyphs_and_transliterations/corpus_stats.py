@@ -0,0 +1,334 @@
+"""
+Streaming corpus statistics over the `glyphs` column of a stage output
+(by default `./outputs/5_with_glyphs.csv`), without loading it into memory.
+
+Keeps:
+- exact glyph unigram counts
+- count-min sketches and top-K heavy hitters for glyph bigrams and trigrams
+  (n-grams do not span special tokens such as `...` or newlines)
+- tablet length histograms (in glyphs) per (period, genre)
+
+The state is saved to `./outputs/corpus_stats/`. Running the script again with
+new files (e.g. additional shards) updates the saved state; tablets that have
+already been counted are skipped. Two states built over different shards can be
+combined with `CorpusStats.merge`.
+
+e.g.
+    poetry run python corpus_stats.py
+    poetry run python corpus_stats.py outputs/shard_1.csv outputs/shard_2.csv
+"""
+
+import argparse
+import json
+import os
+from collections import Counter, defaultdict
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from constants import OUTPUT_DIR
+from glyph_array import to_codepoints
+
+INFILE = f"{OUTPUT_DIR}/5_with_glyphs.csv"
+STATE_DIR = f"{OUTPUT_DIR}/corpus_stats"
+
+CHUNKSIZE = 10_000
+
+SKETCH_WIDTH = 2**20
+SKETCH_DEPTH = 4
+TOP_K = 100
+NGRAM_SIZES = (2, 3)
+
+LENGTH_BINS = [0, 8, 16, 32, 64, 128, 256, 512, 1024, 2048]
+
+# Code points below this are special tokens (see glyph_array.SPECIAL_TOKEN_TO_CHAR)
+MIN_GLYPH_CODEPOINT = 0x20
+# Every glyph code point fits in 21 bits, so a trigram fits in a uint64
+CODEPOINT_BITS = 21
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compute glyph corpus statistics.")
+    parser.add_argument("infiles", nargs="*", default=[INFILE])
+    parser.add_argument("--state", type=str, default=STATE_DIR)
+    parser.add_argument("--fresh", action="store_true", help="Ignore saved state")
+    args = parser.parse_args()
+
+    if not args.fresh and os.path.isdir(args.state):
+        print(f"Loading state from {args.state}...")
+        stats = CorpusStats.load(args.state)
+    else:
+        stats = CorpusStats()
+
+    for infile in args.infiles:
+        print(f"Reading {infile}...")
+        stats.update_from_csv(infile)
+
+    stats.save(args.state)
+    stats.print_report()
+
+
+class CountMinSketch:
+    """
+    Count-min sketch over uint64 keys, using multiply-shift hashing.
+    Sketches with the same width, depth, and seed can be added together.
+    """
+
+    def __init__(self, width: int = SKETCH_WIDTH, depth: int = SKETCH_DEPTH, seed=0):
+        if width & (width - 1):
+            raise ValueError("width must be a power of 2")
+        self.width = width
+        self.depth = depth
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        # odd multipliers
+        self._multipliers = rng.integers(0, 2**63, size=depth, dtype=np.uint64)
+        self._multipliers = self._multipliers * np.uint64(2) + np.uint64(1)
+        self._shift = np.uint64(64 - (width.bit_length() - 1))
+        self.table = np.zeros((depth, width), dtype=np.int64)
+
+    def _buckets(self, keys: np.ndarray) -> np.ndarray:
+        keys = keys.astype(np.uint64)
+        with np.errstate(over="ignore"):
+            hashed = keys[None, :] * self._multipliers[:, None]
+        return (hashed >> self._shift).astype(np.int64)
+
+    def add(self, keys: np.ndarray, counts: np.ndarray):
+        buckets = self._buckets(keys)
+        for row in range(self.depth):
+            self.table[row] += np.bincount(
+                buckets[row], weights=counts, minlength=self.width
+            ).astype(np.int64)
+
+    def query(self, keys: np.ndarray) -> np.ndarray:
+        buckets = self._buckets(keys)
+        rows = np.arange(self.depth)[:, None]
+        return self.table[rows, buckets].min(axis=0)
+
+    def merge(self, other: "CountMinSketch"):
+        params = (self.width, self.depth, self.seed)
+        if params != (other.width, other.depth, other.seed):
+            raise ValueError("Can only merge sketches with the same parameters")
+        self.table += other.table
+
+
+class CorpusStats:
+    def __init__(self, top_k: int = TOP_K, **sketch_kwargs):
+        self.top_k = top_k
+        self.unigrams: Counter[str] = Counter()
+        self.sketches = {n: CountMinSketch(**sketch_kwargs) for n in NGRAM_SIZES}
+        # n -> (candidate keys, estimated counts); at most top_k of each
+        self.heavy_hitters = {
+            n: (np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64))
+            for n in NGRAM_SIZES
+        }
+        # (period, genre) -> count per length bin
+        self.length_histograms: dict[tuple[str, str], np.ndarray] = defaultdict(
+            lambda: np.zeros(len(LENGTH_BINS), dtype=np.int64)
+        )
+        self.seen_ids: set[str] = set()
+
+    # ----------------------------------------------------------------------------------
+    # ------------------------------ Updates -------------------------------------------
+    # ----------------------------------------------------------------------------------
+    def update_from_csv(self, infile: str, chunksize: int = CHUNKSIZE):
+        for chunk in pd.read_csv(
+            infile,
+            usecols=["id", "period", "genre", "glyphs"],
+            chunksize=chunksize,
+            encoding="utf-8",
+            keep_default_na=False,
+        ):
+            self.update(chunk)
+
+    def update(self, df: pd.DataFrame):
+        """Add a chunk of tablets (columns: id, period, genre, glyphs)."""
+        df = df[~df["id"].isin(self.seen_ids)].drop_duplicates("id")
+        if df.empty:
+            return
+        self.seen_ids.update(df["id"])
+
+        codepoints = [to_codepoints(glyphs) for glyphs in df["glyphs"]]
+
+        # Lengths (glyphs only)
+        lengths = np.array([(c >= MIN_GLYPH_CODEPOINT).sum() for c in codepoints])
+        bins = np.digitize(lengths, LENGTH_BINS) - 1
+        for period, genre, bin_ in zip(df["period"], df["genre"], bins):
+            self.length_histograms[(period, genre)][bin_] += 1
+
+        # Tablets are separated by a 0 so that n-grams never span two tablets
+        separator = np.zeros(1, dtype=np.uint32)
+        stream = np.concatenate([x for c in codepoints for x in (c, separator)])
+        is_glyph = stream >= MIN_GLYPH_CODEPOINT
+
+        glyphs, counts = np.unique(stream[is_glyph], return_counts=True)
+        for glyph, count in zip(glyphs.tolist(), counts.tolist()):
+            self.unigrams[chr(glyph)] += count
+
+        for n in NGRAM_SIZES:
+            keys = _ngram_keys(stream, is_glyph, n)
+            keys, counts = np.unique(keys, return_counts=True)
+            self.sketches[n].add(keys, counts)
+            self._update_heavy_hitters(n, keys)
+
+    def _update_heavy_hitters(self, n: int, new_keys: np.ndarray):
+        keys, _ = self.heavy_hitters[n]
+        keys = np.union1d(keys, new_keys)
+        estimates = self.sketches[n].query(keys)
+        top = np.argsort(-estimates, kind="stable")[: self.top_k]
+        self.heavy_hitters[n] = (keys[top], estimates[top])
+
+    def merge(self, other: "CorpusStats"):
+        """Combine with the stats of a disjoint shard."""
+        overlap = self.seen_ids & other.seen_ids
+        if overlap:
+            raise ValueError(f"{len(overlap)} tablets were counted in both states")
+        self.unigrams.update(other.unigrams)
+        for n in NGRAM_SIZES:
+            self.sketches[n].merge(other.sketches[n])
+            self._update_heavy_hitters(n, other.heavy_hitters[n][0])
+        for key, histogram in other.length_histograms.items():
+            self.length_histograms[key] += histogram
+        self.seen_ids |= other.seen_ids
+
+    # ----------------------------------------------------------------------------------
+    # ------------------------------ Queries -------------------------------------------
+    # ----------------------------------------------------------------------------------
+    def ngram_count(self, glyphs: str) -> int:
+        """Exact for single glyphs, an upper-bound estimate for bigrams/trigrams."""
+        codepoints = to_codepoints(glyphs)
+        if len(codepoints) == 1:
+            return self.unigrams[glyphs]
+        if len(codepoints) not in self.sketches:
+            raise ValueError(f"Only n-grams of size {NGRAM_SIZES} are sketched")
+        is_glyph = codepoints >= MIN_GLYPH_CODEPOINT
+        key = _ngram_keys(codepoints, is_glyph, len(codepoints))
+        return int(self.sketches[len(codepoints)].query(key)[0]) if len(key) else 0
+
+    def most_common(self, n: int = 1, k: Optional[int] = None) -> list[tuple[str, int]]:
+        if n == 1:
+            return self.unigrams.most_common(k)
+        keys, estimates = self.heavy_hitters[n]
+        return [
+            (_decode_key(key, n), count)
+            for key, count in zip(keys[:k].tolist(), estimates[:k].tolist())
+        ]
+
+    def length_histogram(
+        self,
+        periods: Optional[Iterable[str]] = None,
+        genres: Optional[Iterable[str]] = None,
+    ) -> pd.Series:
+        histogram = np.zeros(len(LENGTH_BINS), dtype=np.int64)
+        for (period, genre), counts in self.length_histograms.items():
+            if periods is not None and period not in periods:
+                continue
+            if genres is not None and genre not in genres:
+                continue
+            histogram += counts
+        labels = [f"{lo}-{hi - 1}" for lo, hi in zip(LENGTH_BINS, LENGTH_BINS[1:])]
+        labels.append(f"{LENGTH_BINS[-1]}+")
+        return pd.Series(histogram, index=labels)
+
+    # ----------------------------------------------------------------------------------
+    # ------------------------------ Save / Load ---------------------------------------
+    # ----------------------------------------------------------------------------------
+    def save(self, path: str = STATE_DIR):
+        os.makedirs(path, exist_ok=True)
+        arrays = {}
+        for n in NGRAM_SIZES:
+            arrays[f"sketch_{n}"] = self.sketches[n].table
+            arrays[f"heavy_hitter_keys_{n}"] = self.heavy_hitters[n][0]
+            arrays[f"heavy_hitter_counts_{n}"] = self.heavy_hitters[n][1]
+        np.savez_compressed(f"{path}/sketches.npz", **arrays)
+
+        sketch = self.sketches[NGRAM_SIZES[0]]
+        state = {
+            "top_k": self.top_k,
+            "sketch": {
+                "width": sketch.width,
+                "depth": sketch.depth,
+                "seed": sketch.seed,
+            },
+            "unigrams": dict(self.unigrams),
+            "length_bins": LENGTH_BINS,
+            "length_histograms": [
+                {"period": period, "genre": genre, "counts": counts.tolist()}
+                for (period, genre), counts in self.length_histograms.items()
+            ],
+            "seen_ids": sorted(self.seen_ids),
+        }
+        with open(f"{path}/state.json", "w", encoding="utf-8") as outfile:
+            json.dump(state, outfile, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str = STATE_DIR) -> "CorpusStats":
+        with open(f"{path}/state.json", encoding="utf-8") as infile:
+            state = json.load(infile)
+        if state["length_bins"] != LENGTH_BINS:
+            raise ValueError("Saved state uses different length bins")
+
+        stats = cls(top_k=state["top_k"], **state["sketch"])
+        stats.unigrams = Counter(state["unigrams"])
+        for item in state["length_histograms"]:
+            key = (item["period"], item["genre"])
+            stats.length_histograms[key] = np.array(item["counts"], dtype=np.int64)
+        stats.seen_ids = set(state["seen_ids"])
+
+        arrays = np.load(f"{path}/sketches.npz")
+        for n in NGRAM_SIZES:
+            stats.sketches[n].table = arrays[f"sketch_{n}"]
+            stats.heavy_hitters[n] = (
+                arrays[f"heavy_hitter_keys_{n}"],
+                arrays[f"heavy_hitter_counts_{n}"],
+            )
+        return stats
+
+    # ----------------------------------------------------------------------------------
+    # ------------------------------ Report --------------------------------------------
+    # ----------------------------------------------------------------------------------
+    def print_report(self):
+        total = sum(self.unigrams.values())
+        print()
+        print(f"Number of tablets: {len(self.seen_ids)}")
+        print(f"Number of unique glyphs: {len(self.unigrams)}")
+        print(f"Total number of glyphs: {total}")
+        if self.seen_ids:
+            print(f"Average tablet length: {total / len(self.seen_ids):.1f} glyphs")
+        for n in (1, *NGRAM_SIZES):
+            print()
+            print(f"----- TOP {n}-GRAMS -----")
+            for ngram, count in self.most_common(n, 10):
+                print(f" > {ngram} – {count}")
+        print()
+        print("----- TABLET LENGTHS BY PERIOD -----")
+        periods = sorted({period for period, _ in self.length_histograms})
+        print(
+            pd.DataFrame(
+                {period: self.length_histogram(periods=[period]) for period in periods}
+            ).T
+        )
+        print()
+
+
+def _ngram_keys(stream: np.ndarray, is_glyph: np.ndarray, n: int) -> np.ndarray:
+    """Pack every n-gram of consecutive glyphs in the stream into a uint64."""
+    num_ngrams = len(stream) - n + 1
+    if num_ngrams <= 0:
+        return np.zeros(0, dtype=np.uint64)
+    valid = np.ones(num_ngrams, dtype=bool)
+    keys = np.zeros(num_ngrams, dtype=np.uint64)
+    for j in range(n):
+        valid &= is_glyph[j : num_ngrams + j]
+        keys = (keys << np.uint64(CODEPOINT_BITS)) | stream[j : num_ngrams + j]
+    return keys[valid]
+
+
+def _decode_key(key: int, n: int) -> str:
+    mask = (1 << CODEPOINT_BITS) - 1
+    chars = [chr((key >> (CODEPOINT_BITS * j)) & mask) for j in range(n)]
+    return "".join(chars[::-1])
+
+
+if __name__ == "__main__":
+    main()
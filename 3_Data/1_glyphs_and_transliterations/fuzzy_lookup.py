@@ -0,0 +1,117 @@
+"""
+Fuzzy lookup of readings / glyph names, used by `5_add_glyphs.py` as a fallback
+when a morpheme has no exact match in the lookups from step 4.
+
+Keys are first normalized, so that spelling variants compare equal:
+- subscript digits -> digits (du₃ = du3), ₓ -> x
+- ŋ / ĝ -> g
+
+@ modifiers are kept, and a match one edit away must have the same modifiers
+as the query: KALAM@g and KALAM (or KA@g and KA@t) are different signs.
+
+On top of that, a symmetric-deletion index (as in SymSpell) finds keys within
+one edit (insertion, deletion, substitution, or adjacent transposition) of the
+query. Every key is stored under each of its single-character deletions, so a
+lookup only needs a handful of dict hits rather than a scan of the sign list.
+"""
+
+import re
+from collections import defaultdict
+
+SUBSCRIPTS = str.maketrans("₀₁₂₃₄₅₆₇₈₉ₓ", "0123456789x")
+LETTER_VARIANTS = str.maketrans({"ŋ": "g", "Ŋ": "G", "ĝ": "g", "Ĝ": "G"})
+MODIFIER_PATTERN = re.compile(r"@[a-z0-9]+")
+
+# Queries shorter than this (after normalization) are only matched exactly;
+# a single edit on a two-letter reading is usually a different reading.
+MIN_FUZZY_LENGTH = 3
+
+
+def normalize(key: str) -> str:
+    return key.translate(SUBSCRIPTS).translate(LETTER_VARIANTS)
+
+
+class FuzzyIndex:
+    """
+    >>> index = FuzzyIndex({"lugal": ["LUGAL"], "šeš": ["ŠEŠ"], "KA@g": ["KA@g"]})
+    >>> index.lookup("lugl")
+    {'lugal': ['LUGAL']}
+    >>> index.lookup("KA@t")
+    {}
+    """
+
+    def __init__(self, mapping: dict[str, list[str]]):
+        self._mapping = mapping
+        # normalized key -> original keys
+        self._normalized: dict[str, set[str]] = defaultdict(set)
+        # normalized key with one character deleted -> normalized keys
+        self._deletes: dict[str, set[str]] = defaultdict(set)
+
+        for key in mapping:
+            normalized = normalize(key)
+            self._normalized[normalized].add(key)
+            for deleted in _deletes(normalized):
+                self._deletes[deleted].add(normalized)
+
+    def lookup(self, query: str) -> dict[str, list[str]]:
+        """
+        Keys matching the query (with their values), preferring normalized
+        exact matches over matches one edit away. Empty if nothing is close.
+        """
+        normalized = normalize(query)
+        if normalized in self._normalized:
+            return self._values(self._normalized[normalized])
+        if len(normalized) < MIN_FUZZY_LENGTH:
+            return {}
+
+        query_deletes = _deletes(normalized)
+        # key is the query plus one character
+        candidates = set(self._deletes.get(normalized, ()))
+        for deleted in query_deletes:
+            # key is the query minus one character
+            if deleted in self._normalized:
+                candidates.add(deleted)
+            # key and query differ by a substitution (or transposition)
+            candidates |= self._deletes.get(deleted, set())
+
+        modifiers = MODIFIER_PATTERN.findall(normalized)
+        keys = set()
+        for candidate in candidates:
+            if MODIFIER_PATTERN.findall(candidate) != modifiers:
+                continue
+            if _within_one_edit(normalized, candidate):
+                keys |= self._normalized[candidate]
+        return self._values(keys)
+
+    def _values(self, keys: set[str]) -> dict[str, list[str]]:
+        return {key: self._mapping[key] for key in sorted(keys)}
+
+
+def _deletes(key: str) -> set[str]:
+    return {key[:i] + key[i + 1 :] for i in range(len(key))}
+
+
+def _within_one_edit(a: str, b: str) -> bool:
+    if a == b:
+        return True
+    if abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) > len(b):
+        a, b = b, a
+
+    # first position where they differ
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+
+    if len(a) < len(b):  # insertion
+        return a[i:] == b[i + 1 :]
+    if a[i + 1 :] == b[i + 1 :]:  # substitution
+        return True
+    # adjacent transposition
+    return (
+        i + 1 < len(a)
+        and a[i] == b[i + 1]
+        and a[i + 1] == b[i]
+        and a[i + 2 :] == b[i + 2 :]
+    )
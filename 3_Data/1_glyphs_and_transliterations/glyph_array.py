@@ -0,0 +1,143 @@
+"""
+This script exports the glyphs from `./outputs/5_with_glyphs.csv` as
+memory-mappable arrays in `./outputs/glyph_array/`:
+
+- `ids.npy`: every glyph and special token in the corpus, as one contiguous
+  array of vocabulary IDs (tablets back to back, in CSV order)
+- `offsets.npy`: int64 array of length num_tablets + 1;
+  tablet i is `ids[offsets[i]:offsets[i + 1]]`
+- `vocab.json`: list of tokens, indexed by ID (special tokens come first)
+- `tablets.json`: id, period, and genre of each tablet, in the same order
+
+`GlyphArray` is the reader. Loading is a pair of `np.load(..., mmap_mode="r")`
+calls, and indexing a tablet returns a view into the mapped file (no copy).
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+from constants import OUTPUT_DIR
+
+INFILE = f"{OUTPUT_DIR}/5_with_glyphs.csv"
+OUTDIR = f"{OUTPUT_DIR}/glyph_array"
+
+# Multi-character special tokens are swapped for (unused) control characters
+# so that every token in the glyph string is exactly one code point.
+# Their code points are below those of any glyph, so they get the lowest IDs.
+SPECIAL_TOKEN_TO_CHAR = {
+    "<unk>": "\x01",
+    "...": "\x02",
+    "<SURFACE>": "\x03",
+    "<COLUMN>": "\x04",
+    "<BLANK_SPACE>": "\x05",
+    "<RULING>": "\x06",
+    "\n": "\n",
+}
+CHAR_TO_SPECIAL_TOKEN = {v: k for k, v in SPECIAL_TOKEN_TO_CHAR.items()}
+
+
+def main():
+    print(f"Reading {INFILE}...")
+    tablets = {"id": [], "period": [], "genre": []}
+    codepoints = []
+    for chunk in pd.read_csv(
+        INFILE,
+        usecols=["id", "period", "genre", "glyphs"],
+        chunksize=10_000,
+        encoding="utf-8",
+        keep_default_na=False,
+    ):
+        for key in tablets:
+            tablets[key].extend(chunk[key].tolist())
+        codepoints.extend(to_codepoints(glyphs) for glyphs in chunk["glyphs"])
+
+    lengths = np.array([len(c) for c in codepoints], dtype=np.int64)
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    all_codepoints = np.concatenate(codepoints)
+    vocab_codepoints, ids = np.unique(all_codepoints, return_inverse=True)
+    dtype = np.uint16 if len(vocab_codepoints) < 2**16 else np.uint32
+    vocab = [CHAR_TO_SPECIAL_TOKEN.get(chr(c), chr(c)) for c in vocab_codepoints]
+
+    print(f"Tablets: {len(lengths)}")
+    print(f"Tokens: {len(ids)}")
+    print(f"Vocab size: {len(vocab)}")
+
+    os.makedirs(OUTDIR, exist_ok=True)
+    print(f"Writing to {OUTDIR}...")
+    np.save(f"{OUTDIR}/ids.npy", ids.astype(dtype))
+    np.save(f"{OUTDIR}/offsets.npy", offsets)
+    with open(f"{OUTDIR}/vocab.json", "w", encoding="utf-8") as outfile:
+        json.dump(vocab, outfile, ensure_ascii=False)
+    with open(f"{OUTDIR}/tablets.json", "w", encoding="utf-8") as outfile:
+        json.dump(tablets, outfile, ensure_ascii=False)
+    print("Done!")
+
+
+def to_codepoints(glyphs: str) -> np.ndarray:
+    """
+    Convert a glyph string (as in the `glyphs` column) to an array of code points,
+    one per glyph or special token.
+    """
+    for token, char in SPECIAL_TOKEN_TO_CHAR.items():
+        glyphs = glyphs.replace(token, char)
+    glyphs = glyphs.replace(" ", "")
+    return np.frombuffer(glyphs.encode("utf-32-le"), dtype=np.uint32)
+
+
+# --------------------------------------------------------------------------------------
+# ------------------------------- Reader -----------------------------------------------
+# --------------------------------------------------------------------------------------
+class GlyphArray:
+    """
+    Read-only view of the exported glyph corpus.
+
+    >>> corpus = GlyphArray()
+    >>> corpus[0]                 # IDs of the first tablet (a memmap view)
+    >>> corpus.get("P100001")     # IDs of a tablet by its id
+    >>> corpus.decode(corpus[0])  # back to the glyph string
+    """
+
+    def __init__(self, path: str = OUTDIR):
+        self.ids = np.load(f"{path}/ids.npy", mmap_mode="r")
+        self.offsets = np.load(f"{path}/offsets.npy", mmap_mode="r")
+        with open(f"{path}/vocab.json", encoding="utf-8") as infile:
+            self.vocab: list[str] = json.load(infile)
+        with open(f"{path}/tablets.json", encoding="utf-8") as infile:
+            self.tablets: dict[str, list[str]] = json.load(infile)
+
+        self.token_to_id = {token: i for i, token in enumerate(self.vocab)}
+        self.special_token_ids = {
+            self.token_to_id[token]
+            for token in SPECIAL_TOKEN_TO_CHAR
+            if token in self.token_to_id
+        }
+        self._tablet_id_to_idx = {id: i for i, id in enumerate(self.tablets["id"])}
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        return self.ids[self.offsets[idx] : self.offsets[idx + 1]]
+
+    def get(self, tablet_id: str) -> np.ndarray:
+        return self[self._tablet_id_to_idx[tablet_id]]
+
+    def lengths(self) -> np.ndarray:
+        return np.diff(self.offsets)
+
+    def encode(self, glyphs: str) -> np.ndarray:
+        tokens = [
+            CHAR_TO_SPECIAL_TOKEN.get(chr(c), chr(c)) for c in to_codepoints(glyphs)
+        ]
+        return np.array([self.token_to_id[t] for t in tokens], dtype=self.ids.dtype)
+
+    def decode(self, ids: np.ndarray) -> str:
+        return "".join(self.vocab[i] for i in ids)
+
+
+if __name__ == "__main__":
+    main()
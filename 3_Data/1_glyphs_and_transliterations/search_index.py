@@ -0,0 +1,410 @@
+"""
+Inverted n-gram index over the token table written by step 5
+(`./outputs/5_tokens.parquet`), for finding the tablets/lines that contain
+a sequence of glyphs or readings.
+
+For each field (`glyph`, `morpheme`) and each n in 1..MAX_N, every n-gram is
+mapped to the sorted positions (tablet, line, position in line) where it starts.
+Positions are packed into a single integer
+    tablet_idx << 32 | line_no << 16 | position
+delta-encoded per term, varint-compressed, and stored in one `postings.npy`
+array that is memory-mapped on load.
+
+The index is a list of segments in `./outputs/search_index/seg_#####/`.
+`build` writes a segment for the tablets that are not yet indexed, so re-running
+it after tablets are added only indexes the new ones; `build --rebuild` starts over.
+
+Query syntax: tokens separated by spaces, where
+- `*` matches exactly one token
+- `**` matches any number of tokens (within the same line)
+
+e.g.
+    poetry run python search_index.py build
+    poetry run python search_index.py query "lugal * ki" --field morpheme
+    poetry run python search_index.py query "𒀭 𒂗" --period "Ur III"
+"""
+
+import argparse
+import json
+import os
+import shutil
+import time
+from typing import NamedTuple, Optional
+
+import numpy as np
+import pandas as pd
+from constants import OUTPUT_DIR
+
+INFILE = f"{OUTPUT_DIR}/5_tokens.parquet"
+INDEX_DIR = f"{OUTPUT_DIR}/search_index"
+
+FIELDS = ("glyph", "morpheme")
+MAX_N = 2
+
+WILDCARD = "*"
+GAP = "**"
+
+NEWLINE = "\n"
+
+
+class Hit(NamedTuple):
+    tablet_id: str
+    line_no: int
+    position: int
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the n-gram index.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Index tablets not yet indexed")
+    build_parser.add_argument("--rebuild", action="store_true")
+
+    query_parser = subparsers.add_parser("query", help="Search the index")
+    query_parser.add_argument("pattern", type=str)
+    query_parser.add_argument("--field", choices=FIELDS, default="glyph")
+    query_parser.add_argument("--period", action="append")
+    query_parser.add_argument("--genre", action="append")
+    query_parser.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build(rebuild=args.rebuild)
+        return
+
+    index = SearchIndex()
+    start = time.perf_counter()
+    hits = index.search(
+        args.pattern, field=args.field, periods=args.period, genres=args.genre
+    )
+    elapsed = (time.perf_counter() - start) * 1000
+    for hit in hits[: args.limit]:
+        print(f" > {hit.tablet_id} line {hit.line_no} pos {hit.position}")
+    print(f"Total: {len(hits)} ({elapsed:.1f} ms)")
+
+
+# --------------------------------------------------------------------------------------
+# ------------------------------- Build ------------------------------------------------
+# --------------------------------------------------------------------------------------
+def build(infile: str = INFILE, index_dir: str = INDEX_DIR, rebuild: bool = False):
+    if rebuild and os.path.isdir(index_dir):
+        print(f"Removing {index_dir}...")
+        shutil.rmtree(index_dir)
+    os.makedirs(index_dir, exist_ok=True)
+
+    print(f"Reading {infile}...")
+    columns = ["tablet_id", "period", "genre", "line_no", *FIELDS]
+    df = pd.read_parquet(infile, columns=columns)
+
+    indexed = set()
+    for segment_dir in _segment_dirs(index_dir):
+        with open(f"{segment_dir}/tablets.json", encoding="utf-8") as infile_:
+            indexed.update(json.load(infile_)["id"])
+    df = df[~df["tablet_id"].isin(indexed)]
+    if df.empty:
+        print("Nothing new to index.")
+        return
+
+    segment_dir = f"{index_dir}/seg_{len(_segment_dirs(index_dir)):05d}"
+    print(f"Indexing {df['tablet_id'].nunique()} tablets into {segment_dir}...")
+    _write_segment(df, segment_dir)
+    print("Done!")
+
+
+def _write_segment(df: pd.DataFrame, segment_dir: str):
+    df = df[df["morpheme"] != NEWLINE]
+
+    tablet_idx, _ = pd.factorize(df["tablet_id"].astype(str))
+    tablet_idx = tablet_idx.astype(np.uint64)
+    line_no = df["line_no"].to_numpy(np.uint64)
+    position = df.groupby([tablet_idx, line_no]).cumcount().to_numpy(np.uint64)
+    if line_no.max(initial=0) >= 2**16 or position.max(initial=0) >= 2**16:
+        raise ValueError("Lines and positions must fit in 16 bits")
+    line_keys = (tablet_idx << 32) | (line_no << 16)
+    keys = line_keys | position
+
+    tablets = (
+        df.drop_duplicates("tablet_id")[["tablet_id", "period", "genre"]]
+        .astype(str)
+        .rename(columns={"tablet_id": "id"})
+    )
+
+    terms: dict[str, int] = {}
+    term_keys: list[np.ndarray] = []
+    term_counts: list[np.ndarray] = []
+    for field in FIELDS:
+        codes, vocab = pd.factorize(df[field].astype(str))
+        codes = codes.astype(np.int64)
+        for n in range(1, MAX_N + 1):
+            if len(codes) < n:
+                continue
+            # n-grams may not cross line boundaries
+            num_ngrams = len(codes) - n + 1
+            valid = line_keys[:num_ngrams] == line_keys[n - 1 :]
+            term_ints = np.zeros(valid.sum(), dtype=np.int64)
+            for j in range(n):
+                term_ints = term_ints * len(vocab) + codes[j : num_ngrams + j][valid]
+            ngram_keys = keys[:num_ngrams][valid]
+
+            unique, inverse = np.unique(term_ints, return_inverse=True)
+            order = np.lexsort((ngram_keys, inverse))
+            term_keys.append(ngram_keys[order])
+            term_counts.append(np.bincount(inverse, minlength=len(unique)))
+
+            for term_int in unique.tolist():
+                tokens = []
+                for _ in range(n):
+                    term_int, code = divmod(term_int, len(vocab))
+                    tokens.append(vocab[code])
+                terms[_term(field, tokens[::-1])] = len(terms)
+
+    keys = np.concatenate(term_keys)
+    counts = np.concatenate(term_counts)
+    starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+
+    # Delta-encode within each term; the first posting of a term is absolute
+    deltas = keys.copy()
+    deltas[1:] -= keys[:-1]
+    deltas[starts] = keys[starts]
+    postings, value_offsets = _varint_encode(deltas)
+    byte_offsets = np.append(value_offsets[starts], len(postings))
+
+    line_keys, line_lengths = np.unique(line_keys, return_counts=True)
+
+    os.makedirs(segment_dir, exist_ok=True)
+    np.save(f"{segment_dir}/postings.npy", postings)
+    np.save(f"{segment_dir}/offsets.npy", byte_offsets)
+    np.save(f"{segment_dir}/lines.npy", line_keys)
+    np.save(f"{segment_dir}/line_lengths.npy", line_lengths.astype(np.uint32))
+    with open(f"{segment_dir}/terms.json", "w", encoding="utf-8") as outfile:
+        json.dump(terms, outfile, ensure_ascii=False)
+    with open(f"{segment_dir}/tablets.json", "w", encoding="utf-8") as outfile:
+        json.dump(tablets.to_dict(orient="list"), outfile, ensure_ascii=False)
+    print(f"Terms: {len(terms)}, postings: {len(keys)} ({len(postings)} bytes)")
+
+
+def _term(field: str, tokens: list[str]) -> str:
+    return f"{field}:{' '.join(tokens)}"
+
+
+def _segment_dirs(index_dir: str) -> list[str]:
+    if not os.path.isdir(index_dir):
+        return []
+    return sorted(
+        f"{index_dir}/{name}"
+        for name in os.listdir(index_dir)
+        if name.startswith("seg_")
+    )
+
+
+# --------------------------------------------------------------------------------------
+# ------------------------------- Varints ----------------------------------------------
+# --------------------------------------------------------------------------------------
+def _varint_encode(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    LEB128-encode an array of uint64s.
+    Returns the bytes and the offset at which each value starts.
+    """
+    values = values.astype(np.uint64)
+    num_bytes = np.ones(len(values), dtype=np.int64)
+    for k in range(1, 10):
+        num_bytes += values >= np.uint64(1 << (7 * k))
+    offsets = np.zeros(len(values), dtype=np.int64)
+    np.cumsum(num_bytes[:-1], out=offsets[1:])
+
+    out = np.empty(num_bytes.sum(), dtype=np.uint8)
+    for j in range(int(num_bytes.max(initial=0))):
+        mask = num_bytes > j
+        chunk = (values[mask] >> np.uint64(7 * j)) & np.uint64(0x7F)
+        more = (num_bytes[mask] > j + 1).astype(np.uint64) << np.uint64(7)
+        out[offsets[mask] + j] = chunk | more
+    return out, offsets
+
+
+def _varint_decode(buf: np.ndarray) -> np.ndarray:
+    if len(buf) == 0:
+        return np.zeros(0, dtype=np.uint64)
+    ends = np.flatnonzero((buf & 0x80) == 0)
+    starts = np.zeros(len(ends), dtype=np.int64)
+    starts[1:] = ends[:-1] + 1
+    group = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = (7 * (np.arange(len(buf)) - starts[group])).astype(np.uint64)
+    parts = (buf & 0x7F).astype(np.uint64) << shifts
+    return np.add.reduceat(parts, starts)
+
+
+# --------------------------------------------------------------------------------------
+# ------------------------------- Query ------------------------------------------------
+# --------------------------------------------------------------------------------------
+class _Segment:
+    def __init__(self, segment_dir: str):
+        self.postings = np.load(f"{segment_dir}/postings.npy", mmap_mode="r")
+        self.offsets = np.load(f"{segment_dir}/offsets.npy", mmap_mode="r")
+        self.lines = np.load(f"{segment_dir}/lines.npy", mmap_mode="r")
+        self.line_lengths = np.load(f"{segment_dir}/line_lengths.npy", mmap_mode="r")
+        with open(f"{segment_dir}/terms.json", encoding="utf-8") as infile:
+            self.terms: dict[str, int] = json.load(infile)
+        with open(f"{segment_dir}/tablets.json", encoding="utf-8") as infile:
+            tablets = json.load(infile)
+        self.tablet_ids: list[str] = tablets["id"]
+        self.periods = np.array(tablets["period"], dtype=object)
+        self.genres = np.array(tablets["genre"], dtype=object)
+
+    def keys(self, term: str) -> np.ndarray:
+        if term not in self.terms:
+            return np.zeros(0, dtype=np.uint64)
+        idx = self.terms[term]
+        buf = self.postings[self.offsets[idx] : self.offsets[idx + 1]]
+        return np.cumsum(_varint_decode(buf), dtype=np.uint64)
+
+    def line_length(self, keys: np.ndarray) -> np.ndarray:
+        line_keys = keys >> np.uint64(16) << np.uint64(16)
+        return self.line_lengths[np.searchsorted(self.lines, line_keys)]
+
+
+class SearchIndex:
+    """
+    >>> index = SearchIndex()
+    >>> index.search("lugal * ki", field="morpheme", periods=["Ur III"])
+    [Hit(tablet_id='P100001', line_no=3, position=0), ...]
+    """
+
+    def __init__(self, index_dir: str = INDEX_DIR):
+        self.segments = [_Segment(d) for d in _segment_dirs(index_dir)]
+        if not self.segments:
+            raise FileNotFoundError(f"No index in {index_dir}; run `build` first")
+
+    def search(
+        self,
+        pattern: str,
+        *,
+        field: str = "glyph",
+        periods: Optional[list[str]] = None,
+        genres: Optional[list[str]] = None,
+    ) -> list[Hit]:
+        if field not in FIELDS:
+            raise ValueError(f"field must be one of {FIELDS}")
+        parts = _parse(pattern)
+
+        hits = []
+        for segment in self.segments:
+            allowed = np.ones(len(segment.tablet_ids), dtype=bool)
+            if periods:
+                allowed &= np.isin(segment.periods, periods)
+            if genres:
+                allowed &= np.isin(segment.genres, genres)
+            if not allowed.any():
+                continue
+
+            starts = _match_with_gaps(segment, field, parts, allowed)
+            tablet_idx = (starts >> np.uint64(32)).tolist()
+            line_no = ((starts >> np.uint64(16)) & np.uint64(0xFFFF)).tolist()
+            position = (starts & np.uint64(0xFFFF)).tolist()
+            hits.extend(
+                Hit(segment.tablet_ids[t], l, p)
+                for t, l, p in zip(tablet_idx, line_no, position)
+            )
+        return hits
+
+    def count_tablets(self, pattern: str, **kwargs) -> int:
+        return len({hit.tablet_id for hit in self.search(pattern, **kwargs)})
+
+
+def _parse(pattern: str) -> list[list[Optional[str]]]:
+    """
+    Split a pattern on `**` into phrases, where each phrase is a list of tokens
+    and None stands for a single-token wildcard.
+    """
+    phrases: list[list[Optional[str]]] = [[]]
+    for token in pattern.split():
+        if token == GAP:
+            phrases.append([])
+        else:
+            phrases[-1].append(None if token == WILDCARD else token)
+    phrases = [phrase for phrase in phrases if phrase]
+    if not phrases or any(all(t is None for t in phrase) for phrase in phrases):
+        raise ValueError(f"Pattern needs at least one token per phrase: {pattern!r}")
+    return phrases
+
+
+def _match_with_gaps(
+    segment: _Segment,
+    field: str,
+    phrases: list[list[Optional[str]]],
+    allowed: np.ndarray,
+) -> np.ndarray:
+    """
+    Start positions of the first phrase such that each following phrase starts,
+    on the same line, after the previous one ends.
+    """
+    starts = _match_phrase(segment, field, phrases[0], allowed)
+    ends = starts + np.uint64(len(phrases[0]))
+    for phrase in phrases[1:]:
+        next_starts = _match_phrase(segment, field, phrase, allowed)
+        idx = np.searchsorted(next_starts, ends)
+        found = idx < len(next_starts)
+        idx = np.minimum(idx, max(len(next_starts) - 1, 0))
+        if len(next_starts):
+            same_line = (next_starts[idx] >> np.uint64(16)) == (ends >> np.uint64(16))
+            found &= same_line
+        starts = starts[found]
+        ends = next_starts[idx[found]] + np.uint64(len(phrase))
+    return starts
+
+
+def _match_phrase(
+    segment: _Segment,
+    field: str,
+    phrase: list[Optional[str]],
+    allowed: np.ndarray,
+) -> np.ndarray:
+    """
+    Sorted start keys of a phrase, by intersecting the postings of the n-grams
+    that cover its tokens (shifted back to the start of the phrase).
+    """
+    starts: Optional[np.ndarray] = None
+    for offset, tokens in _cover(phrase):
+        keys = segment.keys(_term(field, tokens))
+        keys = keys[(keys & np.uint64(0xFFFF)) >= offset] - np.uint64(offset)
+        if starts is None:
+            keys = keys[allowed[(keys >> np.uint64(32)).astype(np.int64)]]
+            starts = keys
+        else:
+            starts = np.intersect1d(starts, keys, assume_unique=True)
+        if len(starts) == 0:
+            break
+    assert starts is not None
+
+    # Trailing wildcards must still fall within the line
+    if phrase[-1] is None and len(starts):
+        position = starts & np.uint64(0xFFFF)
+        starts = starts[position + len(phrase) <= segment.line_length(starts)]
+    return starts
+
+
+def _cover(phrase: list[Optional[str]]) -> list[tuple[int, list[str]]]:
+    """
+    (offset, n-gram) pairs covering every non-wildcard token of the phrase,
+    using the longest indexed n-grams.
+    """
+    cover = []
+    i = 0
+    while i < len(phrase):
+        if phrase[i] is None:
+            i += 1
+            continue
+        run_end = i
+        while run_end < len(phrase) and phrase[run_end] is not None:
+            run_end += 1
+        n = min(MAX_N, run_end - i)
+        for j in range(i, run_end - n + 1, n):
+            cover.append((j, phrase[j : j + n]))
+        if (run_end - i) % n:
+            cover.append((run_end - n, phrase[run_end - n : run_end]))
+        i = run_end
+    return cover
+
+
+if __name__ == "__main__":
+    main()
@@ -1,79 +1,92 @@
-import pandas as pd
-
-
-def read_cdli_csv():
-    artifacts = pd.read_csv(
-        "artifacts.csv", dtype={"artifact_id": "Int64"}, na_values=[""]
-    )
-    assets = pd.read_csv("assets.csv", dtype={"artifact_id": "Int64"}, na_values=[""])
-
-    # Drop rows with NA values in the 'artifact_id' column
-    artifacts.dropna(subset=["artifact_id"], inplace=True)
-    assets.dropna(subset=["artifact_id"], inplace=True)
-
-    df = pd.merge(artifacts, assets, on="artifact_id", how="inner")
-    df = df[df["file_format"] == "jpg"]
-    df = df[
-        [
-            "artifact_id",
-            "asset_type",
-            "path",
-            "artifact_type",
-        ]
-    ]
-    df["id"] = df["path"].str.extract(r"/([A-Z]\d+)[_\.]", expand=False)
-    df.rename(columns={"asset_type": "image_type"}, inplace=True)
-    df["path"] = df["path"].str.split("/").str[-1]
-    # df["path"] = "https://sux-photos.s3.us-west-002.backblazeb2.com/" + df["path"]
-    df.rename(columns={"path": "image"}, inplace=True)
-    return df
+"""
+Joins the train/test/validation splits from `1_glyphs_and_transliterations`
+with the CDLI photo catalogue (see `cdli_catalogue.py`), and writes, for each
+split, `{split}.csv` and one `{split}_{image_type}.csv` per image type:
 
+    id | glyphs | image | (image_type) | period | genre
 
-cdli_df = read_cdli_csv()
+The catalogue is imported from `artifacts.csv` and `assets.csv` the first time;
+pass `--refresh` after downloading a newer CDLI dump to update it.
 
+Photos listed as duplicates in `dedup_manifest.csv` (see `5_dedup_photos.py`)
+are never downloaded or uploaded, so rows naming one are pointed at its
+canonical photo instead (and dropped if that tablet already has it).
+"""
 
-def join_and_save(split):
-    # dest_path = f"./outputs/{split}/{image_type}"
-    # if not os.path.exists(dest_path):
-    # os.makedirs(dest_path)
+import argparse
+import os
 
-    glyphs_and_translits_df = pd.read_csv(
-        f"../1_glyphs_and_transliterations/outputs/{split}.csv",
-        low_memory=False,
+import pandas as pd
+from cdli_catalogue import (
+    ARTIFACTS_CSV,
+    ASSETS_CSV,
+    CATALOGUE_FILE,
+    import_catalogue,
+    load_catalogue,
+)
+from phash_index import DEDUP_MANIFEST, load_canonicals
+
+SPLITS_DIR = "../1_glyphs_and_transliterations/outputs"
+SPLITS = ["train", "test", "validation"]
+SPLIT_COLUMNS = ["id", "glyphs", "period", "genre"]
+OUTPUT_COLUMNS = ["id", "glyphs", "image", "image_type", "period", "genre"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Join the splits with CDLI photos.")
+    parser.add_argument("--splits-dir", type=str, default=SPLITS_DIR)
+    parser.add_argument("--artifacts", type=str, default=ARTIFACTS_CSV)
+    parser.add_argument("--assets", type=str, default=ASSETS_CSV)
+    parser.add_argument("--catalogue", type=str, default=CATALOGUE_FILE)
+    parser.add_argument("--dedup-manifest", type=str, default=DEDUP_MANIFEST)
+    parser.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Re-import the catalogue if the dump has changed",
     )
+    args = parser.parse_args()
 
-    # cdli_df_filtered = cdli_df[cdli_df["image_type"] == image_type]
+    if args.refresh or not os.path.isfile(args.catalogue):
+        catalogue = import_catalogue(args.artifacts, args.assets, args.catalogue)
+    else:
+        catalogue = load_catalogue(args.catalogue)
 
-    joined_df = pd.merge(glyphs_and_translits_df, cdli_df, on="id", how="inner")
-    joined_df = joined_df[
+    splits = pd.concat(
         [
-            "id",
-            "glyphs",
-            "image",
-            "image_type",
-            "period",
-            "genre",
-        ]
-    ]
-    joined_df.to_csv(f"{split}.csv", index=False, encoding="utf-8")
-
-    for image_type in joined_df["image_type"].unique():
-        image_type_df = joined_df[joined_df["image_type"] == image_type]
-        image_type_df.drop(columns=["image_type"], inplace=True)
-        image_type_df.to_csv(f"{split}_{image_type}.csv", index=False, encoding="utf-8")
-
-    # for index, row in joined_df.iterrows():
-    # filename = row["file_name"]
-    # img_src_path = f"./photos/{filename}"
-    # img_dst_path = f"{dest_path}/{filename}"
-    # shutil.copy(img_src_path, img_dst_path)
-    # print(f"Copied {img_src_path} to {img_dst_path}")
-
-    # joined_df.to_csv(f"{dest_path}/metadata.csv", index=False)
-    # all_df = pd.concat([all_df, joined_df]) if all_df else joined_df
-    # all_df.to_csv("metadata.csv", index=False)
-
-
-join_and_save("train")
-join_and_save("test")
-join_and_save("validation")
+            pd.read_csv(
+                os.path.join(args.splits_dir, f"{split}.csv"),
+                usecols=SPLIT_COLUMNS,
+                dtype={"period": "category", "genre": "category"},
+            ).assign(split=split)
+            for split in SPLITS
+        ],
+        ignore_index=True,
+    )
+    joined = splits.join(catalogue[["image", "image_type"]], on="id", how="inner")
+
+    canonicals = load_canonicals(args.dedup_manifest)
+    if canonicals:
+        is_duplicate = joined["image"].isin(canonicals.keys())
+        joined.loc[is_duplicate, "image"] = joined.loc[is_duplicate, "image"].map(
+            canonicals
+        )
+        num_rows = len(joined)
+        joined = joined.drop_duplicates(subset=["split", "id", "image"])
+        print(
+            f"Pointed {is_duplicate.sum()} duplicate photos at their canonical "
+            f"photo ({num_rows - len(joined)} rows dropped as repeats)"
+        )
+
+    for split, split_df in joined.groupby("split", sort=False, observed=True):
+        split_df[OUTPUT_COLUMNS].to_csv(f"{split}.csv", index=False, encoding="utf-8")
+        for image_type, image_type_df in split_df.groupby(
+            "image_type", sort=False, observed=True
+        ):
+            image_type_df[OUTPUT_COLUMNS].drop(columns=["image_type"]).to_csv(
+                f"{split}_{image_type}.csv", index=False, encoding="utf-8"
+            )
+        print(f"{split}: {len(split_df)} photos")
+
+
+if __name__ == "__main__":
+    main()
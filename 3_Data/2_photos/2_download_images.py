@@ -1,29 +1,286 @@
+"""
+Downloads the CDLI photos listed in `translits_and_photos.csv` to `photos/`.
+
+- Downloads run in a thread pool over a shared, pooled `requests.Session`,
+  with a cap on concurrent requests and requests/second per host.
+- Failed requests (connection errors, 429, 5xx) are retried with exponential
+  backoff and jitter, honouring `Retry-After`.
+- Each file is written to `{name}.part` and renamed once complete, and then
+  recorded in `photos/manifest.jsonl`. A file only counts as downloaded if it
+  is in the manifest (with a matching size), so an interrupted run is resumed
+  rather than leaving truncated JPEGs behind. A manifest line cut short by a
+  killed run is truncated away on the next start.
+- URLs with the same file name are only downloaded once (the first).
+
+The URL prefix is configurable so that the script can be pointed at a local
+server, e.g. `python -m http.server` serving a directory of test images:
+
+    poetry run python 2_download_images.py --prefix http://localhost:8000/
+
+Photos listed as duplicates in `dedup_manifest.csv` (see `5_dedup_photos.py`)
+are not downloaded again.
+"""
+
+import argparse
+import json
 import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
+from urllib.parse import urlparse
 
 import pandas as pd
 import requests
+from phash_index import DEDUP_MANIFEST, load_duplicates
+from requests.adapters import HTTPAdapter
+from tqdm import tqdm
+
+CSV_FILE = "translits_and_photos.csv"
+PREFIX = "https://cdli.mpiwg-berlin.mpg.de/"
+OUTPUT_DIR = "photos/"
+MANIFEST = "manifest.jsonl"
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class IncompleteRead(IOError):
+    pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Download CDLI photos.")
+    parser.add_argument("--csv", type=str, default=CSV_FILE)
+    parser.add_argument("--prefix", type=str, default=PREFIX)
+    parser.add_argument("--output-dir", type=str, default=OUTPUT_DIR)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument(
+        "--per-host", type=int, default=8, help="Max concurrent requests per host"
+    )
+    parser.add_argument(
+        "--rate", type=float, default=10.0, help="Max requests/second per host"
+    )
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--dedup-manifest", type=str, default=DEDUP_MANIFEST)
+    args = parser.parse_args()
+
+    df = pd.read_csv(args.csv)
+    df = df.sample(frac=1).reset_index(drop=True)
+
+    duplicates = load_duplicates(args.dedup_manifest)
+    if duplicates:
+        is_duplicate = df["path"].map(lambda path: _filename(path) in duplicates)
+        print(f"Skipping {is_duplicate.sum()} duplicate photos")
+        df = df[~is_duplicate]
+
+    downloader = Downloader(
+        output_dir=args.output_dir,
+        workers=args.workers,
+        per_host=args.per_host,
+        rate=args.rate,
+        retries=args.retries,
+        timeout=args.timeout,
+    )
+    downloader.download_all([args.prefix + path for path in df["path"]])
+
+
+class RateLimiter:
+    """Token bucket: at most `rate` acquisitions per second, bursts of `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.capacity = burst
+        self.tokens = float(burst)
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.last) * self.rate
+                )
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class _Host:
+    def __init__(self, per_host: int, rate: float):
+        self.semaphore = threading.BoundedSemaphore(per_host)
+        self.rate_limiter = RateLimiter(rate, burst=per_host)
+
+
+class Downloader:
+    def __init__(
+        self,
+        *,
+        output_dir: str = OUTPUT_DIR,
+        workers: int = 16,
+        per_host: int = 8,
+        rate: float = 10.0,
+        retries: int = 5,
+        timeout: float = 60.0,
+    ):
+        self.output_dir = output_dir
+        self.workers = workers
+        self.per_host = per_host
+        self.rate = rate
+        self.retries = retries
+        self.timeout = timeout
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
 
-csv_file = "translits_and_photos.csv"
-prefix = "https://cdli.mpiwg-berlin.mpg.de/"
-output_dir = "photos/"
-os.makedirs(output_dir, exist_ok=True)
-
-df = pd.read_csv(csv_file)
-df = df.sample(frac=1).reset_index(drop=True)
-
-for _, row in df.iterrows():
-    image_path = row["path"]
-    image_url = prefix + image_path
-    image_filename = os.path.basename(image_path)
-    output_file = os.path.join(output_dir, image_filename)
-    if os.path.exists(output_file):
-        print(f"Skipping {image_filename} (already downloaded)")
-        continue
+        self._hosts: dict[str, _Host] = {}
+        self._hosts_lock = threading.Lock()
+        self._manifest_lock = threading.Lock()
+
+        os.makedirs(output_dir, exist_ok=True)
+        self.manifest_path = os.path.join(output_dir, MANIFEST)
+        self.manifest = _load_manifest(self.manifest_path)
+
+    def download_all(self, urls: list[str]):
+        # One URL per file name, so no two downloads share a `.part` file
+        by_filename = {}
+        for url in urls:
+            by_filename.setdefault(_filename(url), url)
+        num_duplicates = len(set(urls)) - len(by_filename)
+        if num_duplicates:
+            print(f"Skipping {num_duplicates} URLs with the same file name as another")
+        pending = [url for url in by_filename.values() if not self.is_downloaded(url)]
+        num_done = len(by_filename) - len(pending)
+        print(f"{num_done} already downloaded, {len(pending)} to go")
+
+        failed = []
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.download, url): url for url in pending}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                url = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    failed.append(url)
+                    tqdm.write(f"Error downloading {url}: {e}")
+
+        if failed:
+            print(f"Failed to download {len(failed)} files (re-run to retry)")
+
+    def is_downloaded(self, url: str) -> bool:
+        filename = _filename(url)
+        entry = self.manifest.get(filename)
+        if entry is None:
+            return False
+        path = os.path.join(self.output_dir, filename)
+        return os.path.isfile(path) and os.path.getsize(path) == entry["size"]
+
+    def download(self, url: str):
+        filename = _filename(url)
+        content = self._get(url)
+
+        path = os.path.join(self.output_dir, filename)
+        tmp_path = f"{path}.part"
+        with open(tmp_path, "wb") as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+
+        self._record(filename, url=url, size=len(content))
+
+    def _get(self, url: str) -> bytes:
+        host = self._host(urlparse(url).netloc)
+        for attempt in range(self.retries + 1):
+            retry_after: Optional[float] = None
+            with host.semaphore:
+                host.rate_limiter.acquire()
+                try:
+                    response = self.session.get(url, timeout=self.timeout)
+                    if response.status_code not in RETRY_STATUS_CODES:
+                        response.raise_for_status()
+                        _check_length(response)
+                        return response.content
+                except (requests.ConnectionError, requests.Timeout, IncompleteRead):
+                    if attempt == self.retries:
+                        raise
+                else:
+                    if attempt == self.retries:
+                        response.raise_for_status()
+                    retry_after = _retry_after(response)
+            time.sleep(retry_after or _backoff(attempt))
+        raise RuntimeError("unreachable")
+
+    def _host(self, netloc: str) -> _Host:
+        with self._hosts_lock:
+            if netloc not in self._hosts:
+                self._hosts[netloc] = _Host(self.per_host, self.rate)
+            return self._hosts[netloc]
+
+    def _record(self, filename: str, **entry):
+        with self._manifest_lock:
+            self.manifest[filename] = entry
+            with open(self.manifest_path, "a", encoding="utf-8") as outfile:
+                outfile.write(json.dumps({"image": filename, **entry}) + "\n")
+
+
+def _load_manifest(path: str) -> dict[str, dict]:
+    """
+    Read the manifest, truncating a partially written last line (from a
+    killed run) so that the next record isn't appended onto it.
+    """
+    manifest = {}
+    if not os.path.isfile(path):
+        return manifest
+    offset = 0
+    with open(path, "rb") as infile:
+        for line in infile:
+            if not line.endswith(b"\n"):
+                break  # partially written last line
+            offset += len(line)
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            manifest[entry.pop("image")] = entry
+    if offset != os.path.getsize(path):
+        print(f"Truncating {path} at byte {offset} (partial write)")
+        with open(path, "r+b") as outfile:
+            outfile.truncate(offset)
+    return manifest
+
+
+def _filename(url: str) -> str:
+    return os.path.basename(urlparse(url).path)
+
+
+def _check_length(response: requests.Response):
+    # Content-Length is the encoded size, so only compare unencoded responses
+    if response.headers.get("Content-Encoding"):
+        return
+    expected = response.headers.get("Content-Length")
+    if expected is not None and int(expected) != len(response.content):
+        raise IncompleteRead(f"Expected {expected} bytes, got {len(response.content)}")
+
+
+def _retry_after(response: requests.Response) -> Optional[float]:
+    value = response.headers.get("Retry-After")
     try:
-        response = requests.get(image_url)
-        with open(output_file, "wb") as file:
-            file.write(response.content)
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def _backoff(attempt: int, base: float = 1.0, cap: float = 60.0) -> float:
+    return random.uniform(0, min(cap, base * 2**attempt))
+
 
-        print(f"Downloaded {image_filename}")
-    except Exception as e:
-        print(f"Error downloading {image_filename}: {str(e)}")
+if __name__ == "__main__":
+    main()
@@ -1,68 +1,192 @@
+"""
+Uploads a local directory (e.g. `photos/`) to a Backblaze B2 bucket,
+or to another directory with `--local` (a stand-in for B2 when testing).
+
+- What's already uploaded comes from a locally cached manifest of the bucket
+  (`.manifest_{bucket}.json`), built by listing the bucket once;
+  `--refresh-manifest` lists it again.
+- A file is skipped only if the remote copy has the same size and SHA-1,
+  so files that changed locally are uploaded again.
+  Local SHA-1s are cached by (size, mtime) in `.sha1_cache.json`.
+- Uploads run in a bounded thread pool; b2sdk splits large files into parts.
+- Photos listed as duplicates in `dedup_manifest.csv` (see `5_dedup_photos.py`)
+  are not uploaded; only the canonical copy is.
+"""
+
 import argparse
+import json
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Optional
 
-from b2sdk.v2 import B2Api, InMemoryAccountInfo
+from phash_index import DEDUP_MANIFEST, load_duplicates
+from storage import B2Backend, LocalBackend, RemoteManifest, StorageBackend, sha1_file
+from tqdm import tqdm
 
+SHA1_CACHE = ".sha1_cache.json"
+SKIP_FILES = {"manifest.jsonl"}
 
-def upload_directory_to_b2(
-    local_dir, bucket_name, b2_application_key_id, b2_application_key
-):
-    # Set up Backblaze B2 credentials and API
-    info = InMemoryAccountInfo()
-    b2_api = B2Api(info)
-    b2_api.authorize_account("production", b2_application_key_id, b2_application_key)
 
-    # Get the bucket
-    bucket = b2_api.get_bucket_by_name(bucket_name)
+def upload_directory(
+    local_dir: str,
+    backend: StorageBackend,
+    manifest: RemoteManifest,
+    workers: int = 8,
+    refresh_manifest: bool = False,
+    skip: Optional[set[str]] = None,
+):
+    if refresh_manifest or not manifest.exists():
+        manifest.refresh(backend)
 
-    # Retrieve all files currently in the bucket to avoid re-uploading existing files
-    existing_files = set()
-    for file_version, _ in bucket.ls():
-        existing_files.add(file_version.file_name)
+    sha1_cache = _Sha1Cache(os.path.join(local_dir, SHA1_CACHE))
 
-    # Upload files
-    for root, dirs, files in os.walk(local_dir):
+    local_files = []
+    for root, _, files in os.walk(local_dir):
         for filename in files:
+            if filename in SKIP_FILES or filename.startswith("."):
+                continue
+            if filename.endswith(".part") or filename in (skip or ()):
+                continue
             local_file_path = os.path.join(root, filename)
-            b2_file_path = os.path.relpath(
-                local_file_path, start=local_dir
-            )  # Maintains directory structure
+            # Maintains directory structure
+            remote_name = os.path.relpath(local_file_path, start=local_dir)
+            local_files.append((local_file_path, remote_name))
+
+    def _upload_if_changed(local_file_path: str, remote_name: str) -> bool:
+        sha1 = sha1_cache.get(local_file_path)
+        remote = manifest.get(remote_name)
+        if (
+            remote is not None
+            and remote.size == os.path.getsize(local_file_path)
+            # Without a remote sha1 (e.g. some large files), size has to do
+            and remote.sha1 in (None, sha1)
+        ):
+            return False
+        manifest.add(backend.upload(local_file_path, remote_name, sha1))
+        return True
+
+    num_uploaded = 0
+    num_failed = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(_upload_if_changed, path, name): path
+            for path, name in local_files
+        }
+        for i, future in enumerate(tqdm(as_completed(futures), total=len(futures))):
+            try:
+                num_uploaded += future.result()
+            except Exception as e:
+                num_failed += 1
+                tqdm.write(f"Error uploading {futures[future]}: {e}")
+            # Checkpoint, so an interrupted run doesn't forget what it uploaded
+            if i % 1000 == 999:
+                manifest.save()
+                sha1_cache.save()
+
+    manifest.save()
+    sha1_cache.save()
+    print(f"Uploaded: {num_uploaded}")
+    print(f"Skipped (unchanged): {len(local_files) - num_uploaded - num_failed}")
+    print(f"Failed: {num_failed}")
+
+
+def upload_directory_to_b2(
+    local_dir, bucket_name, b2_application_key_id, b2_application_key, workers=8
+):
+    backend = B2Backend(bucket_name, b2_application_key_id, b2_application_key)
+    manifest = RemoteManifest(f".manifest_{bucket_name}.json")
+    upload_directory(local_dir, backend, manifest, workers=workers)
 
-            if b2_file_path not in existing_files:
-                file_version = bucket.upload_local_file(
-                    local_file=local_file_path, file_name=b2_file_path
-                )
-                print(
-                    f"Uploaded {local_file_path} to {bucket_name} with file id {file_version.id_}"
-                )
-            else:
-                print(f"Skipped {local_file_path}: already exists in the bucket.")
+
+class _Sha1Cache:
+    """path -> (size, mtime, sha1), so unchanged files aren't re-hashed."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries: dict[str, list] = {}
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as infile:
+                self.entries = json.load(infile)
+
+    def get(self, file_path: str) -> str:
+        stat = os.stat(file_path)
+        key = os.path.abspath(file_path)
+        entry: Optional[list] = self.entries.get(key)
+        if entry is not None and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return entry[2]
+        sha1 = sha1_file(file_path)
+        with self._lock:
+            self.entries[key] = [stat.st_size, stat.st_mtime_ns, sha1]
+        return sha1
+
+    def save(self):
+        with self._lock:
+            data = dict(self.entries)
+        with open(f"{self.path}.part", "w", encoding="utf-8") as outfile:
+            json.dump(data, outfile)
+        os.replace(f"{self.path}.part", self.path)
 
 
 def main():
     # Create the parser
     parser = argparse.ArgumentParser(
-        description="Upload files from a local directory to Backblaze B2 bucket, skipping existing files."
+        description="Upload new or changed files from a local directory to B2."
     )
 
     # Add the arguments
     parser.add_argument("local_dir", type=str, help="Local directory to upload")
-    parser.add_argument("bucket_name", type=str, help="Backblaze B2 bucket name")
     parser.add_argument(
-        "b2_application_key_id", type=str, help="Backblaze B2 application key ID"
+        "bucket_name",
+        type=str,
+        help="Backblaze B2 bucket name (or destination directory with --local)",
+    )
+    parser.add_argument(
+        "b2_application_key_id",
+        type=str,
+        nargs="?",
+        help="Backblaze B2 application key ID",
     )
     parser.add_argument(
-        "application_key", type=str, help="Backblaze B2 application key"
+        "application_key", type=str, nargs="?", help="Backblaze B2 application key"
+    )
+    parser.add_argument(
+        "--local", action="store_true", help="Upload to a local directory instead"
+    )
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--refresh-manifest", action="store_true")
+    parser.add_argument(
+        "--dedup-manifest",
+        type=str,
+        default=DEDUP_MANIFEST,
+        help="Don't upload the duplicates listed in this file",
     )
 
     # Execute the parse_args() method
     args = parser.parse_args()
 
-    upload_directory_to_b2(
+    if args.local:
+        backend = LocalBackend(args.bucket_name)
+    else:
+        if not (args.b2_application_key_id and args.application_key):
+            parser.error("B2 uploads need an application key ID and key")
+        backend = B2Backend(
+            args.bucket_name,
+            args.b2_application_key_id,
+            args.application_key,
+            max_upload_workers=args.workers,
+        )
+    manifest_name = os.path.basename(os.path.normpath(args.bucket_name))
+    manifest = RemoteManifest(f".manifest_{manifest_name}.json")
+
+    upload_directory(
         args.local_dir,
-        args.bucket_name,
-        args.b2_application_key_id,
-        args.application_key,
+        backend,
+        manifest,
+        workers=args.workers,
+        refresh_manifest=args.refresh_manifest,
+        skip=load_duplicates(args.dedup_manifest),
     )
 
 
@@ -0,0 +1,156 @@
+"""
+Decodes each photo referenced by the merged CSVs (output of `1_merge.py`) once
+and writes it, at every requested resolution, into fixed-size shards of uint8
+arrays that can be memory-mapped (see `image_shards.py`):
+
+    shards/{resolution}/{shard:05d}.npy
+    shards/{resolution}/index.csv          image | shard | offset
+
+A JPEG thumbnail of each photo is also written to `thumbnails/` for browsing.
+
+Decoding and resizing run in a process pool. JPEGs are decoded in draft mode
+at the smallest scale that still covers the largest requested size.
+
+e.g.
+    poetry run python 4_preprocess_images.py train_obverse.csv --resolutions 224 384
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from image_shards import INDEX_FILE, SHARDS_DIR, shard_dir, shard_path
+from photo_loader import load_image
+from PIL import Image, ImageOps
+from tqdm import tqdm
+
+PHOTOS_DIR = "photos"
+THUMBNAILS_DIR = "thumbnails"
+
+RESOLUTIONS = [224]
+SHARD_SIZE = 256
+THUMBNAIL_SIZE = 256
+
+# "crop": center-crop to a square, then resize
+# "pad": resize so the longer side fits, then pad to a square with black
+MODES = ("crop", "pad")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Preprocess photos into shards.")
+    parser.add_argument("csvs", nargs="+", help="CSVs with an `image` column")
+    parser.add_argument("--photos-dir", type=str, default=PHOTOS_DIR)
+    parser.add_argument("--output-dir", type=str, default=SHARDS_DIR)
+    parser.add_argument("--thumbnails-dir", type=str, default=THUMBNAILS_DIR)
+    parser.add_argument("--resolutions", type=int, nargs="+", default=RESOLUTIONS)
+    parser.add_argument("--mode", choices=MODES, default="crop")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--thumbnail-size", type=int, default=THUMBNAIL_SIZE)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    images = pd.concat([pd.read_csv(csv, usecols=["image"]) for csv in args.csvs])
+    images = images["image"].drop_duplicates().tolist()
+    print(f"{len(images)} images")
+
+    os.makedirs(args.thumbnails_dir, exist_ok=True)
+    writers = {
+        resolution: _ShardWriter(args.output_dir, resolution, args.shard_size)
+        for resolution in args.resolutions
+    }
+
+    failed = []
+    jobs = [
+        (
+            os.path.join(args.photos_dir, image),
+            args.resolutions,
+            args.mode,
+            os.path.join(args.thumbnails_dir, image),
+            args.thumbnail_size,
+        )
+        for image in images
+    ]
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        results = executor.map(_process, *zip(*jobs), chunksize=16)
+        for image, arrays in tqdm(zip(images, results), total=len(images)):
+            if arrays is None:
+                failed.append(image)
+                continue
+            for resolution, array in arrays.items():
+                writers[resolution].add(image, array)
+
+    for writer in writers.values():
+        writer.close()
+    if failed:
+        print(f"Failed to decode {len(failed)} images, e.g. {failed[:5]}")
+    print("Done!")
+
+
+def _process(
+    path: str,
+    resolutions: list[int],
+    mode: str,
+    thumbnail_path: str,
+    thumbnail_size: int,
+) -> Optional[dict[int, np.ndarray]]:
+    try:
+        # Only decode at the scale the largest output needs
+        img = load_image(path, max(*resolutions, thumbnail_size), mode="draft")
+    except (OSError, SyntaxError):
+        return None
+
+    arrays = {}
+    for resolution in resolutions:
+        size = (resolution, resolution)
+        if mode == "crop":
+            resized = ImageOps.fit(img, size, method=Image.Resampling.BICUBIC)
+        else:
+            resized = ImageOps.pad(img, size, method=Image.Resampling.BICUBIC)
+        arrays[resolution] = np.asarray(resized, dtype=np.uint8)
+
+    if not os.path.exists(thumbnail_path):
+        thumbnail = img.copy()
+        thumbnail.thumbnail((thumbnail_size, thumbnail_size))
+        thumbnail.save(thumbnail_path, format="JPEG", quality=85)
+    return arrays
+
+
+class _ShardWriter:
+    def __init__(self, root: str, resolution: int, shard_size: int):
+        self.root = root
+        self.resolution = resolution
+        self.shard_size = shard_size
+        self.index: list[tuple[str, int, int]] = []
+        self._buffer: list[np.ndarray] = []
+        self._shard = 0
+        os.makedirs(shard_dir(root, resolution), exist_ok=True)
+
+    def add(self, image: str, array: np.ndarray):
+        self.index.append((image, self._shard, len(self._buffer)))
+        self._buffer.append(array)
+        if len(self._buffer) == self.shard_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        path = shard_path(self.root, self.resolution, self._shard)
+        np.save(path, np.stack(self._buffer))
+        self._buffer = []
+        self._shard += 1
+
+    def close(self):
+        self._flush()
+        index = pd.DataFrame(self.index, columns=["image", "shard", "offset"])
+        index.to_csv(
+            os.path.join(shard_dir(self.root, self.resolution), INDEX_FILE),
+            index=False,
+        )
+        print(f"{self.resolution}px: {len(index)} images in {self._shard} shards")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Finds near-identical photos in `photos/` (CDLI often has the same photograph
+under several asset types or paths) and writes `dedup_manifest.csv`:
+
+    image | canonical
+
+with a row for every photo in a group of duplicates. The canonical photo of a
+group is its largest file. `2_download_images.py` and `3_upload_to_backblaze.py`
+skip photos whose canonical is a different photo, and `1_merge.py` points the
+rows of the split CSVs at the canonical photo instead.
+
+- Perceptual hashes (dHash + pHash) are computed in a process pool and stored in
+  `phashes.npz`; photos that are already hashed are not hashed again.
+- Duplicates are photos whose hashes are within a Hamming radius of the
+  canonical photo's hash, found with a multi-index hash table (see
+  `phash_index.py`). Being close to another duplicate isn't enough, so
+  similar-looking photos can't chain into one group.
+
+e.g.
+    poetry run python 5_dedup_photos.py --hash phash --radius 4
+"""
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from phash_index import (
+    DEDUP_MANIFEST,
+    MultiIndexHashTable,
+    canonical_clusters,
+    hash_file,
+)
+from tqdm import tqdm
+
+PHOTOS_DIR = "photos"
+HASHES_FILE = "phashes.npz"
+IMAGE_EXTENSIONS = (".jpg", ".jpeg")
+HASH_COLUMNS = ("image", "dhash", "phash")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find duplicate photos.")
+    parser.add_argument("--photos-dir", type=str, default=PHOTOS_DIR)
+    parser.add_argument("--hashes", type=str, default=HASHES_FILE)
+    parser.add_argument("--hash", choices=("phash", "dhash"), default="phash")
+    parser.add_argument("--radius", type=int, default=4)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--output", type=str, default=DEDUP_MANIFEST)
+    args = parser.parse_args()
+
+    hashes = _update_hashes(args.photos_dir, args.hashes, args.workers)
+
+    print(f"Finding duplicates ({args.hash}, radius {args.radius})...")
+    table = MultiIndexHashTable(hashes[args.hash].to_numpy(np.uint64), args.radius)
+    # Photos with at least one near-identical photo, largest files first
+    candidates = hashes.iloc[sorted({i for pair in table.pairs() for i in pair})]
+    candidates = candidates.assign(
+        size=[
+            os.path.getsize(os.path.join(args.photos_dir, image))
+            for image in candidates["image"]
+        ]
+    ).sort_values(["size", "image"], ascending=[False, True])
+    canonical = canonical_clusters(table, candidates.index.tolist())
+
+    images = hashes["image"].to_numpy()
+    members = np.flatnonzero(canonical >= 0)
+    groups = pd.DataFrame(
+        {"image": images[members], "canonical": images[canonical[members]]}
+    )
+    groups = groups[groups.groupby("canonical")["image"].transform("size") > 1]
+    groups = groups.sort_values(["canonical", "image"])
+
+    num_duplicates = (groups["image"] != groups["canonical"]).sum()
+    print(f"Groups of duplicates: {groups['canonical'].nunique()}")
+    print(f"Duplicate photos: {num_duplicates}")
+    print(f"Writing to {args.output}...")
+    groups.to_csv(args.output, index=False)
+
+
+def _update_hashes(photos_dir: str, hashes_file: str, workers: int) -> pd.DataFrame:
+    """Hash the photos that aren't in the hashes file yet, and save."""
+    if os.path.isfile(hashes_file):
+        with np.load(hashes_file) as data:
+            hashes = pd.DataFrame({key: data[key] for key in HASH_COLUMNS})
+    else:
+        hashes = pd.DataFrame(
+            {
+                "image": np.array([], dtype=str),
+                "dhash": np.array([], dtype=np.uint64),
+                "phash": np.array([], dtype=np.uint64),
+            }
+        )
+
+    images = sorted(
+        name
+        for name in os.listdir(photos_dir)
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    hashes = hashes[hashes["image"].isin(images)]
+    new_images = sorted(set(images) - set(hashes["image"]))
+    print(f"{len(hashes)} photos already hashed, {len(new_images)} to go")
+
+    if new_images:
+        paths = [os.path.join(photos_dir, image) for image in new_images]
+        rows = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(hash_file, paths, chunksize=64)
+            for image, result in tqdm(zip(new_images, results), total=len(paths)):
+                if result is None:
+                    tqdm.write(f"Could not decode {image}")
+                    continue
+                rows.append((image, *result))
+        new_hashes = pd.DataFrame(rows, columns=HASH_COLUMNS)
+        hashes = pd.concat([hashes, new_hashes], ignore_index=True)
+
+    hashes = hashes.reset_index(drop=True)
+    hashes["dhash"] = hashes["dhash"].astype(np.uint64)
+    hashes["phash"] = hashes["phash"].astype(np.uint64)
+    np.savez_compressed(
+        hashes_file,
+        image=hashes["image"].to_numpy(str),
+        dhash=hashes["dhash"].to_numpy(np.uint64),
+        phash=hashes["phash"].to_numpy(np.uint64),
+    )
+    return hashes
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Local store of the CDLI photo catalogue (`artifacts.csv` + `assets.csv` from a
+CDLI dump), reduced to the columns the photo pipeline uses and indexed by
+tablet id (P-number), so that joins against it are index lookups:
+
+    id (index) | artifact_id | artifact_type | image_type | image | row_hash
+
+Only JPEG assets are kept. Re-importing is a no-op unless `artifacts.csv` or
+`assets.csv` has changed (by size and mtime, recorded next to the store).
+If one has, the dump is read again, but `row_hash`, a hash of the source
+columns of each row, means only new/changed rows are derived again; rows
+whose hash is already in the store are kept as they are (deleted rows are
+dropped).
+
+>>> catalogue = import_catalogue()  # once, or again after a new CDLI dump
+>>> catalogue = load_catalogue()
+>>> catalogue.loc["P100001"]
+"""
+
+import json
+import os
+
+import pandas as pd
+
+ARTIFACTS_CSV = "artifacts.csv"
+ASSETS_CSV = "assets.csv"
+CATALOGUE_FILE = "cdli_catalogue.parquet"
+
+# Columns read from the CDLI dump; everything else is skipped while parsing
+ARTIFACT_COLUMNS = {"artifact_id": "Int64", "artifact_type": "string"}
+ASSET_COLUMNS = {
+    "artifact_id": "Int64",
+    "asset_type": "string",
+    "path": "string",
+    "file_format": "string",
+}
+SOURCE_COLUMNS = ["artifact_id", "artifact_type", "asset_type", "path"]
+
+ID_PATTERN = r"/([A-Z]\d+)[_\.]"
+
+
+def load_catalogue(path: str = CATALOGUE_FILE) -> pd.DataFrame:
+    return pd.read_parquet(path)
+
+
+def import_catalogue(
+    artifacts_csv: str = ARTIFACTS_CSV,
+    assets_csv: str = ASSETS_CSV,
+    path: str = CATALOGUE_FILE,
+) -> pd.DataFrame:
+    """
+    Import the catalogue from a CDLI dump, reusing the rows of the existing
+    store (if any) that haven't changed.
+    """
+    signature = _signature(artifacts_csv, assets_csv)
+    if os.path.isfile(path) and _load_signature(path) == signature:
+        print(f"{artifacts_csv} and {assets_csv} haven't changed")
+        return load_catalogue(path)
+
+    source = _read_source(artifacts_csv, assets_csv)
+    source["row_hash"] = pd.util.hash_pandas_object(
+        source[SOURCE_COLUMNS], index=False
+    ).to_numpy()
+
+    old = load_catalogue(path) if os.path.isfile(path) else None
+    if old is None:
+        unchanged = None
+        new_rows = source
+    else:
+        unchanged = old[old["row_hash"].isin(source["row_hash"])]
+        new_rows = source[~source["row_hash"].isin(old["row_hash"])]
+        num_removed = len(old) - len(unchanged)
+        print(f"{len(unchanged)} rows unchanged, {num_removed} removed")
+    print(f"{len(new_rows)} new or changed rows")
+
+    catalogue = _derive(new_rows)
+    if unchanged is not None:
+        catalogue = pd.concat([unchanged, catalogue])
+    catalogue = catalogue.sort_index(kind="stable")
+    for column in ("artifact_type", "image_type"):
+        catalogue[column] = catalogue[column].astype("string").astype("category")
+
+    catalogue.to_parquet(path)
+    with open(_signature_path(path), "w", encoding="utf-8") as outfile:
+        json.dump(signature, outfile)
+    print(f"Saved {len(catalogue)} photos to {path}")
+    return catalogue
+
+
+def _signature_path(path: str) -> str:
+    return f"{os.path.splitext(path)[0]}.json"
+
+
+def _signature(*paths: str) -> list:
+    stats = [os.stat(path) for path in paths]
+    return [[path, stat.st_size, stat.st_mtime_ns] for path, stat in zip(paths, stats)]
+
+
+def _load_signature(path: str):
+    if not os.path.isfile(_signature_path(path)):
+        return None
+    with open(_signature_path(path), encoding="utf-8") as infile:
+        return json.load(infile)
+
+
+def _read_source(artifacts_csv: str, assets_csv: str) -> pd.DataFrame:
+    artifacts = pd.read_csv(
+        artifacts_csv,
+        usecols=list(ARTIFACT_COLUMNS),
+        dtype=ARTIFACT_COLUMNS,
+        na_values=[""],
+    )
+    assets = pd.read_csv(
+        assets_csv,
+        usecols=list(ASSET_COLUMNS),
+        dtype=ASSET_COLUMNS,
+        na_values=[""],
+    )
+    artifacts = artifacts.dropna(subset=["artifact_id"])
+    assets = assets.dropna(subset=["artifact_id"])
+    assets = assets[assets["file_format"] == "jpg"]
+
+    df = pd.merge(artifacts, assets, on="artifact_id", how="inner")
+    return df[SOURCE_COLUMNS].reset_index(drop=True)
+
+
+def _derive(df: pd.DataFrame) -> pd.DataFrame:
+    """Source rows -> catalogue rows (tablet id, image filename)."""
+    df = df.copy()
+    df["id"] = df["path"].str.extract(ID_PATTERN, expand=False)
+    df["image"] = df["path"].str.split("/").str[-1]
+    df = df.rename(columns={"asset_type": "image_type"})
+    df = df.set_index("id")
+    return df[["artifact_id", "artifact_type", "image_type", "image", "row_hash"]]
@@ -0,0 +1,53 @@
+"""
+Reader for the image shards written by `4_preprocess_images.py`.
+
+Each resolution has its own directory, `shards/{resolution}/`, containing
+- `{shard:05d}.npy`: uint8 array of shape (num_images, resolution, resolution, 3)
+- `index.csv`: image | shard | offset
+
+>>> shards = ImageShards("shards", 224)
+>>> shards["P100001.jpg"]  # (224, 224, 3) view into a memory-mapped shard
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+SHARDS_DIR = "shards"
+INDEX_FILE = "index.csv"
+
+
+def shard_dir(root: str, resolution: int) -> str:
+    return os.path.join(root, str(resolution))
+
+
+def shard_path(root: str, resolution: int, shard: int) -> str:
+    return os.path.join(shard_dir(root, resolution), f"{shard:05d}.npy")
+
+
+class ImageShards:
+    def __init__(self, root: str = SHARDS_DIR, resolution: int = 224):
+        self.root = root
+        self.resolution = resolution
+        index = pd.read_csv(os.path.join(shard_dir(root, resolution), INDEX_FILE))
+        self.images: list[str] = index["image"].tolist()
+        locations = zip(index["shard"].tolist(), index["offset"].tolist())
+        self._locations = dict(zip(self.images, locations))
+        self._shards: dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return len(self.images)
+
+    def __contains__(self, image: str) -> bool:
+        return image in self._locations
+
+    def __getitem__(self, image: str) -> np.ndarray:
+        shard, offset = self._locations[image]
+        return self._shard(shard)[offset]
+
+    def _shard(self, shard: int) -> np.ndarray:
+        if shard not in self._shards:
+            path = shard_path(self.root, self.resolution, shard)
+            self._shards[shard] = np.load(path, mmap_mode="r")
+        return self._shards[shard]
@@ -0,0 +1,163 @@
+"""
+Perceptual hashes of photos, and a multi-index hash table for finding
+near-identical ones without comparing every pair.
+
+- `dhash`: 64-bit difference hash (is each pixel brighter than its neighbour,
+  on a 9x8 grayscale thumbnail)
+- `phash`: 64-bit DCT hash (is each of the 8x8 lowest frequencies of a 32x32
+  grayscale thumbnail above their median)
+
+`MultiIndexHashTable` splits each hash into `radius + 1` chunks. Two hashes
+within Hamming distance `radius` must agree exactly on at least one chunk
+(pigeonhole), so candidates come from exact chunk lookups, and only those
+are compared bit by bit.
+"""
+
+import os
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from photo_loader import load_image
+from PIL import Image
+
+DEDUP_MANIFEST = "dedup_manifest.csv"
+
+HASH_BITS = 64
+
+
+def dhash(img: Image.Image) -> int:
+    gray = img.convert("L").resize((9, 8), Image.Resampling.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.int16)
+    return _bits_to_int(pixels[:, 1:] > pixels[:, :-1])
+
+
+def phash(img: Image.Image) -> int:
+    gray = img.convert("L").resize((32, 32), Image.Resampling.BILINEAR)
+    pixels = np.asarray(gray, dtype=np.float64)
+    dct = _DCT_MATRIX @ pixels @ _DCT_MATRIX.T
+    low = dct[:8, :8]
+    # the DC term is skipped when taking the median (it dwarfs the rest)
+    return _bits_to_int(low > np.median(low.flatten()[1:]))
+
+
+def hash_file(path: str) -> Optional[tuple[int, int]]:
+    """(dhash, phash) of an image file, or None if it can't be decoded."""
+    try:
+        img = load_image(path, 64, mode="draft")
+    except (OSError, SyntaxError):
+        return None
+    return dhash(img), phash(img)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int("".join("1" if b else "0" for b in bits.flatten()), 2)
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.cos(np.pi * (2 * i + 1) * k / (2 * n)) * np.sqrt(2 / n)
+    matrix[0] /= np.sqrt(2)
+    return matrix
+
+
+_DCT_MATRIX = _dct_matrix(32)
+
+
+def popcount(x: np.ndarray) -> np.ndarray:
+    x = np.ascontiguousarray(x, dtype=np.uint64)
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(x).astype(np.int64)
+    bits = np.unpackbits(x.view(np.uint8).reshape(-1, 8), axis=1)
+    return bits.sum(axis=1).astype(np.int64)
+
+
+class MultiIndexHashTable:
+    def __init__(self, hashes: np.ndarray, radius: int):
+        if not 0 <= radius < HASH_BITS:
+            raise ValueError(f"radius must be in [0, {HASH_BITS})")
+        self.hashes = np.asarray(hashes, dtype=np.uint64)
+        self.radius = radius
+
+        num_chunks = radius + 1
+        bounds = np.linspace(0, HASH_BITS, num_chunks + 1).astype(int)
+        self._chunks = list(zip(bounds[:-1], bounds[1:]))
+        # per chunk: chunk value -> indices of hashes with that value
+        self._tables: list[dict[int, np.ndarray]] = []
+        for lo, hi in self._chunks:
+            values = self._chunk_values(self.hashes, lo, hi)
+            order = np.argsort(values, kind="stable")
+            unique, starts = np.unique(values[order], return_index=True)
+            groups = np.split(order, starts[1:])
+            self._tables.append(dict(zip(unique.tolist(), groups)))
+
+    @staticmethod
+    def _chunk_values(hashes: np.ndarray, lo: int, hi: int) -> np.ndarray:
+        mask = np.uint64((1 << (hi - lo)) - 1)
+        return (hashes >> np.uint64(lo)) & mask
+
+    def query(self, h: int) -> np.ndarray:
+        """Indices of the hashes within `radius` of h."""
+        h_ = np.array([h], dtype=np.uint64)
+        candidates = [
+            table.get(int(self._chunk_values(h_, lo, hi)[0]), np.zeros(0, dtype=int))
+            for (lo, hi), table in zip(self._chunks, self._tables)
+        ]
+        candidates = np.unique(np.concatenate(candidates))
+        distances = popcount(self.hashes[candidates] ^ h_[0])
+        return candidates[distances <= self.radius]
+
+    def pairs(self) -> Iterable[tuple[int, int]]:
+        """Every pair (i, j), i < j, of hashes within `radius` of each other."""
+        seen = set()
+        for table in self._tables:
+            for group in table.values():
+                if len(group) < 2:
+                    continue
+                group = np.sort(group)
+                for k, i in enumerate(group[:-1].tolist()):
+                    others = group[k + 1 :]
+                    distances = popcount(self.hashes[others] ^ self.hashes[i])
+                    for j in others[distances <= self.radius].tolist():
+                        if (i, j) not in seen:
+                            seen.add((i, j))
+                            yield i, j
+
+
+def canonical_clusters(table: MultiIndexHashTable, order: Iterable[int]) -> np.ndarray:
+    """
+    Group the hashes around canonical ones, taken in `order` of preference:
+    the first hash not yet in a group becomes a canonical, and its group is
+    every ungrouped hash within `radius` of it. So every member is close to
+    its canonical, rather than only to some other member (connected
+    components would chain A-B-C into one group even if A and C are far
+    apart). Returns the canonical index of each hash, or -1 for hashes not
+    in `order`.
+    """
+    canonical = np.full(len(table.hashes), -1, dtype=np.int64)
+    for i in order:
+        if canonical[i] >= 0:
+            continue
+        canonical[i] = i
+        neighbours = table.query(int(table.hashes[i]))
+        canonical[neighbours[canonical[neighbours] < 0]] = i
+    return canonical
+
+
+def load_canonicals(path: str = DEDUP_MANIFEST) -> dict[str, str]:
+    """
+    Image -> its canonical image, for the images that duplicate another,
+    according to the manifest written by `5_dedup_photos.py`. Empty if there
+    is no manifest.
+    """
+    if not os.path.isfile(path):
+        return {}
+    df = pd.read_csv(path)
+    df = df[df["image"] != df["canonical"]]
+    return dict(zip(df["image"], df["canonical"]))
+
+
+def load_duplicates(path: str = DEDUP_MANIFEST) -> set[str]:
+    """Images that duplicate another (canonical) image; see load_canonicals."""
+    return set(load_canonicals(path))
@@ -0,0 +1,184 @@
+"""
+Loader for the photos listed in the `train_{image_type}.csv` (etc.) files
+written by `1_merge.py`, for consumers that only need a downscaled image.
+
+- JPEGs are decoded in draft mode: libjpeg scales by 1/2, 1/4 or 1/8 during
+  the DCT, so a 4000px photo requested at 224px is decoded at ~500px instead
+  of full size, and only then resized.
+- `read_header` gets format and size without decoding pixels, for filtering.
+- Decoded images are kept in a byte-bounded LRU cache, and iterating over a
+  `PhotoDataset` prefetches the next images in a thread pool
+  (Pillow releases the GIL while decoding).
+
+>>> dataset = PhotoDataset("train_obverse.csv", size=224)
+>>> image, row = dataset[0]
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Iterator, NamedTuple, Optional
+
+import pandas as pd
+from PIL import Image, ImageOps
+
+PHOTOS_DIR = "photos"
+
+CACHE_BYTES = 512 * 1024**2
+PREFETCH = 32
+
+
+class Header(NamedTuple):
+    format: Optional[str]
+    width: int
+    height: int
+
+
+def read_header(path: str) -> Optional[Header]:
+    """Format and size of an image, reading only its header (None if unreadable)."""
+    try:
+        with Image.open(path) as img:
+            return Header(img.format, img.width, img.height)
+    except (OSError, SyntaxError):
+        return None
+
+
+def load_image(path: str, size: int, mode: str = "fit") -> Image.Image:
+    """
+    Decode an image at (about) the smallest scale that is still >= size x size,
+    then bring it to its final size:
+    - "fit": resize so the longer side is `size` (aspect ratio kept)
+    - "crop": center-crop to a `size` x `size` square
+    - "pad": resize to fit in a `size` x `size` square, padded with black
+    - "draft": no resizing beyond what draft decoding gives
+    """
+    with Image.open(path) as img:
+        img.draft("RGB", (size, size))
+        img = ImageOps.exif_transpose(img).convert("RGB")
+
+    if mode == "fit":
+        img.thumbnail((size, size), Image.Resampling.BICUBIC)
+    elif mode == "crop":
+        img = ImageOps.fit(img, (size, size), method=Image.Resampling.BICUBIC)
+    elif mode == "pad":
+        img = ImageOps.pad(img, (size, size), method=Image.Resampling.BICUBIC)
+    elif mode != "draft":
+        raise ValueError(f"Unknown mode: {mode}")
+    return img
+
+
+class LRUCache:
+    """Thread-safe LRU cache of decoded images, bounded by total bytes."""
+
+    def __init__(self, max_bytes: int = CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.num_bytes = 0
+        self._items: OrderedDict[str, Image.Image] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Image.Image]:
+        with self._lock:
+            img = self._items.get(key)
+            if img is not None:
+                self._items.move_to_end(key)
+            return img
+
+    def put(self, key: str, img: Image.Image):
+        size = _num_bytes(img)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._items:
+                self.num_bytes -= _num_bytes(self._items.pop(key))
+            self._items[key] = img
+            self.num_bytes += size
+            while self.num_bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.num_bytes -= _num_bytes(evicted)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+class PhotoDataset:
+    def __init__(
+        self,
+        csv: str,
+        *,
+        photos_dir: str = PHOTOS_DIR,
+        size: int = 224,
+        mode: str = "fit",
+        min_size: int = 0,
+        formats: Optional[set[str]] = None,
+        cache_bytes: int = CACHE_BYTES,
+        workers: int = os.cpu_count() or 4,
+        prefetch: int = PREFETCH,
+    ):
+        self.photos_dir = photos_dir
+        self.size = size
+        self.mode = mode
+        self.prefetch = prefetch
+        self.cache = LRUCache(cache_bytes)
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._pending: dict[str, Future] = {}
+        self._pending_lock = threading.Lock()
+
+        df = pd.read_csv(csv)
+        if min_size or formats:
+            paths = map(self._path, df["image"])
+            headers = list(self._executor.map(read_header, paths))
+            keep = [
+                header is not None
+                and min(header.width, header.height) >= min_size
+                and (formats is None or header.format in formats)
+                for header in headers
+            ]
+            print(f"Keeping {sum(keep)} of {len(df)} images")
+            df = df[keep]
+        self.df = df.reset_index(drop=True)
+
+    def __len__(self) -> int:
+        return len(self.df)
+
+    def __getitem__(self, idx: int) -> tuple[Image.Image, dict]:
+        row = self.df.iloc[idx]
+        return self._load(row["image"]), row.to_dict()
+
+    def __iter__(self) -> Iterator[tuple[Image.Image, dict]]:
+        for idx in range(len(self)):
+            self.prefetch_range(idx + 1, idx + 1 + self.prefetch)
+            yield self[idx]
+
+    def prefetch_range(self, start: int, stop: int):
+        for image in self.df["image"].iloc[start:stop]:
+            if self.cache.get(image) is not None:
+                continue
+            with self._pending_lock:
+                if image not in self._pending:
+                    self._pending[image] = self._executor.submit(self._decode, image)
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _load(self, image: str) -> Image.Image:
+        img = self.cache.get(image)
+        if img is not None:
+            return img
+        with self._pending_lock:
+            future = self._pending.get(image)
+        return future.result() if future is not None else self._decode(image)
+
+    def _decode(self, image: str) -> Image.Image:
+        img = load_image(self._path(image), self.size, self.mode)
+        self.cache.put(image, img)
+        with self._pending_lock:
+            self._pending.pop(image, None)
+        return img
+
+    def _path(self, image: str) -> str:
+        return os.path.join(self.photos_dir, image)
+
+
+def _num_bytes(img: Image.Image) -> int:
+    return img.width * img.height * len(img.getbands())
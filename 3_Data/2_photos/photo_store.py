@@ -0,0 +1,329 @@
+"""
+Content-addressed store for the CDLI photos.
+
+Each distinct file is stored once, as a blob named by its SHA-256 (read-only,
+unless it was hard-linked in from a working copy with `--link`):
+
+    photo_store/blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}
+    photo_store/manifest.json      name -> [sha256, size, width, height]
+
+where `name` is the photo's CDLI filename (as in `photos/`). Two names with
+the same bytes share a blob, so storage and verification scale with the
+number of unique photos rather than with the catalogue.
+
+- `verify`: every blob exists with the right size (`--full`: and hash)
+- `gc`: deletes blobs that no name points to
+- `export`: hard-links blobs into a flat directory of names (the `photos/`
+  layout that the uploader and the training code read); nothing is copied
+
+e.g.
+    poetry run python photo_store.py import photos/ --link
+    poetry run python photo_store.py verify --full
+    poetry run python photo_store.py export photos/
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, NamedTuple, Optional
+
+from photo_loader import read_header
+from tqdm import tqdm
+
+STORE_DIR = "photo_store"
+BLOBS_DIR = "blobs"
+MANIFEST = "manifest.json"
+TMP_DIR = "tmp"
+
+# Files in `photos/` that aren't photos
+SKIP_FILES = {"manifest.jsonl"}
+
+
+class StoredPhoto(NamedTuple):
+    name: str
+    sha256: str
+    size: int
+    width: Optional[int]
+    height: Optional[int]
+
+
+class PhotoStore:
+    def __init__(self, root: str = STORE_DIR):
+        self.root = root
+        self.manifest_path = os.path.join(root, MANIFEST)
+        self.photos: dict[str, StoredPhoto] = {}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(root, BLOBS_DIR), exist_ok=True)
+        os.makedirs(os.path.join(root, TMP_DIR), exist_ok=True)
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as infile:
+                for name, entry in json.load(infile).items():
+                    self.photos[name] = StoredPhoto(name, *entry)
+
+    def __len__(self) -> int:
+        return len(self.photos)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.photos
+
+    def get(self, name: str) -> Optional[StoredPhoto]:
+        return self.photos.get(name)
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, BLOBS_DIR, sha256[:2], sha256[2:4], sha256)
+
+    def path(self, name: str) -> str:
+        """Path of the blob holding the photo with the given name."""
+        return self.blob_path(self.photos[name].sha256)
+
+    def digests(self) -> set[str]:
+        return {photo.sha256 for photo in self.photos.values()}
+
+    # ----------------------------------------
+    # Adding photos
+    # ----------------------------------------
+
+    def add_file(self, name: str, path: str, link: bool = False) -> StoredPhoto:
+        """
+        Add a file under the given name. With `link`, the file is hard-linked
+        into the store rather than copied (it must not be modified in place
+        afterwards; the downloader only ever replaces files). A linked blob
+        shares its permissions with the original, so it isn't made read-only.
+        """
+        tmp_path = os.path.join(self.root, TMP_DIR, uuid.uuid4().hex)
+        linked = False
+        try:
+            if link:
+                try:
+                    os.link(path, tmp_path)
+                    linked = True
+                except OSError:  # e.g. a different filesystem
+                    shutil.copyfile(path, tmp_path)
+            else:
+                shutil.copyfile(path, tmp_path)
+            sha256 = sha256_file(tmp_path)
+            photo = self._commit(name, sha256, tmp_path, read_only=not linked)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return photo
+
+    def add_bytes(self, name: str, content: bytes) -> StoredPhoto:
+        tmp_path = os.path.join(self.root, TMP_DIR, uuid.uuid4().hex)
+        try:
+            with open(tmp_path, "wb") as outfile:
+                outfile.write(content)
+                outfile.flush()
+                os.fsync(outfile.fileno())
+            sha256 = hashlib.sha256(content).hexdigest()
+            photo = self._commit(name, sha256, tmp_path, read_only=True)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return photo
+
+    def _commit(
+        self, name: str, sha256: str, tmp_path: str, read_only: bool
+    ) -> StoredPhoto:
+        blob_path = self.blob_path(sha256)
+        if not os.path.exists(blob_path):
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            if read_only:
+                os.chmod(tmp_path, 0o444)
+            os.replace(tmp_path, blob_path)
+        header = read_header(blob_path)
+        photo = StoredPhoto(
+            name=name,
+            sha256=sha256,
+            size=os.path.getsize(blob_path),
+            width=header.width if header else None,
+            height=header.height if header else None,
+        )
+        with self._lock:
+            self.photos[name] = photo
+        return photo
+
+    def import_directory(self, directory: str, link: bool = False, workers: int = 8):
+        """
+        Add every file in a directory, skipping names that are already in the
+        store with the same contents.
+        """
+        names = sorted(
+            filename
+            for filename in os.listdir(directory)
+            if filename not in SKIP_FILES
+            and not filename.startswith(".")
+            and not filename.endswith(".part")
+        )
+        print(f"Checking {len(names)} files in {directory}")
+
+        def _add(name: str) -> bool:
+            path = os.path.join(directory, name)
+            if self._is_stored(name, path):
+                return False
+            self.add_file(name, path, link=link)
+            return True
+
+        num_added = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_add, names)
+            for i, added in enumerate(tqdm(results, total=len(names))):
+                num_added += added
+                # Checkpoint, so an interrupted import isn't lost
+                if i % 1000 == 999:
+                    self.save()
+        self.save()
+        print(f"Added {num_added} files")
+        print(f"{len(self.photos)} photos, {len(self.digests())} unique")
+
+    def _is_stored(self, name: str, path: str) -> bool:
+        """Whether the name is stored with these contents (size, then hash)."""
+        photo = self.photos.get(name)
+        if photo is None or photo.size != os.path.getsize(path):
+            return False
+        # A hard-linked file is its blob
+        blob_path = self.blob_path(photo.sha256)
+        if os.path.exists(blob_path) and os.path.samefile(path, blob_path):
+            return True
+        return sha256_file(path) == photo.sha256
+
+    def remove(self, name: str):
+        """Forget a name (its blob is deleted by `gc` if nothing else uses it)."""
+        with self._lock:
+            self.photos.pop(name, None)
+
+    def save(self):
+        with self._lock:
+            data = {
+                photo.name: [photo.sha256, photo.size, photo.width, photo.height]
+                for photo in self.photos.values()
+            }
+        with open(f"{self.manifest_path}.part", "w", encoding="utf-8") as outfile:
+            json.dump(data, outfile)
+        os.replace(f"{self.manifest_path}.part", self.manifest_path)
+
+    # ----------------------------------------
+    # Maintenance
+    # ----------------------------------------
+
+    def verify(self, full: bool = False, workers: int = 8) -> list[str]:
+        """
+        Names whose blob is missing or has the wrong size (with `full`: or
+        whose contents don't hash to its name). Each blob is checked once.
+        """
+        sizes = {photo.sha256: photo.size for photo in self.photos.values()}
+
+        def _is_ok(sha256: str) -> bool:
+            path = self.blob_path(sha256)
+            if not os.path.isfile(path) or os.path.getsize(path) != sizes[sha256]:
+                return False
+            return not full or sha256_file(path) == sha256
+
+        digests = list(sizes)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(_is_ok, digests)
+            bad = {
+                sha256
+                for sha256, ok in tqdm(zip(digests, results), total=len(digests))
+                if not ok
+            }
+        return sorted(p.name for p in self.photos.values() if p.sha256 in bad)
+
+    def gc(self) -> int:
+        """Delete unreferenced blobs (and leftover temporary files)."""
+        referenced = self.digests()
+        num_removed = 0
+        for dirpath, _, filenames in os.walk(os.path.join(self.root, BLOBS_DIR)):
+            for filename in filenames:
+                if filename not in referenced:
+                    os.remove(os.path.join(dirpath, filename))
+                    num_removed += 1
+        tmp_dir = os.path.join(self.root, TMP_DIR)
+        for filename in os.listdir(tmp_dir):
+            os.remove(os.path.join(tmp_dir, filename))
+        return num_removed
+
+    def export(self, directory: str, names: Optional[Iterable[str]] = None) -> int:
+        """
+        Hard-link photos into `directory` under their names (copying only if
+        linking fails). Files already linked to the right blob are left alone.
+        """
+        os.makedirs(directory, exist_ok=True)
+        num_exported = 0
+        for name in tqdm(list(self.photos if names is None else names)):
+            blob_path = self.path(name)
+            dest = os.path.join(directory, name)
+            if os.path.exists(dest) and os.path.samefile(dest, blob_path):
+                continue
+            tmp_dest = f"{dest}.part"
+            try:
+                os.link(blob_path, tmp_dest)
+            except OSError:
+                shutil.copyfile(blob_path, tmp_dest)
+            os.replace(tmp_dest, dest)
+            num_exported += 1
+        return num_exported
+
+
+def sha256_file(path: str, chunk_size: int = 1 << 20) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as infile:
+        while chunk := infile.read(chunk_size):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Content-addressed photo store.")
+    parser.add_argument("--store", type=str, default=STORE_DIR)
+    parser.add_argument("--workers", type=int, default=8)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="Add a directory of photos")
+    import_parser.add_argument("directory", type=str)
+    import_parser.add_argument(
+        "--link", action="store_true", help="Hard-link files instead of copying"
+    )
+
+    verify_parser = subparsers.add_parser("verify", help="Check the blobs")
+    verify_parser.add_argument(
+        "--full", action="store_true", help="Also re-hash every blob"
+    )
+    verify_parser.add_argument(
+        "--drop", action="store_true", help="Remove bad photos from the manifest"
+    )
+
+    subparsers.add_parser("gc", help="Delete unreferenced blobs")
+
+    export_parser = subparsers.add_parser("export", help="Hard-link into a directory")
+    export_parser.add_argument("directory", type=str)
+
+    args = parser.parse_args()
+    store = PhotoStore(args.store)
+
+    if args.command == "import":
+        store.import_directory(args.directory, link=args.link, workers=args.workers)
+    elif args.command == "verify":
+        bad = store.verify(full=args.full, workers=args.workers)
+        print(f"{len(bad)} bad photos of {len(store)}")
+        for name in bad[:20]:
+            print(f"  {name}")
+        if bad and args.drop:
+            for name in bad:
+                store.remove(name)
+            store.save()
+            print("Removed them from the manifest (re-download to restore them)")
+    elif args.command == "gc":
+        print(f"Removed {store.gc()} unreferenced blobs")
+    elif args.command == "export":
+        num_exported = store.export(args.directory)
+        print(f"Exported {num_exported} photos to {args.directory}")
+
+
+if __name__ == "__main__":
+    main()
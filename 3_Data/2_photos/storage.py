@@ -0,0 +1,153 @@
+"""
+Storage backends for the photo uploader.
+
+- `B2Backend`: a Backblaze B2 bucket
+- `LocalBackend`: a directory on disk, laid out like the bucket
+  (useful as a stand-in for B2 when testing)
+
+`RemoteManifest` is a local cache of (name -> size, sha1) for the files in a
+backend, so that deciding what to upload does not require listing the whole
+bucket on every run.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from abc import ABC, abstractmethod
+from typing import Iterator, NamedTuple, Optional
+
+
+class RemoteFile(NamedTuple):
+    name: str
+    size: int
+    sha1: Optional[str]
+
+
+class StorageBackend(ABC):
+    @abstractmethod
+    def list_files(self) -> Iterator[RemoteFile]:
+        """Every file in the backend."""
+
+    @abstractmethod
+    def upload(self, local_path: str, name: str, sha1: str) -> RemoteFile:
+        """Upload a local file under the given name (overwriting it)."""
+
+
+class B2Backend(StorageBackend):
+    def __init__(
+        self,
+        bucket_name: str,
+        application_key_id: str,
+        application_key: str,
+        max_upload_workers: int = 10,
+    ):
+        # Imported here so that the local backend works without b2sdk installed
+        from b2sdk.v2 import B2Api, InMemoryAccountInfo
+
+        # b2sdk uploads large files in parts, using up to max_upload_workers threads
+        info = InMemoryAccountInfo()
+        self.b2_api = B2Api(info, max_upload_workers=max_upload_workers)
+        self.b2_api.authorize_account(
+            "production", application_key_id, application_key
+        )
+        self.bucket = self.b2_api.get_bucket_by_name(bucket_name)
+
+    def list_files(self) -> Iterator[RemoteFile]:
+        for file_version, _ in self.bucket.ls(recursive=True):
+            yield RemoteFile(
+                name=file_version.file_name,
+                size=file_version.size,
+                sha1=_b2_sha1(file_version),
+            )
+
+    def upload(self, local_path: str, name: str, sha1: str) -> RemoteFile:
+        file_version = self.bucket.upload_local_file(
+            local_file=local_path,
+            file_name=name,
+            sha1_sum=sha1,
+            # B2 doesn't store a content sha1 for large (multipart) files
+            file_infos={"large_file_sha1": sha1},
+        )
+        return RemoteFile(name=name, size=file_version.size, sha1=sha1)
+
+
+class LocalBackend(StorageBackend):
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def list_files(self) -> Iterator[RemoteFile]:
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename.endswith(".part"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                yield RemoteFile(
+                    name=os.path.relpath(path, self.root),
+                    size=os.path.getsize(path),
+                    sha1=sha1_file(path),
+                )
+
+    def upload(self, local_path: str, name: str, sha1: str) -> RemoteFile:
+        dest = os.path.join(self.root, name)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        shutil.copyfile(local_path, f"{dest}.part")
+        os.replace(f"{dest}.part", dest)
+        return RemoteFile(name=name, size=os.path.getsize(dest), sha1=sha1)
+
+
+class RemoteManifest:
+    """
+    JSON cache of the files in a backend.
+    Built by listing the backend once, then kept up to date as files are uploaded.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.files: dict[str, RemoteFile] = {}
+        self._lock = threading.Lock()
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as infile:
+                for name, (size, sha1) in json.load(infile).items():
+                    self.files[name] = RemoteFile(name, size, sha1)
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.path)
+
+    def refresh(self, backend: StorageBackend):
+        print("Listing remote files...")
+        with self._lock:
+            self.files = {f.name: f for f in backend.list_files()}
+        print(f"{len(self.files)} remote files")
+        self.save()
+
+    def get(self, name: str) -> Optional[RemoteFile]:
+        return self.files.get(name)
+
+    def add(self, remote_file: RemoteFile):
+        with self._lock:
+            self.files[remote_file.name] = remote_file
+
+    def save(self):
+        with self._lock:
+            data = {f.name: [f.size, f.sha1] for f in self.files.values()}
+        with open(f"{self.path}.part", "w", encoding="utf-8") as outfile:
+            json.dump(data, outfile)
+        os.replace(f"{self.path}.part", self.path)
+
+
+def sha1_file(path: str, chunk_size: int = 1 << 20) -> str:
+    sha1 = hashlib.sha1()
+    with open(path, "rb") as infile:
+        while chunk := infile.read(chunk_size):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _b2_sha1(file_version) -> Optional[str]:
+    sha1 = file_version.content_sha1
+    if sha1 and sha1 != "none":
+        return sha1.removeprefix("unverified:")
+    return (file_version.file_info or {}).get("large_file_sha1")
@@ -0,0 +1,189 @@
+"""
+Tests for the photo downloader against a local `http.server`.
+
+    poetry run pytest 3_Data/2_photos/tests
+"""
+
+import importlib
+import json
+import os
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+pytest.importorskip("pandas")
+pytest.importorskip("numpy")
+pytest.importorskip("PIL")
+pytest.importorskip("tqdm")
+
+download_images = importlib.import_module("2_download_images")
+
+PHOTO = b"\xff\xd8\xff\xe0" + b"not really a jpeg" * 100
+
+
+class _Server:
+    """
+    Serves PHOTO at any path, except:
+    - /flaky/...: 503 (Retry-After: 0.01) for the first `failures` requests
+    - /broken/...: always 500
+    - /slow/...: waits `delay` seconds before answering
+    Counts requests per path and the most requests in flight at once.
+    """
+
+    def __init__(self, failures: int = 1, delay: float = 0.1):
+        self.failures = failures
+        self.delay = delay
+        self.requests = Counter()
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with server.lock:
+                    server.requests[self.path] += 1
+                    count = server.requests[self.path]
+                    server.in_flight += 1
+                    server.max_in_flight = max(server.max_in_flight, server.in_flight)
+                try:
+                    if self.path.startswith("/slow/"):
+                        time.sleep(server.delay)
+                    if self.path.startswith("/broken/") or (
+                        self.path.startswith("/flaky/") and count <= server.failures
+                    ):
+                        status = 500 if self.path.startswith("/broken/") else 503
+                        self.send_response(status)
+                        self.send_header("Retry-After", "0.01")
+                        self.send_header("Content-Length", "0")
+                        self.end_headers()
+                        return
+                    self.send_response(200)
+                    self.send_header("Content-Type", "image/jpeg")
+                    self.send_header("Content-Length", str(len(PHOTO)))
+                    self.end_headers()
+                    self.wfile.write(PHOTO)
+                finally:
+                    with server.lock:
+                        server.in_flight -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def _downloader(output_dir, **kwargs):
+    options = {"workers": 4, "per_host": 4, "rate": 1000.0, "retries": 3}
+    options.update(kwargs)
+    return download_images.Downloader(output_dir=str(output_dir), **options)
+
+
+def _manifest(output_dir) -> list[dict]:
+    with open(os.path.join(output_dir, download_images.MANIFEST)) as infile:
+        return [json.loads(line) for line in infile]
+
+
+def test_retries_then_writes_file_and_manifest(tmp_path):
+    with _Server(failures=2) as server:
+        _downloader(tmp_path).download_all([f"{server.url}/flaky/P1.jpg"])
+
+        assert server.requests["/flaky/P1.jpg"] == 3
+    assert (tmp_path / "P1.jpg").read_bytes() == PHOTO
+    assert not (tmp_path / "P1.jpg.part").exists()
+    assert _manifest(tmp_path) == [
+        {"image": "P1.jpg", "url": f"{server.url}/flaky/P1.jpg", "size": len(PHOTO)}
+    ]
+
+
+def test_gives_up_after_retries(tmp_path):
+    with _Server() as server:
+        downloader = _downloader(tmp_path, retries=1)
+        with pytest.raises(download_images.requests.HTTPError):
+            downloader.download(f"{server.url}/broken/P2.jpg")
+
+        assert server.requests["/broken/P2.jpg"] == 2
+    assert not (tmp_path / "P2.jpg").exists()
+    assert not downloader.is_downloaded(f"{server.url}/broken/P2.jpg")
+
+
+def test_skips_files_in_manifest(tmp_path):
+    urls = [f"/photos/P{i}.jpg" for i in range(3)]
+    with _Server() as server:
+        _downloader(tmp_path).download_all([server.url + url for url in urls])
+        # A new downloader reads the manifest back
+        _downloader(tmp_path).download_all([server.url + url for url in urls])
+
+        assert all(server.requests[url] == 1 for url in urls)
+
+
+def test_redownloads_partial_and_unrecorded_files(tmp_path):
+    # A leftover .part file, a file that was never recorded, and a recorded
+    # file whose size doesn't match
+    (tmp_path / "P1.jpg.part").write_bytes(PHOTO[:10])
+    (tmp_path / "P2.jpg").write_bytes(PHOTO[:10])
+    (tmp_path / "P3.jpg").write_bytes(PHOTO[:10])
+    with open(tmp_path / download_images.MANIFEST, "w") as outfile:
+        outfile.write(json.dumps({"image": "P3.jpg", "size": len(PHOTO)}) + "\n")
+        outfile.write('{"image": "P4.jp')  # interrupted while writing
+
+    urls = [f"/photos/P{i}.jpg" for i in (1, 2, 3)]
+    with _Server() as server:
+        downloader = _downloader(tmp_path)
+        assert not any(downloader.is_downloaded(server.url + url) for url in urls)
+        downloader.download_all([server.url + url for url in urls])
+
+        assert all(server.requests[url] == 1 for url in urls)
+        # The new records weren't appended onto the interrupted line
+        reloaded = _downloader(tmp_path)
+        assert all(reloaded.is_downloaded(server.url + url) for url in urls)
+    for i in (1, 2, 3):
+        assert (tmp_path / f"P{i}.jpg").read_bytes() == PHOTO
+    assert not (tmp_path / "P1.jpg.part").exists()
+    # The old record of P3, then the new ones (in any order)
+    images = [entry["image"] for entry in _manifest(tmp_path)]
+    assert images[0] == "P3.jpg"
+    assert sorted(images[1:]) == ["P1.jpg", "P2.jpg", "P3.jpg"]
+
+
+def test_one_download_per_file_name(tmp_path):
+    urls = ["/a/P5.jpg", "/b/P5.jpg", "/a/P5.jpg"]
+    with _Server() as server:
+        _downloader(tmp_path).download_all([server.url + url for url in urls])
+
+        assert sum(server.requests.values()) == 1
+    assert [entry["image"] for entry in _manifest(tmp_path)] == ["P5.jpg"]
+
+
+def test_per_host_concurrency(tmp_path):
+    urls = [f"/slow/P{i}.jpg" for i in range(8)]
+    with _Server(delay=0.1) as server:
+        downloader = _downloader(tmp_path, workers=8, per_host=2)
+        downloader.download_all([server.url + url for url in urls])
+
+        assert server.max_in_flight <= 2
+        assert all(server.requests[url] == 1 for url in urls)
+
+
+def test_rate_limiter():
+    limiter = download_images.RateLimiter(rate=50, burst=1)
+    start = time.monotonic()
+    for _ in range(6):
+        limiter.acquire()
+    # The first is free, the other 5 wait 1/50 s each
+    assert time.monotonic() - start >= 5 / 50 * 0.9
@@ -0,0 +1,209 @@
+"""
+Concurrent chat-completion requests with asyncio.
+
+- At most `concurrency` requests are in flight at once.
+- Token buckets cap requests/minute and tokens/minute. A request reserves its
+  estimated tokens (prompt + `max_tokens`, which is also how OpenAI counts them
+  against the limit), and the difference is settled once the usage is known.
+- 429s, 5xx responses, timeouts and connection errors are retried with
+  exponential backoff and jitter, honouring `Retry-After`.
+
+`base_url` can point at any OpenAI-compatible server (e.g. a local mock).
+"""
+
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Iterable, NamedTuple, Optional, TypeVar
+
+from openai import (
+    APIConnectionError,
+    APIStatusError,
+    APITimeoutError,
+    AsyncOpenAI,
+    RateLimitError,
+)
+from tqdm import tqdm
+
+T = TypeVar("T")
+
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Rough size of a token in characters, for estimating prompt lengths
+CHARS_PER_TOKEN = 3
+
+# Sampling parameters for the translation requests
+MAX_TOKENS = 2000
+TEMPERATURE = 0.5
+FREQUENCY_PENALTY = 0.2
+
+
+class Completion(NamedTuple):
+    content: str
+    prompt_tokens: int
+    completion_tokens: int
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+class AsyncTokenBucket:
+    """At most `per_minute` units per minute, in bursts of up to `capacity`."""
+
+    def __init__(self, per_minute: float, capacity: Optional[float] = None):
+        self.rate = per_minute / 60
+        self.capacity = capacity if capacity is not None else per_minute
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self, amount: float = 1):
+        # A request bigger than the bucket would wait forever
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            self._refill()
+            while self._tokens < amount:
+                await asyncio.sleep((amount - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= amount
+
+    def adjust(self, amount: float):
+        """Give back (positive) or take (negative) units after the fact."""
+        self._refill()
+        self._tokens = min(self.capacity, self._tokens + amount)
+
+
+class AsyncRunner:
+    def __init__(
+        self,
+        *,
+        model: str = "gpt-4",
+        base_url: Optional[str] = None,
+        api_key: Optional[str] = None,
+        concurrency: int = 8,
+        requests_per_minute: float = 500,
+        tokens_per_minute: float = 150_000,
+        retries: int = 6,
+        timeout: float = 120.0,
+        max_tokens: int = MAX_TOKENS,
+        temperature: float = TEMPERATURE,
+        frequency_penalty: float = FREQUENCY_PENALTY,
+    ):
+        # Retries are handled here, so that they go through the rate limits
+        self.client = AsyncOpenAI(
+            base_url=base_url, api_key=api_key, max_retries=0, timeout=timeout
+        )
+        self.model = model
+        self.concurrency = concurrency
+        self.retries = retries
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.frequency_penalty = frequency_penalty
+        self.requests = AsyncTokenBucket(requests_per_minute)
+        self.tokens = AsyncTokenBucket(tokens_per_minute)
+
+    async def complete(
+        self, messages: list[dict], max_tokens: Optional[int] = None
+    ) -> Completion:
+        max_tokens = max_tokens or self.max_tokens
+        estimate = estimate_tokens(messages) + max_tokens
+        for attempt in range(self.retries + 1):
+            await self.requests.acquire()
+            await self.tokens.acquire(estimate)
+            try:
+                response = await self.client.chat.completions.create(
+                    model=self.model,
+                    messages=messages,
+                    max_tokens=max_tokens,
+                    temperature=self.temperature,
+                    frequency_penalty=self.frequency_penalty,
+                )
+            except (APIStatusError, APIConnectionError, APITimeoutError) as e:
+                if attempt == self.retries or not _is_retryable(e):
+                    raise
+                await asyncio.sleep(_backoff(attempt, e))
+                continue
+
+            usage = response.usage
+            completion = Completion(
+                content=response.choices[0].message.content or "",
+                prompt_tokens=usage.prompt_tokens if usage else 0,
+                completion_tokens=usage.completion_tokens if usage else 0,
+            )
+            if usage is not None:
+                self.tokens.adjust(estimate - completion.total_tokens)
+            return completion
+        raise AssertionError("unreachable")
+
+    def run(
+        self,
+        items: Iterable[T],
+        fn: Callable[[T], Awaitable[int]],
+        total: Optional[int] = None,
+    ) -> tuple[int, list[tuple[T, Exception]]]:
+        """
+        Call `fn` on every item with `concurrency` workers. `fn` returns the
+        number of tokens it used. Returns (total tokens, failed items).
+        """
+        return asyncio.run(self._run(items, fn, total))
+
+    async def _run(self, items, fn, total):
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        failed = []
+        num_tokens = 0
+        progress = tqdm(total=total)
+
+        async def _worker():
+            nonlocal num_tokens
+            while True:
+                item = await queue.get()
+                if item is _DONE:
+                    return
+                try:
+                    num_tokens += await fn(item)
+                except Exception as e:
+                    failed.append((item, e))
+                    tqdm.write(f"Failed: {e!r}")
+                progress.update()
+                progress.set_postfix(tokens=num_tokens, failed=len(failed))
+
+        workers = [asyncio.create_task(_worker()) for _ in range(self.concurrency)]
+        for item in items:
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(_DONE)
+        await asyncio.gather(*workers)
+        progress.close()
+        await self.client.close()
+        return num_tokens, failed
+
+
+_DONE = object()
+
+
+def estimate_tokens(messages: list[dict]) -> int:
+    return sum(len(message["content"]) for message in messages) // CHARS_PER_TOKEN
+
+
+def _is_retryable(e: Exception) -> bool:
+    if isinstance(e, (APIConnectionError, APITimeoutError, RateLimitError)):
+        return True
+    return isinstance(e, APIStatusError) and e.status_code in RETRY_STATUS_CODES
+
+
+def _backoff(attempt: int, e: Exception) -> float:
+    if isinstance(e, APIStatusError):
+        retry_after = e.response.headers.get("retry-after")
+        if retry_after is not None:
+            try:
+                return float(retry_after)
+            except ValueError:
+                pass
+    # Full jitter, so that concurrent requests don't retry in lockstep
+    return random.uniform(0, min(60.0, 2**attempt))
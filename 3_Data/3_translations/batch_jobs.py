@@ -0,0 +1,147 @@
+"""
+Translation requests as OpenAI Batch API jobs, for when latency doesn't matter.
+
+`export_jobs` writes every request as a line of a JSONL job file:
+
+    {"custom_id": ..., "method": "POST", "url": "/v1/chat/completions",
+     "body": {"model": ..., "messages": [...], ...}}
+
+split into files of at most MAX_REQUESTS_PER_FILE requests. Next to them,
+`{stem}.meta.jsonl` records which tablets each custom_id covers.
+`custom_id`s are derived from the tablet ids, so exporting the same tablets
+again gives the same ids.
+
+`import_results` reads the results files the Batch API returns (one line per
+request: custom_id + response or error), matches them back to the tablets
+through the meta file, and reports what is missing or failed.
+"""
+
+import hashlib
+import json
+import os
+from typing import Iterable, NamedTuple, Optional
+
+from async_runner import FREQUENCY_PENALTY, MAX_TOKENS, TEMPERATURE
+from prompts import (
+    PROMPT,
+    build_messages,
+    build_packed_messages,
+    parse_packed_response,
+)
+
+BATCH_URL = "/v1/chat/completions"
+MAX_REQUESTS_PER_FILE = 50_000
+
+
+class BatchReport(NamedTuple):
+    translated: list[tuple[dict, str]]  # (tablet record, translation)
+    failed: list[str]  # custom_ids with an error or an unparseable response
+    missing: list[str]  # custom_ids in the meta file without a result
+    unknown: list[str]  # custom_ids in the results but not in the meta file
+
+
+def custom_id(ids: list[str]) -> str:
+    if len(ids) == 1:
+        return f"tablet-{ids[0]}"
+    digest = hashlib.sha1("\n".join(ids).encode("utf-8")).hexdigest()[:16]
+    return f"pack-{digest}"
+
+
+def meta_path(path: str) -> str:
+    return f"{os.path.splitext(path)[0]}.meta.jsonl"
+
+
+def export_jobs(
+    batches: list[list[dict]],
+    path: str,
+    *,
+    model: str,
+    examples: Optional[list[str]] = None,
+    max_requests: int = MAX_REQUESTS_PER_FILE,
+) -> list[str]:
+    """
+    Write job files for batches of tablet records ({id, transliteration, genre,
+    period}, transliteration already cleaned), optionally with the few-shot
+    examples to use for each batch. Returns the paths written.
+    """
+    stem, ext = os.path.splitext(path)
+    num_files = max(1, -(-len(batches) // max_requests))
+    if num_files == 1:
+        paths = [path]
+    else:
+        paths = [f"{stem}_{i:05d}{ext}" for i in range(num_files)]
+
+    with open(meta_path(path), "w", encoding="utf-8") as meta_file:
+        for i, job_path in enumerate(paths):
+            with open(job_path, "w", encoding="utf-8") as job_file:
+                stop = min((i + 1) * max_requests, len(batches))
+                for j in range(i * max_requests, stop):
+                    batch = batches[j]
+                    id_ = custom_id([record["id"] for record in batch])
+                    batch_examples = examples[j] if examples is not None else PROMPT
+                    job = _job(id_, batch, model, batch_examples)
+                    job_file.write(json.dumps(job) + "\n")
+                    meta = {"custom_id": id_, "tablets": batch}
+                    meta_file.write(json.dumps(meta, ensure_ascii=False) + "\n")
+    return paths
+
+
+def _job(id_: str, batch: list[dict], model: str, examples: str) -> dict:
+    texts = [record["transliteration"] for record in batch]
+    if len(texts) == 1:
+        messages = build_messages(texts[0], examples)
+    else:
+        messages = build_packed_messages(texts, examples)
+    return {
+        "custom_id": id_,
+        "method": "POST",
+        "url": BATCH_URL,
+        "body": {
+            "model": model,
+            "messages": messages,
+            "max_tokens": MAX_TOKENS,
+            "temperature": TEMPERATURE,
+            "frequency_penalty": FREQUENCY_PENALTY,
+        },
+    }
+
+
+def import_results(results_paths: Iterable[str], meta_file: str) -> BatchReport:
+    with open(meta_file, encoding="utf-8") as infile:
+        metas = [json.loads(line) for line in infile if line.strip()]
+    tablets = {meta["custom_id"]: meta["tablets"] for meta in metas}
+
+    translated, failed, unknown = [], [], []
+    seen = set()
+    for results_path in results_paths:
+        with open(results_path, encoding="utf-8") as infile:
+            for line in infile:
+                if not line.strip():
+                    continue
+                result = json.loads(line)
+                id_ = result["custom_id"]
+                if id_ not in tablets:
+                    unknown.append(id_)
+                    continue
+                seen.add(id_)
+                translations = _translations(result, len(tablets[id_]))
+                if translations is None:
+                    failed.append(id_)
+                    continue
+                translated.extend(zip(tablets[id_], translations))
+
+    missing = [id_ for id_ in tablets if id_ not in seen]
+    return BatchReport(translated, failed, missing, unknown)
+
+
+def _translations(result: dict, num_tablets: int) -> Optional[list[str]]:
+    response = result.get("response") or {}
+    if result.get("error") or response.get("status_code") != 200:
+        return None
+    choices = response.get("body", {}).get("choices") or []
+    if not choices:
+        return None
+    content = choices[0]["message"].get("content") or ""
+    if num_tablets == 1:
+        return [content] if content.strip() else None
+    return parse_packed_response(content, num_tablets)
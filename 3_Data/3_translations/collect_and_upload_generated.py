@@ -1,24 +1,33 @@
-import json
-import os
-
-from datasets import Dataset
-
-
-def load_json_files():
-    data = []
-    for filename in os.listdir("./generated"):
-        if filename.endswith(".json"):
-            filepath = os.path.join("./generated", filename)
-            with open(filepath, "r") as file:
-                json_data = json.load(file)
-                if json_data.get("translation", "") != "":
-                    data.append(json_data)
-    return data
-
-
-json_data = load_json_files()
-dataset = Dataset.from_list(json_data)
-print(dataset)
-# dataset.to_csv("generated.csv")
-# print(dataset)
-dataset.push_to_hub("colesimmons/SumTablets_English-augmented")
+import argparse
+
+from translation_store import STORE_DIR, TranslationStore
+
+REPO_ID = "colesimmons/SumTablets_English-augmented"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Upload generated translations.")
+    parser.add_argument("--store", type=str, default=STORE_DIR)
+    parser.add_argument("--legacy-dir", type=str, default="./generated")
+    parser.add_argument(
+        "--compact", action="store_true", help="Compact the store before uploading"
+    )
+    parser.add_argument("--repo-id", type=str, default=REPO_ID)
+    parser.add_argument("--no-push", action="store_true")
+    args = parser.parse_args()
+
+    store = TranslationStore(args.store)
+    store.migrate_directory(args.legacy_dir)
+    if args.compact:
+        store.compact()
+
+    dataset = store.to_dataset()
+    store.close()
+    print(dataset)
+    # dataset.to_csv("generated.csv")
+    if not args.no_push:
+        dataset.push_to_hub(args.repo_id)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Picks few-shot examples for a translation prompt from the CDLI parallel data
+(`train.csv`, written by `format_cdli.py`), instead of always sending the same
+fixed examples.
+
+Tablets are indexed by the readings in their transliteration (split on
+whitespace and hyphens) and bigrams of them. A query is scored against every
+indexed tablet at once, TF-IDF style: the postings of its features are
+concatenated and summed per tablet with `np.bincount`. Features that occur in
+more than MAX_DF of the tablets (e.g. `1(diš)`) carry little signal and are
+left out of the index.
+
+The best-scoring tablets are added to the prompt until `k` examples or the
+token budget is reached.
+
+>>> selector = FewShotSelector.from_csv("train.csv")
+>>> examples = selector.examples("2(diš) udu\\nba-uš₂\\n...", exclude={"P100001"})
+>>> build_messages(text, examples=examples)
+"""
+
+import math
+import re
+from collections import defaultdict
+from typing import Iterable, Optional
+
+import numpy as np
+import pandas as pd
+from async_runner import CHARS_PER_TOKEN
+from prompts import PROMPT, clean_transliteration
+
+PARALLEL_DATA = "train.csv"
+K = 4
+MAX_EXAMPLE_TOKENS = 1500
+MAX_DF = 0.2
+
+_SEPARATORS = re.compile(r"[\s\-]+")
+
+
+def features(text: str) -> set[str]:
+    readings = [reading for reading in _SEPARATORS.split(text) if reading]
+    bigrams = [f"{a} {b}" for a, b in zip(readings, readings[1:])]
+    return set(readings) | set(bigrams)
+
+
+def format_example(transliteration: str, translation: str) -> str:
+    return f"INPUT:\n{transliteration}\n\nOUTPUT:\n{translation}\n\n---\n\n"
+
+
+class FewShotSelector:
+    def __init__(
+        self, ids: list[str], transliterations: list[str], translations: list[str]
+    ):
+        self.ids = ids
+        self.examples_text = [
+            format_example(transliteration, translation)
+            for transliteration, translation in zip(transliterations, translations)
+        ]
+        self.example_tokens = np.array(
+            [len(example) // CHARS_PER_TOKEN for example in self.examples_text]
+        )
+        self._positions = {id_: i for i, id_ in enumerate(ids)}
+
+        postings: dict[str, list[int]] = defaultdict(list)
+        for i, transliteration in enumerate(transliterations):
+            for feature in features(transliteration):
+                postings[feature].append(i)
+        max_df = max(1, int(MAX_DF * len(ids)))
+        # feature -> (tablet indices, idf)
+        self._index: dict[str, tuple[np.ndarray, float]] = {
+            feature: (
+                np.array(tablets, dtype=np.int32),
+                math.log(len(ids) / len(tablets)),
+            )
+            for feature, tablets in postings.items()
+            if len(tablets) <= max_df
+        }
+
+    @classmethod
+    def from_csv(cls, path: str = PARALLEL_DATA) -> "FewShotSelector":
+        df = pd.read_csv(path, usecols=["id", "transliteration", "translation"])
+        df = df.dropna(subset=["transliteration", "translation"])
+        df = df[df["translation"].str.strip() != ""]
+        transliterations = [clean_transliteration(t) for t in df["transliteration"]]
+        return cls(df["id"].tolist(), transliterations, df["translation"].tolist())
+
+    def scores(self, text: str) -> np.ndarray:
+        matches = [self._index[f] for f in features(text) if f in self._index]
+        if not matches:
+            return np.zeros(len(self.ids))
+        tablets = np.concatenate([tablets for tablets, _ in matches])
+        weights = np.concatenate(
+            [np.full(len(tablets), idf) for tablets, idf in matches]
+        )
+        return np.bincount(tablets, weights=weights, minlength=len(self.ids))
+
+    def select(
+        self,
+        text: str,
+        k: int = K,
+        max_tokens: int = MAX_EXAMPLE_TOKENS,
+        exclude: Optional[Iterable[str]] = None,
+    ) -> list[int]:
+        """Indices of up to k similar tablets whose examples fit in max_tokens."""
+        scores = self.scores(text)
+        if len(scores) == 0 or k <= 0:
+            return []
+        for id_ in exclude or ():
+            if id_ in self._positions:
+                scores[self._positions[id_]] = 0
+        num_candidates = min(len(scores), 4 * k)
+        candidates = np.argpartition(-scores, num_candidates - 1)[:num_candidates]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+
+        selected, num_tokens = [], 0
+        for i in candidates.tolist():
+            if scores[i] <= 0 or len(selected) == k:
+                break
+            if num_tokens + self.example_tokens[i] > max_tokens:
+                continue
+            selected.append(i)
+            num_tokens += self.example_tokens[i]
+        return selected
+
+    def examples(
+        self,
+        text: str,
+        k: int = K,
+        max_tokens: int = MAX_EXAMPLE_TOKENS,
+        exclude: Optional[Iterable[str]] = None,
+    ) -> str:
+        """
+        Few-shot examples for a prompt, most similar last (nearest the input).
+        The fixed examples are used if no indexed tablet is similar at all.
+        """
+        selected = self.select(text, k, max_tokens, exclude)
+        if not selected:
+            return PROMPT
+        return "\n" + "".join(self.examples_text[i] for i in reversed(selected))
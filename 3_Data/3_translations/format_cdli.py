@@ -1,64 +1,38 @@
-import csv
-import json
-
-import pandas as pd
-
-# Open and read the contents of the JSON file
-data = []
-for filename in ["cdli.json", "cdli2.json", "cdli3.json", "cdli4.json"]:
-    with open(filename, "r") as file:
-        data.extend(json.load(file))
-
-# Create an empty list to store the tablet transcriptions
-tablets = []
+"""
+Extracts the Sumerian transliterations and English translations (`#tr.en:`
+lines) from the CDLI JSON exports (`cdli.json`, `cdli2.json`, ...) into
+`cdli.parquet`:
 
-# Iterate through each tablet object
-for tablet in data:
-    genres = tablet.get("genres", [])
-    genres = [g.get("genre") for g in genres]
-    genres = [g.get("genre") for g in genres]
-    genre = ", ".join(genres) if genres else "Unknown"
+    id | name | period | genre | transliteration | translation
 
-    period = tablet.get("period", {})
-    period = period.get("period", "Unknown")
+and joins them with the SumTablets splits, writing `{split}.csv`:
 
-    if "inscription" not in tablet:
-        continue
-    inscription = tablet["inscription"].get("atf", "")
-    if "#atf: lang sux" not in inscription:
-        continue
+    id | period | genre | transliteration | translation
 
-    name = inscription.split(" ", 1)
-    name = name[0].split("&", 1)[1]
+The exports are parsed as a stream (one artifact at a time), so memory use
+doesn't grow with the size of the dumps. The splits are read once into
+`split_index.parquet`, indexed by id, which is only rebuilt when the split
+CSVs change.
+"""
 
-    inscription_body = inscription.split("#atf: lang sux", 1)[1]
-
-    lines = inscription_body.split("\n")
-
-    translation = [line[8:].strip() for line in lines if line.startswith("#tr.en: ")]
-    translation = "\n".join(translation)
+import argparse
+import json
+import os
+from typing import Iterator, Optional
 
-    transliteration = [
-        line.strip() for line in lines if not line.startswith("#tr.en: ")
-    ]
-    transliteration = "\n".join(transliteration)
-
-    tablets.append(
-        {
-            "id": tablet.get("id", ""),
-            "name": name,
-            "transliteration": transliteration,
-            "translation": translation,
-            "period": period,
-            "genre": genre,
-        }
-    )
+import pandas as pd
+from tqdm import tqdm
 
-df = pd.DataFrame(tablets)
+CDLI_FILES = ["cdli.json", "cdli2.json", "cdli3.json", "cdli4.json"]
+CDLI_TABLE = "cdli.parquet"
 
-# Save the DataFrame to a CSV file
-df.to_csv("cdli.csv", index=False)
+SPLITS_DIR = "../1_glyphs_and_transliterations/outputs"
+SPLITS = ["train", "test", "validation"]
+SPLIT_INDEX = "split_index.parquet"
+SPLIT_INDEX_SIGNATURE = "split_index.json"
 
+LANG_SUX = "#atf: lang sux"
+TRANSLATION_PREFIX = "#tr.en: "
 
 SPECIAL_TOKS_TO_REMOVE = {
     "<SURFACE>",
@@ -68,70 +42,192 @@ SPECIAL_TOKS_TO_REMOVE = {
 }
 
 
-def _rm_special_tokens(text):
-    text_ = text
-    for tok in SPECIAL_TOKS_TO_REMOVE:
-        text_ = text_.replace(tok, "")
-    return text_
-
-
-def count_in_common_with_epsd2():
-    # 2191 of 3656
-    cdli_df = pd.read_csv("cdli.csv", encoding="utf-8")
-    # Rename the "id" column to "name" to match the column name in cdli.csv
-    cdli_df = cdli_df[["name", "translation"]]
-    cdli_df = cdli_df.rename(columns={"name": "id"})
-    print("Before dropping duplicates:", cdli_df.shape)
-    cdli_df = cdli_df.drop_duplicates(subset=["id"])
-    print("After dropping duplicates:", cdli_df.shape)
-
-    train_df = pd.read_csv(
-        "../1_glyphs_and_transliterations/outputs/train.csv", encoding="utf-8"
+def main():
+    parser = argparse.ArgumentParser(description="Extract CDLI translations.")
+    parser.add_argument("files", nargs="*", default=CDLI_FILES)
+    parser.add_argument("--splits-dir", type=str, default=SPLITS_DIR)
+    parser.add_argument(
+        "--skip-extract", action="store_true", help=f"Reuse {CDLI_TABLE}"
     )
-    test_df = pd.read_csv(
-        "../1_glyphs_and_transliterations/outputs/test.csv", encoding="utf-8"
+    args = parser.parse_args()
+
+    if args.skip_extract and os.path.isfile(CDLI_TABLE):
+        cdli_df = pd.read_parquet(CDLI_TABLE)
+    else:
+        cdli_df = extract(args.files)
+        cdli_df.to_parquet(CDLI_TABLE, index=False)
+        print(f"Wrote {len(cdli_df)} tablets to {CDLI_TABLE}")
+
+    split_index = load_split_index(args.splits_dir)
+    num_in_common = count_in_common(cdli_df, split_index)
+    print(f"CDLI tablets in SumTablets: {num_in_common} of {len(cdli_df)}")
+    join_with_splits(cdli_df, split_index)
+
+
+# ----------------------------------------
+# Extraction
+# ----------------------------------------
+
+
+def iter_json_array(path: str, chunk_size: int = 1 << 20) -> Iterator[dict]:
+    """The elements of a top-level JSON array, decoded one at a time."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as infile:
+        buffer = ""
+        pos = 0
+        started = False
+        eof = False
+        while True:
+            if not eof:
+                chunk = infile.read(chunk_size)
+                eof = chunk == ""
+                buffer = buffer[pos:] + chunk
+                pos = 0
+            while True:
+                # Skip whitespace and the separators between elements
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos == len(buffer):
+                    break
+                if not started:
+                    if buffer[pos] != "[":
+                        raise ValueError(f"{path} is not a JSON array")
+                    started = True
+                    pos += 1
+                    continue
+                if buffer[pos] == "]":
+                    return
+                try:
+                    element, pos = decoder.raw_decode(buffer, pos)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                    break  # incomplete element; read more
+                yield element
+            if eof:
+                raise ValueError(f"{path} ended before the end of the array")
+
+
+def parse_atf(atf: str) -> Optional[tuple[str, str, str]]:
+    """(name, transliteration, translation) of a Sumerian ATF, else None."""
+    header, sep, body = atf.partition(LANG_SUX)
+    if not sep:
+        return None
+    # "&P100001 = ..." -> "P100001"
+    name = header.split(" ", 1)[0].partition("&")[2]
+
+    transliteration, translation = [], []
+    for line in body.split("\n"):
+        if line.startswith(TRANSLATION_PREFIX):
+            translation.append(line[len(TRANSLATION_PREFIX) :].strip())
+        else:
+            transliteration.append(line.strip())
+    return name, "\n".join(transliteration), "\n".join(translation)
+
+
+def extract(files: list[str]) -> pd.DataFrame:
+    rows = []
+    for filename in files:
+        for tablet in tqdm(iter_json_array(filename), desc=filename):
+            atf = (tablet.get("inscription") or {}).get("atf", "")
+            parsed = parse_atf(atf) if atf else None
+            if parsed is None:
+                continue
+            name, transliteration, translation = parsed
+
+            genres = tablet.get("genres", [])
+            genres = [g.get("genre") for g in genres]
+            genres = [g.get("genre") for g in genres]
+            genre = ", ".join(genres) if genres else "Unknown"
+            period = (tablet.get("period") or {}).get("period", "Unknown")
+
+            rows.append(
+                (
+                    str(tablet.get("id", "")),
+                    name,
+                    period,
+                    genre,
+                    transliteration,
+                    translation,
+                )
+            )
+
+    df = pd.DataFrame(
+        rows,
+        columns=["id", "name", "period", "genre", "transliteration", "translation"],
     )
-    val_df = pd.read_csv(
-        "../1_glyphs_and_transliterations/outputs/validation.csv", encoding="utf-8"
+    for column in ("id", "name", "transliteration", "translation"):
+        df[column] = df[column].astype("string")
+    for column in ("period", "genre"):
+        df[column] = df[column].astype("category")
+    return df
+
+
+# ----------------------------------------
+# Joining with the splits
+# ----------------------------------------
+
+
+def load_split_index(splits_dir: str = SPLITS_DIR) -> pd.DataFrame:
+    """
+    id (index) | split | period | genre | transliteration, for every SumTablets
+    split, cached in SPLIT_INDEX until one of the split CSVs changes.
+    """
+    paths = [os.path.join(splits_dir, f"{split}.csv") for split in SPLITS]
+    stats = [os.stat(path) for path in paths]
+    signature = [
+        [path, stat.st_size, stat.st_mtime_ns] for path, stat in zip(paths, stats)
+    ]
+    if os.path.isfile(SPLIT_INDEX) and os.path.isfile(SPLIT_INDEX_SIGNATURE):
+        with open(SPLIT_INDEX_SIGNATURE, encoding="utf-8") as infile:
+            if json.load(infile) == signature:
+                return pd.read_parquet(SPLIT_INDEX)
+
+    print("Indexing the splits...")
+    split_index = pd.concat(
+        [
+            pd.read_csv(
+                path,
+                usecols=["id", "period", "genre", "transliteration"],
+                dtype={"id": "string", "transliteration": "string"},
+                encoding="utf-8",
+            ).assign(split=split)
+            for split, path in zip(SPLITS, paths)
+        ],
+        ignore_index=True,
     )
+    for column in ("split", "period", "genre"):
+        split_index[column] = split_index[column].astype("category")
+    split_index = split_index.set_index("id")
+    split_index.to_parquet(SPLIT_INDEX)
+    with open(SPLIT_INDEX_SIGNATURE, "w", encoding="utf-8") as outfile:
+        json.dump(signature, outfile)
+    return split_index
+
+
+def join_with_splits(cdli_df: pd.DataFrame, split_index: pd.DataFrame):
+    # SumTablets ids are CDLI names (P-numbers)
+    translations = cdli_df[["name", "translation"]].rename(columns={"name": "id"})
+    print("Before dropping duplicates:", translations.shape)
+    translations = translations.drop_duplicates(subset=["id"])
+    print("After dropping duplicates:", translations.shape)
+
+    joined = translations.join(split_index, on="id", how="inner")
+    for tok in SPECIAL_TOKS_TO_REMOVE:
+        joined["transliteration"] = joined["transliteration"].str.replace(
+            tok, "", regex=False
+        )
+    for split, split_df in joined.groupby("split", sort=False, observed=True):
+        split_df = split_df[["id", "period", "genre", "transliteration", "translation"]]
+        split_df.to_csv(f"{split}.csv", index=False, encoding="utf-8")
+        print(f"{split}: {len(split_df)} tablets")
+
+
+def count_in_common(cdli_df: pd.DataFrame, split_index: pd.DataFrame) -> int:
+    """How many CDLI translations are for tablets in SumTablets (2191 of 3656)."""
+    names = set(cdli_df["name"].dropna())
+    return len(names & set(split_index.index))
+
 
-    for split, df_ in [
-        ("train", train_df),
-        ("test", test_df),
-        ("validation", val_df),
-    ]:
-        joined = pd.merge(cdli_df, df_, on="id", how="inner")
-        joined = joined[
-            [
-                "id",
-                "period",
-                "genre",
-                "transliteration",
-                "translation",
-            ]
-        ]
-        joined["transliteration"] = joined["transliteration"].apply(_rm_special_tokens)
-        joined.to_csv(f"{split}.csv", index=False, encoding="utf-8")
-    return
-
-    # Read the IDs from cdli.csv
-    with open("cdli.csv", "r") as cdli_file:
-        cdli_reader = csv.DictReader(cdli_file)
-        cdli_ids = [row["id"] for row in cdli_reader]
-
-    # Read the IDs from tablets.csv
-    with open(
-        "../1_glyphs_and_transliterations/outputs/5_with_glyphs.csv", "r"
-    ) as tablets_file:
-        tablets_reader = csv.DictReader(tablets_file)
-        tablets_ids = [row["id"] for row in tablets_reader]
-
-    # Count the number of IDs from cdli.csv that are present in tablets.csv
-    count = sum(1 for id in cdli_ids if id in tablets_ids)
-
-    # Print the count
-    print(f"Number of IDs from cdli.csv present in tablets.csv: {count}")
-    print(len(cdli_ids))
-
-
-count_in_common_with_epsd2()
+if __name__ == "__main__":
+    main()
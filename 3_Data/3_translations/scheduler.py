@@ -0,0 +1,271 @@
+"""
+Deciding what to translate under a fixed budget, and accounting for what it
+cost.
+
+- `prioritize` orders tablets so that the (period, genre) groups with the
+  fewest translations so far come first, taking one tablet at a time from
+  whichever group is currently smallest.
+- `estimate` predicts a request's prompt and completion tokens before it is
+  sent: the prompt from its length in characters, the completion from the
+  length of the transliteration(s) in tokenizer tokens. It's only a forecast
+  (`Budget.plan`), never used to enforce the cap.
+- `Budget` is a cap on tokens and/or dollars. A request reserves the most it
+  can use before it is sent (its prompt plus `max_tokens`, capped at what's
+  left of the budget, so concurrent requests can't overshoot), and the
+  reservation is replaced by the actual usage once it's back. The completion
+  is bounded by `max_tokens`, but the prompt is only estimated (characters /
+  `CHARS_PER_TOKEN`), so it's reserved with a `PROMPT_MARGIN`, and no more
+  requests are sent once the actual usage reaches the cap. A prompt that is
+  underestimated by more than the margin can still take the run past the cap,
+  by that estimation error.
+- `UsageLedger` accumulates usage per (period, genre), and appends it, with
+  throughput, to a CSV at the end of a run.
+"""
+
+import csv
+import heapq
+import math
+import os
+import time
+from collections import Counter, defaultdict
+from typing import Callable, Hashable, Iterable, NamedTuple, Optional, TypeVar
+
+from async_runner import Completion, estimate_tokens
+
+T = TypeVar("T")
+
+# English translation tokens per transliteration token (tokenizer tokens)
+COMPLETION_RATIO = 1.5
+
+# Prompt tokens reserved per estimated prompt token, for the estimation error
+PROMPT_MARGIN = 1.25
+
+LEDGER_FILE = "usage_ledger.csv"
+LEDGER_COLUMNS = [
+    "run",
+    "period",
+    "genre",
+    "tablets",
+    "requests",
+    "prompt_tokens",
+    "completion_tokens",
+    "cost_usd",
+    "minutes",
+    "tablets_per_minute",
+    "tokens_per_minute",
+]
+
+
+class Pricing(NamedTuple):
+    # USD per million tokens
+    prompt: float
+    completion: float
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (prompt_tokens * self.prompt + completion_tokens * self.completion) / 1e6
+
+
+PRICING = {
+    "gpt-4": Pricing(30.0, 60.0),
+    "gpt-4-turbo": Pricing(10.0, 30.0),
+    "gpt-4o": Pricing(5.0, 15.0),
+    "gpt-4o-mini": Pricing(0.15, 0.6),
+}
+
+
+class Estimate(NamedTuple):
+    prompt_tokens: int
+    completion_tokens: int
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+
+def estimate(
+    messages: list[dict], lengths: list[int], ratio: float = COMPLETION_RATIO
+) -> Estimate:
+    """Tokens of a request, given the lengths of the transliterations in it."""
+    return Estimate(estimate_tokens(messages), int(sum(lengths) * ratio))
+
+
+def prioritize(
+    items: Iterable[T], key: Callable[[T], Hashable], counts: Counter
+) -> list[T]:
+    """
+    Interleave items so that the groups (`key`) with the lowest counts come
+    first. Within a group, the original order is kept.
+    """
+    groups: dict[Hashable, list[T]] = defaultdict(list)
+    for item in items:
+        groups[key(item)].append(item)
+
+    # (count, tiebreak, group, position in group)
+    heap = [(counts[group], i, group, 0) for i, group in enumerate(groups)]
+    heapq.heapify(heap)
+    ordered = []
+    while heap:
+        count, i, group, position = heapq.heappop(heap)
+        ordered.append(groups[group][position])
+        if position + 1 < len(groups[group]):
+            heapq.heappush(heap, (count + 1, i, group, position + 1))
+    return ordered
+
+
+class Budget:
+    def __init__(
+        self,
+        pricing: Pricing,
+        max_tokens: Optional[int] = None,
+        max_cost: Optional[float] = None,
+        prompt_margin: float = PROMPT_MARGIN,
+    ):
+        self.pricing = pricing
+        self.max_tokens = max_tokens
+        self.max_cost = max_cost
+        self.prompt_margin = prompt_margin
+        self.tokens = 0  # spent + reserved
+        self.cost = 0.0
+
+    def _fits(self, tokens: int, cost: float) -> bool:
+        if self.max_tokens is not None and self.tokens + tokens > self.max_tokens:
+            return False
+        if self.max_cost is not None and self.cost + cost > self.max_cost:
+            return False
+        return True
+
+    def _cost(self, estimate: Estimate) -> float:
+        return self.pricing.cost(estimate.prompt_tokens, estimate.completion_tokens)
+
+    def reserve(
+        self, prompt_tokens: int, max_tokens: int, min_tokens: int = 1
+    ) -> Optional[Estimate]:
+        """
+        Reserve the most a request can use: its prompt plus up to max_tokens of
+        completion, cut down to what's left of the budget. The (estimated)
+        prompt is reserved with `prompt_margin`. Returns the reservation, whose
+        completion_tokens is the `max_tokens` to send the request with, or None
+        if less than min_tokens of completion would fit (a request cut down
+        that far would only come back truncated), which is always the case
+        once the actual usage has reached the cap.
+        """
+        prompt_tokens = math.ceil(prompt_tokens * self.prompt_margin)
+        completion_tokens = min(max_tokens, self._completion_left(prompt_tokens))
+        if completion_tokens < max(1, min_tokens):
+            return None
+        reservation = Estimate(prompt_tokens, int(completion_tokens))
+        self.tokens += reservation.total_tokens
+        self.cost += self._cost(reservation)
+        return reservation
+
+    def _completion_left(self, prompt_tokens: int) -> float:
+        """Completion tokens left in the budget after a prompt (can be < 0)."""
+        left = math.inf
+        if self.max_tokens is not None:
+            left = self.max_tokens - self.tokens - prompt_tokens
+        if self.max_cost is not None:
+            cost_left = self.max_cost - self.cost - self.pricing.cost(prompt_tokens, 0)
+            if self.pricing.completion > 0:
+                left = min(left, math.floor(cost_left * 1e6 / self.pricing.completion))
+            elif cost_left < 0:
+                left = -1
+        return left
+
+    def release(self, estimate: Estimate):
+        self.tokens -= estimate.total_tokens
+        self.cost -= self._cost(estimate)
+
+    def settle(self, estimate: Estimate, completion: Completion):
+        """Replace a reservation with the actual usage."""
+        self.release(estimate)
+        self.tokens += completion.total_tokens
+        self.cost += self.pricing.cost(
+            completion.prompt_tokens, completion.completion_tokens
+        )
+
+    @property
+    def exceeded(self) -> bool:
+        """Whether the actual usage went past the cap."""
+        return not self._fits(0, 0.0)
+
+    def plan(self, estimates: list[Estimate]) -> int:
+        """How many of the (ordered) requests fit in what's left of the budget."""
+        tokens, cost = 0, 0.0
+        for i, estimate in enumerate(estimates):
+            tokens += estimate.total_tokens
+            cost += self._cost(estimate)
+            if not self._fits(tokens, cost):
+                return i
+        return len(estimates)
+
+
+class UsageLedger:
+    def __init__(self, pricing: Pricing):
+        self.pricing = pricing
+        self.start = time.monotonic()
+        self.run = time.strftime("%Y-%m-%dT%H:%M:%S")
+        self.groups: dict[tuple[str, str], Counter] = defaultdict(Counter)
+
+    def record(
+        self,
+        groups: list[tuple[str, str]],
+        lengths: list[int],
+        completion: Completion,
+        translated: bool = True,
+    ):
+        """
+        Record a request for tablets in the given groups. The usage of a packed
+        request is split between its tablets by transliteration length.
+        `translated=False` for a request whose response couldn't be used.
+        """
+        total_length = sum(lengths) or 1
+        for group, length in zip(groups, lengths):
+            share = length / total_length
+            counter = self.groups[group]
+            counter["tablets"] += int(translated)
+            counter["requests"] += share
+            counter["prompt_tokens"] += completion.prompt_tokens * share
+            counter["completion_tokens"] += completion.completion_tokens * share
+
+    def rows(self) -> list[dict]:
+        minutes = (time.monotonic() - self.start) / 60
+        rows = []
+        for (period, genre), counter in sorted(self.groups.items()):
+            rows.append(self._row(period, genre, counter, minutes))
+        total = sum(self.groups.values(), Counter())
+        rows.append(self._row("TOTAL", "TOTAL", total, minutes))
+        return rows
+
+    def _row(self, period: str, genre: str, counter: Counter, minutes: float) -> dict:
+        prompt_tokens = round(counter["prompt_tokens"])
+        completion_tokens = round(counter["completion_tokens"])
+        tokens = prompt_tokens + completion_tokens
+        return {
+            "run": self.run,
+            "period": period,
+            "genre": genre,
+            "tablets": counter["tablets"],
+            "requests": round(counter["requests"], 2),
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost_usd": round(self.pricing.cost(prompt_tokens, completion_tokens), 4),
+            "minutes": round(minutes, 2),
+            "tablets_per_minute": round(counter["tablets"] / max(minutes, 1e-9), 2),
+            "tokens_per_minute": round(tokens / max(minutes, 1e-9)),
+        }
+
+    def write(self, path: str = LEDGER_FILE):
+        rows = self.rows()
+        is_new = not os.path.isfile(path)
+        with open(path, "a", encoding="utf-8", newline="") as outfile:
+            writer = csv.DictWriter(outfile, fieldnames=LEDGER_COLUMNS)
+            if is_new:
+                writer.writeheader()
+            writer.writerows(rows)
+        total = rows[-1]
+        print(
+            f"{total['tablets']} tablets, {total['prompt_tokens']} + "
+            f"{total['completion_tokens']} tokens, ${total['cost_usd']:.2f}, "
+            f"{total['tablets_per_minute']} tablets/min, "
+            f"{total['tokens_per_minute']} tokens/min"
+        )
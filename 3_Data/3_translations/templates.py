@@ -0,0 +1,88 @@
+"""
+Template clustering of formulaic tablets (mostly Ur III receipts and
+deliveries), which often differ only in numbers, names and dates.
+
+`template` masks, line by line:
+- numbers, e.g. `2(diš)`, `1(u)`, `4(u) 5(diš)-am₃` -> `N`, `N-am₃`
+- words with a determinative (`{d}šul-gi`, `si-ma-num₂{ki}`) -> `NAME`
+- the person after `ki` (from), `giri₃` (via), `kišib₃` (seal) -> `NAME`
+- a line on its own before `šu ba-ti` / `i₃-dab₅` / `ba-zi` (receiver) -> `NAME`
+- month and year names (`iti ...`, `mu ...`) -> `iti DATE`, `mu DATE`
+
+Tablets with the same template hash are one cluster. Only one tablet per
+cluster (the representative) needs a translation; once it has one, the rest
+are recorded as template-reused in `template_reuse.jsonl` (not in the
+translation store, since the representative's translation has the wrong
+numbers, names and dates for them), and can still be translated later.
+"""
+
+import hashlib
+import json
+import os
+import re
+from typing import Optional
+
+REUSE_LEDGER = "template_reuse.jsonl"
+
+# Tablets shorter than this aren't clustered (fragments all look alike)
+MIN_LINES = 3
+
+_NUMBER = re.compile(r"(?:\d+\([^)\s]*\)|\b\d+\b)(?:\s+(?:\d+\([^)\s]*\)|\b\d+\b))*")
+_DETERMINATIVE = re.compile(r"\S*\{[^}]+\}\S*")
+_PERSON_AFTER = re.compile(r"^(ki|giri₃|kišib₃)\s+.+?(-ta|-še₃)?$")
+_DATE = re.compile(r"^(iti|mu)\s.*$")
+_RECEIVER_VERBS = ("šu ba-ti", "i₃-dab₅", "ba-zi")
+
+
+def template(text: str) -> Optional[str]:
+    """Masked template of a (cleaned) transliteration, None if too short."""
+    lines = [line.strip() for line in text.split("\n") if line.strip()]
+    if len(lines) < MIN_LINES:
+        return None
+
+    masked = []
+    for i, line in enumerate(lines):
+        line = _NUMBER.sub("N", line)
+        line = _DATE.sub(lambda m: f"{m.group(1)} DATE", line)
+        match = _PERSON_AFTER.match(line)
+        if match:
+            line = f"{match.group(1)} NAME{match.group(2) or ''}"
+        line = _DETERMINATIVE.sub("NAME", line)
+        next_line = lines[i + 1] if i + 1 < len(lines) else ""
+        if next_line in _RECEIVER_VERBS and " " not in line:
+            line = "NAME"
+        masked.append(line)
+    return "\n".join(masked)
+
+
+def template_hash(text: str) -> Optional[str]:
+    masked = template(text)
+    if masked is None:
+        return None
+    return hashlib.blake2b(masked.encode("utf-8"), digest_size=8).hexdigest()
+
+
+class ReuseLedger:
+    """id -> (representative id, template hash), appended as JSON lines."""
+
+    def __init__(self, path: str = REUSE_LEDGER):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as infile:
+                for line in infile:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self.entries[entry["id"]] = entry
+
+    def __contains__(self, id: str) -> bool:
+        return id in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add_all(self, entries: list[dict]):
+        with open(self.path, "a", encoding="utf-8") as outfile:
+            for entry in entries:
+                self.entries[entry["id"]] = entry
+                outfile.write(json.dumps(entry, ensure_ascii=False) + "\n")
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# The scripts import each other as top-level modules (they're run from this
+# directory), so do the same here
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,118 @@
+"""
+Tests for the Batch API job export and result import.
+
+    poetry run pytest 3_Data/3_translations/tests
+"""
+
+import json
+import os
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("tqdm")
+
+import batch_jobs  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures")
+# Batch API output for the jobs BATCHES exports (see _read_jsonl(RESULTS))
+RESULTS = os.path.join(FIXTURES, "batch_output.jsonl")
+
+
+def _tablet(id_: str) -> dict:
+    return {
+        "id": id_,
+        "transliteration": f"1 udu {id_}",
+        "genre": "Administrative",
+        "period": "Ur III (ca. 2100-2000 BC)",
+    }
+
+
+BATCHES = [
+    [_tablet("P000001")],  # translated
+    [_tablet("P000002"), _tablet("P000003")],  # packed, translated
+    [_tablet("P000004")],  # request error
+    [_tablet("P000005"), _tablet("P000006")],  # packed, one output missing
+    [_tablet("P000007")],  # no result
+    [_tablet("P000008")],  # status 500
+]
+
+
+def _read_jsonl(path: str) -> list[dict]:
+    with open(path, encoding="utf-8") as infile:
+        return [json.loads(line) for line in infile if line.strip()]
+
+
+def test_custom_id():
+    assert batch_jobs.custom_id(["P000001"]) == "tablet-P000001"
+    packed = batch_jobs.custom_id(["P000002", "P000003"])
+    assert packed == "pack-472b479345505b98"
+    # Stable across exports, and depends on the order of the tablets
+    assert batch_jobs.custom_id(["P000002", "P000003"]) == packed
+    assert batch_jobs.custom_id(["P000003", "P000002"]) != packed
+
+
+def test_export_jobs(tmp_path):
+    path = str(tmp_path / "jobs.jsonl")
+    assert batch_jobs.export_jobs(BATCHES, path, model="gpt-4o-mini") == [path]
+
+    jobs = _read_jsonl(path)
+    metas = _read_jsonl(batch_jobs.meta_path(path))
+    assert [job["custom_id"] for job in jobs] == [
+        meta["custom_id"] for meta in metas
+    ]
+    assert [meta["tablets"] for meta in metas] == BATCHES
+    assert all(job["url"] == batch_jobs.BATCH_URL for job in jobs)
+    # Packed requests number their inputs
+    assert "=== INPUT 2 ===" in jobs[1]["body"]["messages"][-1]["content"]
+    assert "=== INPUT" not in jobs[0]["body"]["messages"][-1]["content"]
+
+    # The fixture answers the ids export_jobs gives these tablets
+    result_ids = {result["custom_id"] for result in _read_jsonl(RESULTS)}
+    assert result_ids - {job["custom_id"] for job in jobs} == {"tablet-P999999"}
+
+
+def test_export_jobs_splits_files(tmp_path):
+    path = str(tmp_path / "jobs.jsonl")
+    paths = batch_jobs.export_jobs(BATCHES, path, model="gpt-4o-mini", max_requests=4)
+    assert paths == [
+        str(tmp_path / "jobs_00000.jsonl"),
+        str(tmp_path / "jobs_00001.jsonl"),
+    ]
+    assert [len(_read_jsonl(job_path)) for job_path in paths] == [4, 2]
+    assert len(_read_jsonl(batch_jobs.meta_path(path))) == len(BATCHES)
+
+
+def test_import_results(tmp_path):
+    path = str(tmp_path / "jobs.jsonl")
+    batch_jobs.export_jobs(BATCHES, path, model="gpt-4o-mini")
+
+    report = batch_jobs.import_results([RESULTS], batch_jobs.meta_path(path))
+
+    assert [(tablet["id"], text) for tablet, text in report.translated] == [
+        ("P000001", "1 sheep, for the temple"),
+        ("P000002", "2 goats"),
+        ("P000003", "3 jars of beer"),
+    ]
+    assert report.translated[0][0] == BATCHES[0][0]
+    assert report.failed == [
+        "tablet-P000004",
+        batch_jobs.custom_id(["P000005", "P000006"]),
+        "tablet-P000008",
+    ]
+    assert report.missing == ["tablet-P000007"]
+    assert report.unknown == ["tablet-P999999"]
+
+
+def test_import_results_across_files(tmp_path):
+    path = str(tmp_path / "jobs.jsonl")
+    batch_jobs.export_jobs(BATCHES, path, model="gpt-4o-mini")
+    results = _read_jsonl(RESULTS)
+    paths = [str(tmp_path / "results_0.jsonl"), str(tmp_path / "results_1.jsonl")]
+    for results_path, part in zip(paths, (results[:2], results[2:])):
+        with open(results_path, "w", encoding="utf-8") as outfile:
+            outfile.write("".join(json.dumps(result) + "\n" for result in part))
+
+    report = batch_jobs.import_results(paths, batch_jobs.meta_path(path))
+    assert len(report.translated) == 3
+    assert report.missing == ["tablet-P000007"]
@@ -0,0 +1,73 @@
+"""
+Tests for the translation budget.
+
+    poetry run pytest 3_Data/3_translations/tests
+"""
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("tqdm")
+
+from async_runner import Completion  # noqa: E402
+from scheduler import Budget, Estimate, Pricing  # noqa: E402
+
+PRICING = Pricing(1.0, 2.0)  # $1 / $2 per million tokens
+
+
+def test_reserve_caps_max_tokens_at_what_is_left():
+    budget = Budget(PRICING, max_tokens=3000, prompt_margin=1)
+    assert budget.reserve(500, 2000) == Estimate(500, 2000)
+    # 500 left: the prompt and 100 tokens of completion
+    assert budget.reserve(400, 2000, min_tokens=50) == Estimate(400, 100)
+    assert budget.reserve(10, 2000) is None
+    assert budget.tokens == 3000
+
+
+def test_reserve_refuses_below_min_tokens():
+    budget = Budget(PRICING, max_tokens=1000, prompt_margin=1)
+    assert budget.reserve(800, 2000, min_tokens=300) is None
+    assert budget.tokens == 0
+
+
+def test_reserve_caps_by_cost():
+    # $0.005 buys a 1000-token prompt ($0.001) and 2000 completion tokens
+    budget = Budget(PRICING, max_cost=0.005, prompt_margin=1)
+    assert budget.reserve(1000, 4000) == Estimate(1000, 2000)
+    assert budget.reserve(1, 4000) is None
+    assert budget.cost <= 0.005
+
+
+def test_settled_usage_never_exceeds_the_cap():
+    budget = Budget(PRICING, max_tokens=10_000)
+    reservations = []
+    while (reservation := budget.reserve(900, 2000, min_tokens=100)) is not None:
+        reservations.append(reservation)
+    # Every request uses all of its max_tokens, the worst case
+    for reservation in reservations:
+        budget.settle(reservation, Completion("", *reservation))
+    assert budget.tokens <= 10_000
+
+
+def test_prompt_is_reserved_with_a_margin():
+    budget = Budget(PRICING, max_tokens=10_000, prompt_margin=1.25)
+    assert budget.reserve(801, 2000) == Estimate(1002, 2000)
+
+
+def test_no_reservations_once_actual_usage_reaches_the_cap():
+    budget = Budget(PRICING, max_tokens=3000, prompt_margin=1.25)
+    reservation = budget.reserve(800, 2000)
+    assert reservation == Estimate(1000, 2000)
+    # The prompt was twice as long as estimated (more than the margin)
+    budget.settle(reservation, Completion("", 1600, 1500))
+    assert budget.tokens == 3100
+    assert budget.exceeded
+    assert budget.reserve(1, 2000) is None
+    assert budget.tokens == 3100
+
+
+def test_unlimited_budget_keeps_max_tokens():
+    budget = Budget(PRICING, prompt_margin=1)
+    assert budget.reserve(500, 2000) == Estimate(500, 2000)
+    budget.release(Estimate(500, 2000))
+    assert budget.tokens == 0
@@ -0,0 +1,88 @@
+"""
+Tests for template reuse in translate.py: reused tablets are only recorded in
+the reuse ledger, never written to (or exported from) the translation store.
+
+    poetry run pytest 3_Data/3_translations/tests
+"""
+
+import json
+
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("datasets")
+pytest.importorskip("transformers")
+pytest.importorskip("tqdm")
+
+import translate  # noqa: E402
+from templates import ReuseLedger  # noqa: E402
+from translation_store import TranslationStore  # noqa: E402
+
+
+def _tablet(id_: str, number: int, name: str) -> translate.Tablet:
+    text = f"{number}(diš) udu\nki {name}-ta\nšu ba-ti\niti {name}"
+    example = {"id": id_, "genre": "Administrative", "period": "Ur III"}
+    return translate.Tablet(example, text, 10)
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = TranslationStore(str(tmp_path / "store"))
+    yield store
+    store.close()
+
+
+def _ledger_ids(path) -> list[str]:
+    with open(path, encoding="utf-8") as infile:
+        return [json.loads(line)["id"] for line in infile]
+
+
+def test_reused_members_wait_for_the_representative(tmp_path, store):
+    ledger_path = tmp_path / "template_reuse.jsonl"
+    reuse = translate.TemplateReuse(ReuseLedger(str(ledger_path)))
+    tablets = [_tablet("P1", 1, "a"), _tablet("P2", 2, "bb"), _tablet("P3", 3, "c")]
+
+    kept = translate._reuse_templates(tablets, [], reuse)
+
+    assert [tablet.example["id"] for tablet in kept] == ["P1"]
+    assert reuse.num_pending == 2
+    assert not ledger_path.exists()
+
+    # The representative comes back: only it goes into the store
+    translate.write_output(store, kept[0].example, kept[0].text, "1 sheep")
+    assert reuse.record("P1", "1 sheep") == 2
+    assert reuse.num_pending == 0
+    assert _ledger_ids(ledger_path) == ["P2", "P3"]
+    assert store.ids() == {"P1"}
+
+
+def test_untranslated_representative_keeps_members_pending(tmp_path):
+    reuse = translate.TemplateReuse(ReuseLedger(str(tmp_path / "reuse.jsonl")))
+    tablets = [_tablet("P1", 1, "a"), _tablet("P2", 2, "b")]
+    translate._reuse_templates(tablets, [], reuse)
+
+    assert reuse.record("P1", "") == 0
+    assert reuse.num_pending == 1
+    assert "P2" not in reuse.ledger
+
+
+def test_reused_member_is_not_exported(tmp_path, store):
+    representative = _tablet("P1", 1, "a")
+    translate.write_output(store, representative.example, representative.text, "T")
+    reuse = translate.TemplateReuse(ReuseLedger(str(tmp_path / "reuse.jsonl")))
+
+    kept = translate._reuse_templates(
+        [_tablet("P2", 2, "bb")], list(store.records()), reuse
+    )
+
+    assert kept == []
+    assert "P2" in reuse.ledger
+    dataset = store.to_dataset()
+    assert dataset["id"] == ["P1"]
+    assert dataset.column_names == [
+        "id",
+        "transliteration",
+        "translation",
+        "genre",
+        "period",
+    ]
@@ -1,239 +1,514 @@
-import json
-import re
+"""
+Augments the SumTablets train split with GPT translations, written to the
+translation store in `./generated_store/` (see `translation_store.py`):
+
+    {"id", "transliteration", "translation", "genre", "period"}
+
+Translations in the old layout (`./generated/{id}.json`) are migrated into the
+store the first time it's opened.
+
+Tablets whose (cleaned) transliteration is longer than MAX_LEN tokens are
+written with an empty translation and not sent.
+
+With `--pack-tokens`, short tablets are packed into one request (up to that
+many tokens of transliteration and `--pack-size` tablets), so the few-shot
+examples are paid for once per request rather than once per tablet. If a
+packed response can't be split back into one translation per tablet, its
+tablets are sent again one at a time.
+
+With `--batch-export jobs.jsonl`, the requests are written as OpenAI Batch API
+job files instead of being sent; `--batch-import results.jsonl` later writes
+the translations from the results file(s) (see `batch_jobs.py`). Tablets
+whose request failed are left pending, so exporting again resubmits them.
+
+With `--few-shot K`, the fixed few-shot examples are replaced by the K most
+similar tablets from the CDLI parallel data (`train.csv` from
+`format_cdli.py`), within `--few-shot-tokens` (see `few_shot.py`).
+
+With `--template-reuse`, pending tablets that share a masked template (numbers,
+names and dates masked; see `templates.py`) with each other or with a tablet
+that's already translated are clustered, and only one per cluster (the
+representative) is sent. Once the representative's translation is in the
+store, the others are recorded in `template_reuse.jsonl` (not in the store:
+they'd get the representative's numbers, names and dates) and skipped on
+later runs, unless `--translate-reused` is given. Tablets whose
+representative wasn't translated (e.g. cut by `--limit` or the budget) stay
+pending.
+
+Pending tablets are ordered so that the (period, genre) groups with the fewest
+translations come first, and `--budget-tokens` / `--budget-usd` cap a run
+(see `scheduler.py`: prompts are only estimated, so a run can go over the cap
+by the error of that estimate). Usage per (period, genre), with throughput, is
+appended to `usage_ledger.csv`.
+
+Requests are sent concurrently (see `async_runner.py`). Each translation is
+written to the store as soon as it arrives, so an interrupted run picks up
+where it left off.
+
+e.g. against a local OpenAI-compatible mock server:
+    poetry run python translate.py --base-url http://localhost:8000/v1 --limit 10
+"""
 
+import argparse
+import asyncio
+import os
+from collections import Counter, defaultdict
+from typing import NamedTuple
+
+from async_runner import AsyncRunner
+from batch_jobs import export_jobs, import_results, meta_path
 from datasets import load_dataset
-from openai import OpenAI
+from few_shot import MAX_EXAMPLE_TOKENS, PARALLEL_DATA, FewShotSelector
+from prompts import (
+    PROMPT,
+    build_messages,
+    build_packed_messages,
+    clean_transliteration,
+    parse_packed_response,
+)
+from scheduler import (
+    COMPLETION_RATIO,
+    LEDGER_FILE,
+    PRICING,
+    Budget,
+    Pricing,
+    UsageLedger,
+    estimate,
+    prioritize,
+)
+from templates import REUSE_LEDGER, ReuseLedger, template_hash
 from tqdm import tqdm
+from translation_store import STORE_DIR, TranslationStore
 from transformers import AutoTokenizer
 
-client = OpenAI(api_key="")
-
-SYSTEM = """
-You are a highly skilled translator specializing in Sumerian.
-
-Your task is to accurately translate Sumerian transliterations into English while maintaining the original meaning and context.
-
-Please follow these steps:
-1) Analyze the Sumerian text provided by the user, considering the context and any specific terminology. Break down the text into smaller segments, such as sentences or phrases, to ensure accurate translation.
-2) For each segment, provide a definitive English translation that captures the intended meaning. Do not include any Sumerian transliteration in the final translation.
-3) Once you have translated all the segments, combine them into a coherent English translation that maintains the structure and flow of the original Sumerian text.
-Do not include any additional information or commentary in your translation.
-
-When translating Sumerian to English, keep in mind the following grammatical information:
-1) Sumerian is an agglutinative language, meaning that words are formed by combining smaller morphemes or grammatical elements.
-2) The word order in Sumerian is Subject-Object-Verb (SOV).
-3) Sumerian uses a system of grammatical cases to indicate the function of a noun in a sentence. The main cases include the ergative (subject of a transitive verb), absolutive (object of a transitive verb or subject of an intransitive verb), genitive (indicating possession), and dative (indicating the recipient or beneficiary of an action).
-4) Verbs in Sumerian have a complex system of affixes that indicate tense, aspect, mood, and agreement with the subject and object.
-5) Pronouns in Sumerian are generally not used, as the verb affixes can indicate the person and number of the subject and object.
-6) Sumerian does not have articles (e.g., "a," "an," "the") or conjunctions (e.g., "and," "but," "or").
-"""
-
-PROMPT = """
-INPUT:
-ud re-a-ta ud an ki-bi-ta...
-ŋi₆ re-a-ta ŋi₆ an ki-bi-ta...
-...mu nam...
-...ba-tu-ud-da-a-ba
-{d}ama{d}inana nam <unk> še₃ ba-tuku-a-ba
-{d}ama{d}inana an ki-a ba-hal-hal-la-a-ba
-{d}ama{d}inana...ba-a-peš u₃-tud-da-a-ba
-diŋir kurum₆-ma-bi <unk>...unu₂-bi-še₃ ba-ab-keše₂-a-ba
-diŋir šar₂-šar₂ kiŋ₂-ŋa₂ al-sug₂-ge-eš diŋir tur-tur du₂-lum im-il₂-il₂-e-ne
-diŋir id₂ im dun-dun-u₃-ne sahar-bi ha-ra-li im-dub-dub-be₂-ne
-diŋir im ar₃-ar₃-re-ne zi-bi inim am₃-ma-ŋar-re-ne
-ud-ba ŋeštug₂ daŋal mud diŋir šar₂-šar₂ ŋal₂-ŋal₂
-{d}en-ki-ke₄ engur burudₓ(U) a-sur-ra ki diŋir na-me šag₄-bi u₆ nu-um-me
-ki-nu₂-ni i₃-nu₂ u₃ ku nu-um-zi-zi
-diŋir er₂-ra im-pad-pad-ne a-nir ŋal₂ i₃-ak im-me-ne
-lu₂ ku-ra i₃-nu₂-a-ra ki-nu₂-bi nu-um-zi-zi-ra
-{d}namma-ke₄ ama palil u₃-tud diŋir šar₂-šar₂-ra-ke₄-ne
-er₂-ra diŋir-re-e-ne dumu-ni-ir ba-ši-in-de₆
-...mu-un-ši-nu₂-u₃-nam u₃ mu-un-ši-ku-ku-na-nam
-...<unk> <unk>...
-dim₃-me₂-er šu dim₂-dim₂-ma-zu...gu₂-bi im-tu₁₀-tu₁₀-ne
-du₅-mu-ŋu₁₀ ki-nu₂-zu zig₃-ga...ma-al-la-zu-ta na-aŋ₂-kug-zu u₃-mu-e-kiŋ₂-ŋa₂
-kiŋ₂-sig₁₀ dim₃-me₂-er-e-ne-ke₄...du₂-lum-bi ha-ba-tu-lu-ne
-{d}en-ki-ke₄ inim ama-na {d}namma-ke₄ ki-nu₂-na ba-ta-zig₃
-hal-an-kug niŋin₂ šag₄ kuš₂-u₃-da-na haš...
-
-OUTPUT:
-In those days, in the days when heaven and earth were created; in those nights, in the nights when heaven and earth were created; in those years, in the years when the fates were determined; when the Anuna gods were born; when the goddesses were taken in marriage; when the goddesses were distributed in heaven and earth; when the goddesses...became pregnant and gave birth; when the gods were obliged...their food...for their meals; the senior gods oversaw the work, while the minor gods were bearing the toil. The gods were digging the canals and piling up the silt in Harali. The gods, dredging the clay, began complaining about this life.
-
-At that time, the one of great wisdom, the creator of all the senior gods, Enki lay on his bed, not waking up from his sleep, in the deep engur, in the flowing water, the place the inside of which no other god knows. The gods said, weeping: "He is the cause of the lamenting!" Namma, the primeval mother who gave birth to the senior gods, took the tears of the gods to the one who lay sleeping, to the one who did not wake up from his bed, to her son: "Are you really lying there asleep, and...not awake? The gods, your creatures, are smashing their...My son, wake up from your bed! Please apply the skill deriving from your wisdom and create a substitute for the gods so that they can be freed from their toil!"
-
-At the word of his mother Namma, Enki rose up from his bed.
-
-INPUT:
-2(diš) udu
-1(diš) sila₄
-ba-uš₂
-u₄ 1(u)-kam
-ki be-li₂-i₃-li₂-ta
-{d}šul-gi-iri-mu
-šu ba-ti
-iti <unk> bi₂-gu₇
-mu us₂-sa si-ma-num₂{ki} ba-hul
-3(diš)
-
-OUTPUT:
-2 sheep, 1 lamb. Slaughtered on the 10th day.
-Šulgi-irimu received from Bēlī-ilī.
-Month: “Ubi feast"
-Year: “Simanum was destroyed.”
-Total: 3.
-
----
-
-INPUT:
-1(u) 5(diš) guruš
-a₂ u₄ 1(diš)-bi gu-nigin₂ 4(u) 5(diš)-am₃
-šuniŋin 1(gešʾu) 2(geš₂) 4(u) 5(diš) gu-nigin₂-am₃
-a₂ u₄ 1(u) 7(diš)-bi-im
-
-OUTPUT:
-15 male laborers,
-Labor of 1 day: 45 bales.
-Total: 765 bales, 17 days of labor.
-
----
-
-INPUT:
-2(u) 3(diš) ab₂
-4(diš) gu₄
-2(gešʾu) 3(u) 2(diš) u₈
-1(geš₂) 4(u) 5(diš) udu
-4(diš) sila₄ ga
-...e₂-udu-niga
-...
-sa₂-du₁₁...
-iti ki-siki{d}nin-a-zu
-mu ki-maš{ki} u₃ hu-ur₅-ti{ki} ba-hul
-2(u) 7(diš) gu₄ 2(gešʾu)...
-
-OUTPUT:
-23 cows
-4 oxen
-1232 ewes 105 rams, 4 suckling lambs...house of grain-fed sheep; regular rations
-Month: “kisiki of Ninazu”
-Year: “Kimaš and Hurti were destroyed.”
-Total: 27 oxen, 1341 sheep.
-
----
-
-INPUT:
-{d}šu{d}suen
-nita kal-ga
-lugal uri₅{ki}ma
-lugal an ub-da limmu₂-ba
-lu₂{d}na-ru₂...
-dub-sar
-dumu he-sa₆
-arad₂-zu
-
-OUTPUT:
-Šū-Suen, strong man, king of Ur, king of heaven, king of the Four Corners.
-Lu-Nurua, scribe, son of Ḫesa, is your servant.
-
----
-
-INPUT:
-8(diš) udu niga
-u₄ 2(u) la₂ 1(diš)-kam
-ki ab-ba-sa₆-ga-ta
-na-lu₅
-i₃-dab₅
-iti maš-da₃-gu₇
-mu ur-bi₂-lum{ki} ba-hul
-8(diš)
-
-OUTPUT:
-8 fattened sheep.
-On the 19th day.
-From Abbasaga.
-Accepted by Nalu.
-Month: “Gazelle feast,”
-Year: “Urbilum was destroyed;”
-Total: 8.
-
----
-
-"""
-
-SPECIAL_TOKS_TO_REMOVE = {
-    "<SURFACE>",
-    "<COLUMN>",
-    "<RULING>",
-    "<BLANK_SPACE>",
-}
+LEGACY_DIR = "./generated"
 
-
-dataset = load_dataset("colesimmons/SumTablets")
-tokenizer = AutoTokenizer.from_pretrained(
-    "ColeSimmons/SumerianTransliterationTokenizer_Roberta"
-)
+DATASET = "colesimmons/SumTablets"
+TOKENIZER = "ColeSimmons/SumerianTransliterationTokenizer_Roberta"
 MAX_LEN = 256
 
+# How many partly filled requests `pack` tries to fit each tablet into
+MAX_OPEN_BATCHES = 16
+
+
+class Tablet(NamedTuple):
+    example: dict
+    text: str  # cleaned transliteration
+    length: int  # in tokenizer tokens
+
+    @property
+    def group(self) -> tuple[str, str]:
+        return self.example["period"], self.example["genre"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Translate tablets with GPT.")
+    parser.add_argument("--split", type=str, default="train")
+    parser.add_argument("--store", type=str, default=STORE_DIR)
+    parser.add_argument(
+        "--legacy-dir",
+        type=str,
+        default=LEGACY_DIR,
+        help="Directory of {id}.json files to migrate into the store",
+    )
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--model", type=str, default="gpt-4")
+    parser.add_argument(
+        "--base-url", type=str, default=None, help="OpenAI-compatible endpoint"
+    )
+    parser.add_argument("--api-key", type=str, default=os.getenv("OPENAI_API_KEY"))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=float, default=500, help="Requests/minute")
+    parser.add_argument("--tpm", type=float, default=150_000, help="Tokens/minute")
+    parser.add_argument("--retries", type=int, default=6)
+    parser.add_argument(
+        "--pack-tokens",
+        type=int,
+        default=0,
+        help="Pack tablets into requests of up to this many tokens (0: don't)",
+    )
+    parser.add_argument("--pack-size", type=int, default=8)
+    parser.add_argument(
+        "--batch-export", type=str, default=None, help="Write Batch API job files"
+    )
+    parser.add_argument(
+        "--batch-import",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Read Batch API results files",
+    )
+    parser.add_argument(
+        "--batch-meta",
+        type=str,
+        default=None,
+        help="Meta file written by --batch-export (needed with --batch-import)",
+    )
+    parser.add_argument("--budget-tokens", type=int, default=None)
+    parser.add_argument("--budget-usd", type=float, default=None)
+    parser.add_argument(
+        "--price",
+        type=float,
+        nargs=2,
+        default=None,
+        metavar=("PROMPT", "COMPLETION"),
+        help="USD per million tokens (default: known prices for --model)",
+    )
+    parser.add_argument(
+        "--completion-ratio",
+        type=float,
+        default=COMPLETION_RATIO,
+        help="Expected translation tokens per transliteration token",
+    )
+    parser.add_argument("--ledger", type=str, default=LEDGER_FILE)
+    parser.add_argument(
+        "--few-shot",
+        type=int,
+        default=0,
+        help="Retrieve this many similar examples per request (0: fixed examples)",
+    )
+    parser.add_argument("--few-shot-tokens", type=int, default=MAX_EXAMPLE_TOKENS)
+    parser.add_argument("--parallel-data", type=str, default=PARALLEL_DATA)
+    parser.add_argument(
+        "--template-reuse",
+        action="store_true",
+        help="Send one tablet per template cluster",
+    )
+    parser.add_argument(
+        "--translate-reused",
+        action="store_true",
+        help="Also send tablets recorded as template-reused",
+    )
+    parser.add_argument("--reuse-ledger", type=str, default=REUSE_LEDGER)
+    args = parser.parse_args()
+
+    if args.price is not None:
+        pricing = Pricing(*args.price)
+    elif args.model in PRICING:
+        pricing = PRICING[args.model]
+    elif args.budget_usd is not None:
+        parser.error(f"No known price for {args.model}; pass --price")
+    else:
+        pricing = Pricing(0.0, 0.0)
+
+    store = TranslationStore(args.store)
+    store.migrate_directory(args.legacy_dir)
+
+    if args.batch_import:
+        if args.batch_meta is None:
+            parser.error("--batch-import needs --batch-meta")
+        try:
+            _import_batch_results(store, args.batch_import, args.batch_meta)
+        finally:
+            store.close()
+        return
+
+    dataset = load_dataset(DATASET)[args.split].shuffle(seed=2)
+    tokenizer = AutoTokenizer.from_pretrained(TOKENIZER)
+    reuse = TemplateReuse(ReuseLedger(args.reuse_ledger))
+    pending = [
+        example
+        for example in dataset
+        if example["id"] not in store
+        and (args.translate_reused or example["id"] not in reuse.ledger)
+    ]
+    print(f"{len(store)} already translated, {len(pending)} to go")
+
+    tablets = []
+    for example in pending:
+        text = clean_transliteration(example["transliteration"])
+        length = len(tokenizer(text, padding=False, truncation=False)["input_ids"])
+        if length > MAX_LEN:
+            # Too long: not sent
+            write_output(store, example, text, "")
+            continue
+        tablets.append(Tablet(example, text, length))
+
+    translated = [record for record in store.records() if record.get("translation")]
+
+    # Least-translated (period, genre) groups first
+    counts = Counter((record["period"], record["genre"]) for record in translated)
+    tablets = prioritize(tablets, lambda tablet: tablet.group, counts)
+    if args.template_reuse and not args.translate_reused:
+        tablets = _reuse_templates(tablets, translated, reuse)
+    if args.limit is not None:
+        tablets = tablets[: args.limit]
+    batches = pack(tablets, args.pack_tokens, args.pack_size)
+
+    selector = FewShotSelector.from_csv(args.parallel_data) if args.few_shot else None
+
+    def _examples(batch: list[Tablet]) -> str:
+        if selector is None:
+            return PROMPT
+        return selector.examples(
+            "\n".join(tablet.text for tablet in batch),
+            k=args.few_shot,
+            max_tokens=args.few_shot_tokens,
+            exclude={tablet.example["id"] for tablet in batch},
+        )
 
-def translate_text(example) -> int:
-    text = example["transliteration"]
-    id = example["id"]
+    examples = [_examples(batch) for batch in batches]
+
+    def _estimate(batch: list[Tablet], batch_examples: str):
+        lengths = [tablet.length for tablet in batch]
+        messages = _messages(batch, batch_examples)
+        return estimate(messages, lengths, args.completion_ratio)
+
+    estimates = [_estimate(*item) for item in zip(batches, examples)]
+    budget = Budget(pricing, args.budget_tokens, args.budget_usd)
+    num_within_budget = budget.plan(estimates)
+    batches = batches[:num_within_budget]
+    examples = examples[:num_within_budget]
+    estimates = estimates[:num_within_budget]
+    estimated_cost = sum(pricing.cost(*e) for e in estimates)
+    print(
+        f"{sum(map(len, batches))} tablets in {len(batches)} requests, "
+        f"~{sum(e.total_tokens for e in estimates)} tokens (~${estimated_cost:.2f})"
+    )
+
+    if args.batch_export:
+        store.close()
+        records = [[_record(tablet) for tablet in batch] for batch in batches]
+        paths = export_jobs(
+            records, args.batch_export, model=args.model, examples=examples
+        )
+        print(f"Wrote {len(batches)} requests to {', '.join(paths)}")
+        print(f"Wrote {meta_path(args.batch_export)}")
+        return
+
+    runner = AsyncRunner(
+        model=args.model,
+        base_url=args.base_url,
+        # Local servers usually don't check the key, but the client needs one
+        api_key=args.api_key or ("unused" if args.base_url else None),
+        concurrency=args.concurrency,
+        requests_per_minute=args.rpm,
+        tokens_per_minute=args.tpm,
+        retries=args.retries,
+    )
+
+    ledger = UsageLedger(pricing)
+    over_budget = []
+
+    async def _request(batch: list[Tablet], batch_examples: str):
+        """Send a request if the budget allows it (else None)."""
+        # Reserve the worst case (prompt + max_tokens), with max_tokens cut
+        # down to what's left of the budget, but not below the expected length
+        batch_estimate = _estimate(batch, batch_examples)
+        reservation = budget.reserve(
+            batch_estimate.prompt_tokens,
+            runner.max_tokens,
+            min_tokens=batch_estimate.completion_tokens,
+        )
+        if reservation is None:
+            over_budget.extend(batch)
+            return None
+        try:
+            completion = await runner.complete(
+                _messages(batch, batch_examples),
+                max_tokens=reservation.completion_tokens,
+            )
+        except Exception:
+            budget.release(reservation)
+            raise
+        budget.settle(reservation, completion)
+        return completion
+
+    async def _translate(item: tuple[list[Tablet], str]) -> int:
+        batch, batch_examples = item
+        completion = await _request(batch, batch_examples)
+        if completion is None:
+            return 0
+        groups = [tablet.group for tablet in batch]
+        lengths = [tablet.length for tablet in batch]
+        if len(batch) == 1:
+            translations = [completion.content]
+        else:
+            translations = parse_packed_response(completion.content, len(batch))
+        if translations is None:
+            ledger.record(groups, lengths, completion, translated=False)
+            tqdm.write(f"Couldn't parse a packed response, unpacking {len(batch)}")
+            usages = await asyncio.gather(
+                *(_translate(([tablet], _examples([tablet]))) for tablet in batch)
+            )
+            return completion.total_tokens + sum(usages)
+        ledger.record(groups, lengths, completion)
+        for tablet, translation in zip(batch, translations):
+            write_output(store, tablet.example, tablet.text, translation)
+            reuse.record(tablet.example["id"], translation)
+        return completion.total_tokens
 
-    # See if file already exists
     try:
-        with open(f"./generated/{id}.json", "r") as f:
-            print(f"Skipping {id} (already translated)")
+        _, failed = runner.run(
+            list(zip(batches, examples)), _translate, total=len(batches)
+        )
+    finally:
+        store.close()
+        ledger.write(args.ledger)
+    print(f"Spent: {budget.tokens} tokens (${budget.cost:.2f})")
+    if budget.exceeded:
+        print("Over budget: some prompts were longer than estimated")
+    if over_budget:
+        print(f"Not sent (over budget): {len(over_budget)} tablets")
+    if reuse.num_pending:
+        print(f"Template reuse: {reuse.num_pending} tablets left pending")
+    if failed:
+        num_failed = sum(len(batch) for (batch, _), _ in failed)
+        print(f"Failed: {num_failed} tablets (re-run to retry)")
+
+
+class TemplateReuse:
+    """
+    Tablets that reuse a representative's translation, held back until it's
+    in the store and only then recorded in the ledger.
+    """
+
+    def __init__(self, ledger: ReuseLedger):
+        self.ledger = ledger
+        # representative id -> [(tablet, template hash)]
+        self.members: dict[str, list[tuple[Tablet, str]]] = defaultdict(list)
+
+    @property
+    def num_pending(self) -> int:
+        return sum(map(len, self.members.values()))
+
+    def add(self, representative: str, tablet: Tablet, key: str):
+        self.members[representative].append((tablet, key))
+
+    def record(self, representative: str, translation: str) -> int:
+        """Record the members of a representative that has been translated."""
+        if not translation or representative not in self.members:
             return 0
-    except FileNotFoundError:
-        pass
-
-    for token in SPECIAL_TOKS_TO_REMOVE:
-        text = text.replace(token, "")
-    text = text.replace("<unk>", "...")
-    text = re.sub(r"\n+", "\n", text)
-    text = re.sub(r"\ *\.\.\.\ *", "...", text)
-    text = text.strip()
-
-    tokenized = tokenizer(text, padding=False, truncation=False)
-    if len(tokenized["input_ids"]) > MAX_LEN:
-        print(f"Skipping {id} (too long)")
-        translation = ""
-        usage = 0
-    else:
-        prompt = PROMPT + f"INPUT:\n{text}\n\nOUTPUT:\n"
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content": SYSTEM},
-                {"role": "user", "content": prompt},
-            ],
-            max_tokens=2000,
-            temperature=0.5,
-            frequency_penalty=0.2,
+        members = self.members.pop(representative)
+        self.ledger.add_all(
+            [
+                {
+                    "id": tablet.example["id"],
+                    "representative": representative,
+                    "template": key,
+                }
+                for tablet, key in members
+            ]
         )
-        translation = response.choices[0].message.content
-        usage = response.usage.total_tokens
-
-    # Write to JSON file in ./generated/{id}.json
-    with open(f"./generated/{id}.json", "w", encoding="utf-8") as f:
-        out = {
-            "id": id,
+        return len(members)
+
+
+def _reuse_templates(
+    tablets: list[Tablet], translated: list[dict], reuse: TemplateReuse
+) -> list[Tablet]:
+    """
+    Keep one tablet per template cluster (the first, in priority order), and
+    none for templates that already have a translation. The rest are added to
+    `reuse`: those of already translated templates are recorded now, the
+    others once their representative is translated.
+    """
+    representatives = {}  # template hash -> id
+    stored = {}  # id -> translation, of the representatives already translated
+    for record in translated:
+        key = template_hash(record["transliteration"])
+        if key is not None and key not in representatives:
+            representatives[key] = record["id"]
+            stored[record["id"]] = record["translation"]
+
+    kept = []
+    num_reused = 0
+    for tablet in tablets:
+        key = template_hash(tablet.text)
+        if key is None:
+            kept.append(tablet)
+        elif key in representatives:
+            reuse.add(representatives[key], tablet, key)
+            num_reused += 1
+        else:
+            representatives[key] = tablet.example["id"]
+            kept.append(tablet)
+    num_recorded = sum(reuse.record(id_, text) for id_, text in stored.items())
+    print(
+        f"Template reuse: sending {len(kept)} tablets, reusing {num_reused} "
+        f"({num_recorded} recorded now)"
+    )
+    return kept
+
+
+def _messages(batch: list[Tablet], examples: str = PROMPT) -> list[dict]:
+    if len(batch) == 1:
+        return build_messages(batch[0].text, examples)
+    return build_packed_messages([tablet.text for tablet in batch], examples)
+
+
+def pack(tablets: list[Tablet], max_tokens: int, max_tablets: int) -> list[list]:
+    """
+    Group tablets into requests of up to `max_tokens` tokens and `max_tablets`
+    tablets, in order (first fit over the last few unfilled requests). Tablets
+    that don't fit with any others get a request to themselves, as do all
+    tablets if `max_tokens` is 0.
+    """
+    if max_tokens <= 0 or max_tablets <= 1:
+        return [[tablet] for tablet in tablets]
+    batches: list[list[Tablet]] = []
+    open_batches: list[tuple[list[Tablet], int]] = []  # (batch, tokens)
+    for tablet in tablets:
+        for i, (batch, num_tokens) in enumerate(open_batches):
+            if num_tokens + tablet.length <= max_tokens:
+                batch.append(tablet)
+                open_batches[i] = (batch, num_tokens + tablet.length)
+                if len(batch) == max_tablets:
+                    open_batches.pop(i)
+                break
+        else:
+            batch = [tablet]
+            batches.append(batch)
+            if tablet.length < max_tokens:
+                open_batches.append((batch, tablet.length))
+                if len(open_batches) > MAX_OPEN_BATCHES:
+                    open_batches.pop(0)
+    return batches
+
+
+def _record(tablet: Tablet) -> dict:
+    return {
+        "id": tablet.example["id"],
+        "transliteration": tablet.text,
+        "genre": tablet.example["genre"],
+        "period": tablet.example["period"],
+    }
+
+
+def _import_batch_results(
+    store: TranslationStore, results_paths: list[str], meta_file: str
+):
+    report = import_results(results_paths, meta_file)
+    num_written = 0
+    for record, translation in report.translated:
+        if record["id"] in store:
+            continue
+        write_output(store, record, record["transliteration"], translation)
+        num_written += 1
+
+    print(f"Translated: {len(report.translated)} tablets ({num_written} new)")
+    print(f"Failed: {len(report.failed)} requests")
+    print(f"Missing from the results: {len(report.missing)} requests")
+    if report.unknown:
+        print(f"Not in {meta_file}: {len(report.unknown)} requests")
+    if report.failed or report.missing:
+        failed_path = f"{os.path.splitext(meta_file)[0]}.failed.txt"
+        with open(failed_path, "w", encoding="utf-8") as outfile:
+            outfile.writelines(f"{id_}\n" for id_ in report.failed + report.missing)
+        print(f"Wrote their custom_ids to {failed_path}")
+        print("Their tablets are still pending: export again to resubmit them")
+
+
+def write_output(store: TranslationStore, example: dict, text: str, translation: str):
+    store.add(
+        {
+            "id": example["id"],
             "transliteration": text,
             "translation": translation,
             "genre": example["genre"],
             "period": example["period"],
         }
-        json.dump(out, f, ensure_ascii=False, indent=4)
-
-    return usage
-
-
-# Augment the dataset with translated text
-def augment_dataset():
-    num_tokens = 0
-    dataset["train"] = dataset["train"].shuffle(seed=2)
-    for example in tqdm(dataset["train"]):
-        num_tokens += translate_text(example)
-        print("Usage: ", num_tokens)
+    )
 
 
-augment_dataset()
+if __name__ == "__main__":
+    main()
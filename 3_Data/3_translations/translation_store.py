@@ -0,0 +1,191 @@
+"""
+Append-only store of generated translations, replacing one JSON file per
+tablet in `./generated/`.
+
+Records ({id, transliteration, translation, genre, period}) are appended as
+lines to JSONL segments:
+
+    generated_store/segment_{n:05d}.jsonl
+
+and an in-memory index maps each id to its latest record's location, so
+"is this tablet done?" is a dict lookup. The index is rebuilt by reading the
+segments sequentially when the store is opened.
+
+- Crash safety: each append is flushed and fsynced. A partial last line (from
+  a crash mid-write) is truncated away when the store is opened.
+- Updates: adding an id again appends a new record, which wins over the old
+  one. `compact` rewrites the store with only the latest record per id.
+- `to_dataset` builds a `datasets.Dataset` straight from the records.
+
+>>> store = TranslationStore()
+>>> store.migrate_directory("./generated")  # once, for the old layout
+>>> "P100001" in store
+"""
+
+import json
+import os
+import threading
+from typing import Iterator, Optional
+
+from datasets import Dataset
+
+STORE_DIR = "./generated_store"
+SEGMENT_BYTES = 64 * 1024**2
+SEGMENT_PREFIX = "segment_"
+SEGMENT_SUFFIX = ".jsonl"
+
+
+class TranslationStore:
+    def __init__(self, root: str = STORE_DIR, segment_bytes: int = SEGMENT_BYTES):
+        self.root = root
+        self.segment_bytes = segment_bytes
+        # id -> (segment, offset, length)
+        self.index: dict[str, tuple[int, int, int]] = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+        self._segments = sorted(
+            int(filename[len(SEGMENT_PREFIX) : -len(SEGMENT_SUFFIX)])
+            for filename in os.listdir(root)
+            if filename.startswith(SEGMENT_PREFIX)
+            and filename.endswith(SEGMENT_SUFFIX)
+        )
+        for segment in self._segments:
+            self._load_segment(segment)
+        if not self._segments:
+            self._segments.append(0)
+        self._file = open(self._segment_path(self._segments[-1]), "ab")
+
+    def _segment_path(self, segment: int) -> str:
+        filename = f"{SEGMENT_PREFIX}{segment:05d}{SEGMENT_SUFFIX}"
+        return os.path.join(self.root, filename)
+
+    def _load_segment(self, segment: int):
+        path = self._segment_path(segment)
+        offset = 0
+        with open(path, "rb") as infile:
+            for line in infile:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("partial line")
+                    record = json.loads(line)
+                except ValueError:
+                    print(f"Truncating {path} at byte {offset} (partial write)")
+                    break
+                self.index[record["id"]] = (segment, offset, len(line))
+                offset += len(line)
+        if offset != os.path.getsize(path):
+            with open(path, "r+b") as outfile:
+                outfile.truncate(offset)
+
+    def __contains__(self, id: str) -> bool:
+        return id in self.index
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def ids(self) -> set[str]:
+        return set(self.index)
+
+    def get(self, id: str) -> Optional[dict]:
+        location = self.index.get(id)
+        if location is None:
+            return None
+        segment, offset, length = location
+        with open(self._segment_path(segment), "rb") as infile:
+            infile.seek(offset)
+            return json.loads(infile.read(length))
+
+    def add(self, record: dict, sync: bool = True):
+        """
+        Append a record. With `sync=False` it isn't fsynced (call `sync` after
+        a bulk load).
+        """
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            position = self._file.tell()
+            if position > 0 and position + len(line) > self.segment_bytes:
+                self._roll()
+            offset = self._file.tell()
+            self._file.write(line)
+            self._file.flush()
+            if sync:
+                os.fsync(self._file.fileno())
+            self.index[record["id"]] = (self._segments[-1], offset, len(line))
+
+    def sync(self):
+        with self._lock:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+
+    def _roll(self):
+        self._file.close()
+        self._segments.append(self._segments[-1] + 1)
+        self._file = open(self._segment_path(self._segments[-1]), "ab")
+
+    def records(self) -> Iterator[dict]:
+        """The latest record of every id, reading each segment once."""
+        with self._lock:
+            self._file.flush()
+            locations = sorted(self.index.values())
+        open_segment, infile = None, None
+        try:
+            for segment, offset, length in locations:
+                if segment != open_segment:
+                    if infile is not None:
+                        infile.close()
+                    infile = open(self._segment_path(segment), "rb")
+                    open_segment = segment
+                infile.seek(offset)
+                yield json.loads(infile.read(length))
+        finally:
+            if infile is not None:
+                infile.close()
+
+    def compact(self):
+        """
+        Rewrite the store with only the latest record of every id. The new
+        segments are complete before the old ones are deleted; if that's
+        interrupted, the leftover duplicates are harmless (latest wins).
+        """
+        old_segments = list(self._segments)
+        records = list(self.records())
+        with self._lock:
+            self._roll()
+            self.index = {}
+        for record in records:
+            self.add(record, sync=False)
+        self.sync()
+        with self._lock:
+            for segment in old_segments:
+                os.remove(self._segment_path(segment))
+            self._segments = [s for s in self._segments if s not in old_segments]
+        print(f"Compacted into {len(self._segments)} segments ({len(self)} records)")
+
+    def to_dataset(self, translated_only: bool = True) -> Dataset:
+        records = self.records()
+        if translated_only:
+            records = (r for r in records if r.get("translation", "") != "")
+        return Dataset.from_list(list(records))
+
+    def migrate_directory(self, directory: str) -> int:
+        """Add the `{id}.json` files of the old layout that aren't in the store."""
+        if not os.path.isdir(directory):
+            return 0
+        num_added = 0
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith(".json"):
+                continue
+            if filename.removesuffix(".json") in self:
+                continue
+            with open(os.path.join(directory, filename), encoding="utf-8") as infile:
+                self.add(json.load(infile), sync=False)
+            num_added += 1
+        self.sync()
+        if num_added:
+            print(f"Migrated {num_added} files from {directory}")
+        return num_added
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,151 @@
+"""
+Sequence packing for MLM pretraining of the glyph encoder.
+
+Instead of padding each tablet to `seq_len` (most tablets are much shorter)
+or cutting long ones into overlapping windows, the tokenized tablets are
+concatenated into one flat token array and cut into rows of exactly
+`seq_len` tokens, so only the last row is padded. A tablet that runs over the
+end of a row continues at the start of the next one.
+
+Document boundaries are kept in two ways:
+- separators: each tablet keeps its `<s> ... </s>` (or `sep_token_id` is
+  inserted after each one), and `position_ids` restart at every tablet.
+- attention: `document_ids` numbers the tablets within a row (0 = padding),
+  and `PackedCollator` turns them into a block-diagonal attention mask, so a
+  token only attends to its own tablet.
+
+>>> packed = dataset.map(
+...     partial(pack, seq_len=128, pad_token_id=tokenizer.pad_token_id),
+...     batched=True,
+...     remove_columns=dataset["train"].column_names,
+... )
+"""
+
+from dataclasses import dataclass
+from itertools import chain
+from typing import Optional
+
+import numpy as np
+import torch
+from transformers import DataCollatorForLanguageModeling
+
+
+def flatten(sequences: list[list[int]]) -> tuple[np.ndarray, np.ndarray]:
+    """(values, offsets) of a list of sequences; sequence i is
+    values[offsets[i]:offsets[i + 1]]."""
+    lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+    offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    values = np.fromiter(
+        chain.from_iterable(sequences), dtype=np.int64, count=offsets[-1]
+    )
+    return values, offsets
+
+
+def pack(
+    examples: dict[str, list],
+    seq_len: int,
+    pad_token_id: int,
+    sep_token_id: Optional[int] = None,
+) -> dict[str, list]:
+    """
+    Pack a batch of tokenized tablets (`input_ids`, and `special_tokens_mask`
+    if present) into rows of seq_len tokens, for `Dataset.map(batched=True)`.
+
+    Returns input_ids, special_tokens_mask, attention_mask, position_ids
+    (RoBERTa-style: they start at pad_token_id + 1 for each tablet) and
+    document_ids. A `weight` column (for oversampling) becomes the
+    token-weighted mean weight of the tablets in each row.
+    """
+    tokens, offsets = flatten(examples["input_ids"])
+    if "special_tokens_mask" in examples:
+        special, _ = flatten(examples["special_tokens_mask"])
+    else:
+        special = np.zeros_like(tokens)
+    lengths = np.diff(offsets)
+    num_docs = len(lengths)
+
+    if sep_token_id is not None:
+        # Shift each tablet right by the number of separators before it
+        doc_of_token = np.repeat(np.arange(num_docs), lengths)
+        positions = np.arange(len(tokens)) + doc_of_token
+        lengths = lengths + 1
+        stream = np.full(len(tokens) + num_docs, sep_token_id, dtype=np.int64)
+        stream_special = np.ones_like(stream)
+        stream[positions] = tokens
+        stream_special[positions] = special
+        tokens, special = stream, stream_special
+
+    docs = np.repeat(np.arange(num_docs), lengths)
+    if "weight" in examples:
+        weights = np.repeat(np.asarray(examples["weight"], dtype=np.float64), lengths)
+
+    # Pad the stream to a whole number of rows
+    num_rows = -(-len(tokens) // seq_len)
+    num_pad = num_rows * seq_len - len(tokens)
+    tokens = np.pad(tokens, (0, num_pad), constant_values=pad_token_id)
+    special = np.pad(special, (0, num_pad), constant_values=1)
+    docs = np.pad(docs, (0, num_pad), constant_values=-1)
+    tokens, special, docs = (
+        array.reshape(num_rows, seq_len) for array in (tokens, special, docs)
+    )
+
+    packed = {}
+    if "weight" in examples:
+        weights = np.pad(weights, (0, num_pad)).reshape(num_rows, seq_len)
+        num_real = np.maximum(1, (docs >= 0).sum(axis=1))
+        packed["weight"] = (weights.sum(axis=1) / num_real).tolist()
+
+    # A segment starts at the start of a row or where the tablet changes
+    starts = np.ones_like(docs, dtype=bool)
+    starts[:, 1:] = docs[:, 1:] != docs[:, :-1]
+    is_pad = docs < 0
+    document_ids = np.cumsum(starts, axis=1)
+    document_ids[is_pad] = 0
+
+    index = np.arange(seq_len)
+    segment_start = np.maximum.accumulate(np.where(starts, index, 0), axis=1)
+    position_ids = np.where(
+        is_pad, pad_token_id, index - segment_start + pad_token_id + 1
+    )
+
+    packed.update(
+        input_ids=tokens.tolist(),
+        special_tokens_mask=special.tolist(),
+        attention_mask=(~is_pad).astype(np.int64).tolist(),
+        position_ids=position_ids.tolist(),
+        document_ids=document_ids.tolist(),
+    )
+    return packed
+
+
+def padding_ratio(dataset) -> float:
+    """Fraction of the tokens in a (packed or padded) dataset that are padding."""
+    attention_mask = np.asarray(dataset["attention_mask"])
+    return 1 - attention_mask.sum() / attention_mask.size
+
+
+@dataclass
+class PackedCollator(DataCollatorForLanguageModeling):
+    """
+    MLM collator for packed rows. With block_diagonal, `document_ids` becomes
+    a (batch, seq_len, seq_len) attention mask that keeps each tablet from
+    attending to the others in its row; otherwise they only share a row,
+    separated by their special tokens.
+
+    `document_ids` isn't a model input, so the Trainer needs
+    `remove_unused_columns=False` to pass it through.
+    """
+
+    block_diagonal: bool = True
+
+    def torch_call(self, examples: list[dict]) -> dict:
+        examples = [dict(example) for example in examples]
+        document_ids = [example.pop("document_ids", None) for example in examples]
+        batch = super().torch_call(examples)
+        if self.block_diagonal and document_ids[0] is not None:
+            documents = torch.tensor(document_ids)
+            # Padding (document 0) only attends to padding
+            mask = documents[:, :, None] == documents[:, None, :]
+            batch["attention_mask"] = mask.long()
+        return batch
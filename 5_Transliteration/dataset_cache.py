@@ -0,0 +1,262 @@
+"""
+Cache of preprocessed (tokenized) datasets, keyed by what they depend on:
+
+- the raw dataset (the fingerprints of its splits, which change with the
+  Hub revision and with any map/filter/shuffle applied before this)
+- the tokenizer files (hashed after `save_pretrained`)
+- the preprocessing parameters (e.g. MAX_LENGTH)
+- what the preprocessing function depends on: its source, the source of the
+  functions and classes it reads from its globals or closure (recursively,
+  e.g. `pack` through `partial(pack, seq_len=...)`, with the partial's
+  arguments), the source of the local modules they're defined in (installed
+  packages are left out), and the values of the plain constants it reads
+  (numbers, strings, and lists/tuples/dicts of them, e.g. MAX_LENGTH)
+- `version`, to bump by hand for anything else the output depends on (a
+  data file read inside the function, an upgraded tokenizers library, a
+  constant read through an object attribute...)
+
+A hit is loaded with `load_from_disk`, which memory-maps the Arrow files
+rather than reading them, so it takes seconds. A miss runs the preprocessing
+(with `num_proc` worker processes) and saves it. Only the MAX_ENTRIES most
+recently used entries are kept.
+
+>>> dataset = load_preprocessed(
+...     raw_dataset,
+...     tokenize,
+...     tokenizers={"encoder_tokenizer": enc, "decoder_tokenizer": dec},
+...     params={"max_length": MAX_LENGTH},
+... )
+"""
+
+import functools
+import hashlib
+import inspect
+import json
+import os
+import shutil
+import sysconfig
+import tempfile
+import time
+from types import CodeType
+from typing import Callable, Optional
+
+import datasets
+
+CACHE_DIR = "./dataset_cache"
+MAX_ENTRIES = 5
+META_FILE = "cache_meta.json"
+
+# Modules under these aren't hashed (their versions aren't in the key either)
+_LIBRARY_PATHS = tuple(
+    {
+        os.path.abspath(sysconfig.get_paths()[name])
+        for name in ("stdlib", "platstdlib", "purelib", "platlib")
+    }
+)
+
+
+def _sha256(*parts: bytes) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part)
+    return digest.hexdigest()
+
+
+def dataset_hash(dataset) -> str:
+    if isinstance(dataset, datasets.DatasetDict):
+        fingerprints = [f"{split}={dataset[split]._fingerprint}" for split in dataset]
+    else:
+        fingerprints = [dataset._fingerprint]
+    return _sha256("\n".join(sorted(fingerprints)).encode())
+
+
+def tokenizer_hash(tokenizer) -> str:
+    """Hash of the files the tokenizer saves (vocab, merges, config...)."""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tokenizer.save_pretrained(tmp_dir)
+        parts = []
+        for name in sorted(os.listdir(tmp_dir)):
+            with open(os.path.join(tmp_dir, name), "rb") as infile:
+                parts.append(name.encode() + b"\0" + _sha256(infile.read()).encode())
+    return _sha256(*parts)
+
+
+def function_hash(fn: Callable) -> str:
+    """Hash of a function's source and of what it depends on (see above)."""
+    parts: list[str] = []
+    _add_dependency(fn, parts, set())
+    return _sha256("\n".join(parts).encode())
+
+
+def _add_dependency(value, parts: list[str], seen: set[int]):
+    constant = _constant_repr(value)
+    if constant is not None:
+        parts.append(constant)
+        return
+    if id(value) in seen:
+        return
+    seen.add(id(value))
+
+    if isinstance(value, functools.partial):
+        parts.append("partial")
+        for arg in value.args:
+            _add_dependency(arg, parts, seen)
+        for name, arg in sorted(value.keywords.items()):
+            parts.append(name)
+            _add_dependency(arg, parts, seen)
+        _add_dependency(value.func, parts, seen)
+    elif inspect.ismodule(value):
+        path = getattr(value, "__file__", None)
+        if _is_local(path):
+            with open(path, "rb") as infile:
+                parts.append(f"{value.__name__}:{_sha256(infile.read())}")
+    elif inspect.isfunction(value) or inspect.isclass(value):
+        module = inspect.getmodule(value)
+        if module is not None and module.__name__ != "__main__":
+            if not _is_local(getattr(module, "__file__", None)):
+                return  # from an installed package, or built in
+            _add_dependency(module, parts, seen)
+        parts.append(_source(value))
+        if inspect.isfunction(value):
+            for name in sorted(_global_names(value.__code__)):
+                if name in value.__globals__:
+                    parts.append(name)
+                    _add_dependency(value.__globals__[name], parts, seen)
+            for cell in value.__closure__ or ():
+                try:
+                    _add_dependency(cell.cell_contents, parts, seen)
+                except ValueError:  # an empty cell
+                    pass
+    else:
+        # A tokenizer, a dataset...: only its type
+        parts.append(type(value).__qualname__)
+
+
+def _constant_repr(value) -> Optional[str]:
+    """repr of numbers, strings, and lists/tuples/dicts of them; else None."""
+    if value is None or isinstance(value, (bool, int, float, str, bytes)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        items = [_constant_repr(item) for item in value]
+        if all(item is not None for item in items):
+            return f"{type(value).__name__}({', '.join(items)})"
+    if isinstance(value, dict):
+        items = [
+            (_constant_repr(key), _constant_repr(item)) for key, item in value.items()
+        ]
+        if all(key is not None and item is not None for key, item in items):
+            return "{" + ", ".join(f"{key}: {item}" for key, item in items) + "}"
+    return None
+
+
+def _source(value) -> str:
+    try:
+        return inspect.getsource(value)
+    except (OSError, TypeError):
+        return getattr(value, "__qualname__", repr(value))
+
+
+def _global_names(code: CodeType) -> set[str]:
+    """Names a function's code (and the functions nested in it) can look up."""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names |= _global_names(const)
+    return names
+
+
+def _is_local(path: Optional[str]) -> bool:
+    if path is None or not path.endswith(".py"):
+        return False
+    path = os.path.abspath(path)
+    return not path.startswith(_LIBRARY_PATHS) and "-packages" + os.sep not in path
+
+
+def cache_key(
+    dataset,
+    fn: Callable,
+    tokenizers: dict,
+    params: Optional[dict] = None,
+    version: Optional[str] = None,
+) -> str:
+    parts = {
+        "dataset": dataset_hash(dataset),
+        "function": function_hash(fn),
+        "tokenizers": {
+            name: tokenizer_hash(tokenizer) for name, tokenizer in tokenizers.items()
+        },
+        "params": params or {},
+        "version": version,
+    }
+    return _sha256(json.dumps(parts, sort_keys=True, default=str).encode())[:16]
+
+
+def load_preprocessed(
+    dataset,
+    fn: Callable,
+    *,
+    tokenizers: dict,
+    params: Optional[dict] = None,
+    version: Optional[str] = None,
+    num_proc: Optional[int] = None,
+    cache_dir: str = CACHE_DIR,
+    max_entries: int = MAX_ENTRIES,
+):
+    """
+    `fn(dataset, **tokenizers, **params, num_proc=num_proc)`, from the cache
+    if it's there. `version` only goes into the cache key (it isn't passed to
+    `fn`): change it to invalidate entries for something the key can't see.
+    """
+    params = params or {}
+    key = cache_key(dataset, fn, tokenizers, params, version)
+    path = os.path.join(cache_dir, key)
+    if os.path.isdir(path):
+        print(f"Loading preprocessed dataset from {path}")
+        os.utime(path)  # most recently used
+        return datasets.load_from_disk(path)
+
+    print(f"Preprocessing dataset (cache key {key})...")
+    start = time.monotonic()
+    if num_proc is None:
+        num_proc = os.cpu_count()
+    preprocessed = fn(dataset, **tokenizers, **params, num_proc=num_proc)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    part_path = f"{path}.part"
+    shutil.rmtree(part_path, ignore_errors=True)
+    preprocessed.save_to_disk(part_path)
+    with open(os.path.join(part_path, META_FILE), "w", encoding="utf-8") as outfile:
+        json.dump(
+            {
+                "function": getattr(fn, "__qualname__", repr(fn)),
+                "params": params,
+                "version": version,
+                "tokenizers": {
+                    name: getattr(tokenizer, "name_or_path", "")
+                    for name, tokenizer in tokenizers.items()
+                },
+                "seconds": round(time.monotonic() - start, 1),
+            },
+            outfile,
+            indent=2,
+            default=str,
+        )
+    os.replace(part_path, path)
+    evict(cache_dir, max_entries)
+
+    # Reload so the result is memory-mapped from the cache, like a hit
+    return datasets.load_from_disk(path)
+
+
+def evict(cache_dir: str = CACHE_DIR, max_entries: int = MAX_ENTRIES):
+    """Delete all but the max_entries most recently used entries."""
+    entries = [
+        os.path.join(cache_dir, name)
+        for name in os.listdir(cache_dir)
+        if not name.endswith(".part")
+        and os.path.isdir(os.path.join(cache_dir, name))
+    ]
+    entries.sort(key=os.path.getmtime, reverse=True)
+    for path in entries[max_entries:]:
+        print(f"Evicting {path}")
+        shutil.rmtree(path)
@@ -1,16 +1,24 @@
-from transformers import RobertaTokenizer, XLMRobertaTokenizer
+from length_grouping import LengthGroupedSeq2SeqTrainer, print_padding_report
+from transformers import (
+    DataCollatorForSeq2Seq,
+    RobertaTokenizer,
+    XLMRobertaTokenizer,
+)
 
 encoder_tokenizer = XLMRobertaTokenizer.from_pretrained("xlm-roberta-base")
 decoder_tokenizer = RobertaTokenizer.from_pretrained("roberta-base")
 
 
+MAX_LENGTH = 128
+
+
 def preprocess_function(examples):
     encoder_inputs = encoder_tokenizer(
-        examples["source"], truncation=True, padding="max_length", max_length=128
+        examples["source"], truncation=True, max_length=MAX_LENGTH
     )
     with encoder_tokenizer.as_target_tokenizer():
         labels = decoder_tokenizer(
-            examples["target"], truncation=True, padding="max_length", max_length=128
+            examples["target"], truncation=True, max_length=MAX_LENGTH
         )
     encoder_inputs["labels"] = labels["input_ids"]
     return encoder_inputs
@@ -28,7 +36,7 @@ decoder = RobertaModel.from_pretrained("roberta-base")
 # Combine them into an encoder-decoder model
 model = EncoderDecoderModel(encoder=encoder, decoder=decoder)
 
-from transformers import Seq2SeqTrainer, Seq2SeqTrainingArguments
+from transformers import Seq2SeqTrainingArguments
 
 training_args = Seq2SeqTrainingArguments(
     output_dir="./results",
@@ -41,12 +49,21 @@ training_args = Seq2SeqTrainingArguments(
     predict_with_generate=True,
 )
 
-trainer = Seq2SeqTrainer(
+# Pads each batch to its longest tablet
+data_collator = DataCollatorForSeq2Seq(
+    encoder_tokenizer, model=model, pad_to_multiple_of=8
+)
+
+# Batches of up to max_tokens padded source + target tokens, grouped by length
+trainer = LengthGroupedSeq2SeqTrainer(
     model=model,
     args=training_args,
     train_dataset=tokenized_datasets["train"],
+    data_collator=data_collator,
+    max_tokens=8192,
     # Implement compute_metrics function to calculate BLEU score
 )
+print_padding_report(trainer.batch_sampler, max_length=MAX_LENGTH, batch_size=4)
 
 from datasets import load_metric
 
@@ -67,9 +84,11 @@ def compute_metrics(eval_pred):
     return {"bleu": result["score"]}
 
 
-trainer = Seq2SeqTrainer(
+trainer = LengthGroupedSeq2SeqTrainer(
     model=model,
     args=training_args,
+    data_collator=data_collator,
+    max_tokens=8192,
     compute_metrics=compute_metrics,
     train_dataset=tokenized_datasets["train"],
     eval_dataset=tokenized_datasets["validation"],
@@ -0,0 +1,278 @@
+"""
+Length-grouped batching for the seq2seq transliteration model.
+
+Padding every tablet to a fixed length (128 or 256) spends most of the compute
+on padding, since most tablets are much shorter. Instead:
+
+- `TokenBudgetBatchSampler` shuffles the tablets, sorts them by length within
+  large buckets, and cuts each bucket into batches of at most `max_tokens`
+  (padded source + target tokens), so short tablets go in big batches and
+  long ones in small batches. The batches are cut once; each epoch only
+  shuffles their order (with a different seed), so every epoch has the same
+  number of batches, as the Trainer expects when it computes `max_steps` from
+  `len(train_dataloader)`. With `weights`, each epoch's tablets are drawn by
+  weight instead (see `oversampling.py`) and cut again, and random batches are
+  dropped or repeated to keep the first epoch's number of batches.
+- Each batch is padded only to its longest tablet (`DataCollatorForSeq2Seq`
+  with a small `pad_to_multiple_of`).
+- `LengthGroupedSeq2SeqTrainer` is a drop-in for `Seq2SeqTrainer` that trains
+  on those batches (`per_device_train_batch_size` is ignored).
+
+>>> trainer = LengthGroupedSeq2SeqTrainer(
+...     model=model,
+...     args=training_args,
+...     train_dataset=dataset["train"],
+...     data_collator=DataCollatorForSeq2Seq(tokenizer, model, pad_to_multiple_of=8),
+...     max_tokens=16384,
+... )
+>>> print_padding_report(trainer.batch_sampler, max_length=256, batch_size=8)
+"""
+
+from typing import Iterator, Optional
+
+import numpy as np
+from oversampling import draw
+from torch.utils.data import DataLoader, Sampler
+from transformers import Seq2SeqTrainer
+
+MAX_TOKENS = 16384
+# Tablets are sorted within buckets of this many batches' worth of tablets
+BUCKET_BATCHES = 50
+
+
+def sequence_lengths(dataset, column: str) -> np.ndarray:
+    return np.fromiter(
+        (len(sequence) for sequence in dataset[column]),
+        dtype=np.int64,
+        count=len(dataset),
+    )
+
+
+class TokenBudgetBatchSampler(Sampler[list[int]]):
+    def __init__(
+        self,
+        source_lengths: np.ndarray,
+        target_lengths: np.ndarray,
+        max_tokens: int = MAX_TOKENS,
+        *,
+        max_batch_size: Optional[int] = None,
+        pad_to_multiple_of: int = 1,
+        shuffle: bool = True,
+        weights: Optional[np.ndarray] = None,
+        seed: int = 42,
+    ):
+        self.source_lengths = np.asarray(source_lengths)
+        self.target_lengths = np.asarray(target_lengths)
+        self.max_tokens = max_tokens
+        self.max_batch_size = max_batch_size
+        self.pad_to_multiple_of = pad_to_multiple_of
+        self.shuffle = shuffle
+        self.weights = weights
+        self.seed = seed
+        self.epoch = 0
+        self._batches: Optional[tuple[int, list[list[int]]]] = None  # (epoch, ...)
+        self._grouped: Optional[list[list[int]]] = None
+
+    @classmethod
+    def from_dataset(cls, dataset, max_tokens: int = MAX_TOKENS, **kwargs):
+        return cls(
+            sequence_lengths(dataset, "input_ids"),
+            sequence_lengths(dataset, "labels"),
+            max_tokens,
+            **kwargs,
+        )
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _padded(self, length: int) -> int:
+        multiple = self.pad_to_multiple_of
+        return -(-length // multiple) * multiple
+
+    def batches(self, epoch: int) -> list[list[int]]:
+        if self._batches is not None and self._batches[0] == epoch:
+            return self._batches[1]
+
+        rng = np.random.default_rng((self.seed, epoch))
+        if self.weights is None or epoch == 0:
+            batches = list(self._grouped_batches())
+        else:
+            batches = self._group(draw(self.weights, rng))
+            batches = self._resize(batches, len(self._grouped_batches()), rng)
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+
+        self._batches = (epoch, batches)
+        return batches
+
+    def _grouped_batches(self) -> list[list[int]]:
+        """The batches every epoch is a reordering of (or sized like)."""
+        if self._grouped is None:
+            rng = np.random.default_rng(self.seed)
+            if self.weights is not None:
+                indices = draw(self.weights, rng)
+            elif self.shuffle:
+                indices = rng.permutation(len(self.source_lengths))
+            else:
+                indices = np.arange(len(self.source_lengths))
+            self._grouped = self._group(indices)
+        return self._grouped
+
+    def _group(self, indices: np.ndarray) -> list[list[int]]:
+        """Sort tablets by length within buckets, and cut them into batches."""
+        lengths = self.source_lengths + self.target_lengths
+        typical_batch_size = max(1, self.max_tokens // max(1, int(np.median(lengths))))
+        bucket_size = typical_batch_size * BUCKET_BATCHES
+
+        batches = []
+        for start in range(0, len(indices), bucket_size):
+            bucket = indices[start : start + bucket_size]
+            bucket = bucket[np.argsort(lengths[bucket], kind="stable")]
+            batches.extend(self._cut(bucket.tolist()))
+        return batches
+
+    @staticmethod
+    def _resize(
+        batches: list[list[int]], num_batches: int, rng: np.random.Generator
+    ) -> list[list[int]]:
+        """Drop or repeat random batches, so that there are num_batches."""
+        if not batches:
+            return batches
+        if len(batches) >= num_batches:
+            keep = np.sort(rng.choice(len(batches), num_batches, replace=False))
+        else:
+            extra = rng.choice(len(batches), num_batches - len(batches))
+            keep = np.concatenate([np.arange(len(batches)), extra])
+        return [batches[i] for i in keep]
+
+    def _cut(self, bucket: list[int]) -> Iterator[list[int]]:
+        """Cut tablets sorted by length into batches within the token budget."""
+        batch: list[int] = []
+        max_source = max_target = 0
+        for i in bucket:
+            source = max(max_source, self._padded(self.source_lengths[i]))
+            target = max(max_target, self._padded(self.target_lengths[i]))
+            too_many = (len(batch) + 1) * (source + target) > self.max_tokens
+            too_big = self.max_batch_size and len(batch) == self.max_batch_size
+            if batch and (too_many or too_big):
+                yield batch
+                batch = []
+                source = self._padded(self.source_lengths[i])
+                target = self._padded(self.target_lengths[i])
+            # A tablet over the budget on its own still gets a batch
+            batch.append(i)
+            max_source, max_target = source, target
+        if batch:
+            yield batch
+
+    def __iter__(self) -> Iterator[list[int]]:
+        # The Trainer doesn't always call set_epoch on a batch sampler, so
+        # move on to the next epoch's order after each pass
+        epoch = self.epoch
+        self.epoch += 1
+        yield from self.batches(epoch)
+
+    def __len__(self) -> int:
+        return len(self._grouped_batches())
+
+
+# ----------------------------------------
+# Padding report
+# ----------------------------------------
+
+
+def padding_report(
+    sampler: TokenBudgetBatchSampler, max_length: int, batch_size: int = 1
+) -> dict[str, float]:
+    """
+    Padding ratio (padding / padded tokens) when every tablet is padded to
+    max_length, when random batches of batch_size are padded to their longest
+    tablet, and with the sampler's batches.
+    """
+    source, target = sampler.source_lengths, sampler.target_lengths
+    # Compare on the same tablets: one epoch's worth (drawn, if weighted)
+    grouped_batches = sampler.batches(sampler.epoch)
+    indices = np.concatenate([np.asarray(batch) for batch in grouped_batches])
+    num_tokens = int(source[indices].sum() + target[indices].sum())
+
+    def _ratio(padded: int) -> float:
+        return 1 - num_tokens / padded if padded else 0.0
+
+    def _padded(batches: list) -> int:
+        return sum(
+            len(batch)
+            * (
+                sampler._padded(source[batch].max())
+                + sampler._padded(target[batch].max())
+            )
+            for batch in batches
+        )
+
+    order = np.random.default_rng(sampler.seed).permutation(indices)
+    random_batches = [
+        order[i : i + batch_size] for i in range(0, len(order), batch_size)
+    ]
+    return {
+        "max_length": _ratio(2 * max_length * len(indices)),
+        "random_batches": _ratio(_padded(random_batches)),
+        "length_grouped": _ratio(_padded(grouped_batches)),
+        "num_batches": len(grouped_batches),
+        "mean_batch_size": len(indices) / max(1, len(grouped_batches)),
+    }
+
+
+def print_padding_report(
+    sampler: TokenBudgetBatchSampler, max_length: int, batch_size: int = 1
+):
+    report = padding_report(sampler, max_length, batch_size)
+    print(f"Padding to {max_length}: {report['max_length']:.1%}")
+    print(
+        f"Random batches of {batch_size}, padded to the longest: "
+        f"{report['random_batches']:.1%}"
+    )
+    print(
+        f"Length-grouped, {sampler.max_tokens} tokens per batch: "
+        f"{report['length_grouped']:.1%} "
+        f"({report['num_batches']} batches, {report['mean_batch_size']:.1f} avg)"
+    )
+
+
+# ----------------------------------------
+# Trainer
+# ----------------------------------------
+
+
+class LengthGroupedSeq2SeqTrainer(Seq2SeqTrainer):
+    """Seq2SeqTrainer that trains on TokenBudgetBatchSampler batches."""
+
+    def __init__(
+        self,
+        *args,
+        max_tokens: int = MAX_TOKENS,
+        max_batch_size: Optional[int] = None,
+        pad_to_multiple_of: int = 8,
+        weights: Optional[np.ndarray] = None,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.batch_sampler = TokenBudgetBatchSampler.from_dataset(
+            self.train_dataset,
+            max_tokens,
+            max_batch_size=max_batch_size,
+            pad_to_multiple_of=pad_to_multiple_of,
+            weights=weights,
+            seed=self.args.seed,
+        )
+
+    def get_train_dataloader(self) -> DataLoader:
+        train_dataset = self._remove_unused_columns(
+            self.train_dataset, description="training"
+        )
+        dataloader = DataLoader(
+            train_dataset,
+            batch_sampler=self.batch_sampler,
+            collate_fn=self.data_collator,
+            num_workers=self.args.dataloader_num_workers,
+            pin_memory=self.args.dataloader_pin_memory,
+        )
+        return self.accelerator.prepare(dataloader)
@@ -0,0 +1,118 @@
+"""
+Oversampling by weight, without copying the dataset.
+
+Rather than concatenating 10 copies of the non-administrative tablets (and
+tokenizing each copy), every tablet gets a weight from its genre and period,
+and each epoch draws indices into the original dataset: a tablet of weight
+2.5 is drawn twice, plus a third time with probability 0.5. With whole-number
+weights that's the same multiset of tablets as concatenating copies. The
+draw is seeded by (seed, epoch), so runs are reproducible but each epoch
+differs. With fractional weights the number of draws varies from epoch to
+epoch, but the Trainer sizes its schedule (and the epoch's progress bar) from
+len(sampler) once, so every epoch is trimmed or topped up with random repeats
+to the length of epoch 0, like TokenBudgetBatchSampler does with batches.
+
+>>> weights = example_weights(
+...     dataset["train"], {"Administrative": 1}, default_genre_weight=10
+... )
+>>> trainer = WeightedTrainer(..., train_dataset=dataset["train"], weights=weights)
+"""
+
+from typing import Iterator, Optional
+
+import numpy as np
+from torch.utils.data import Sampler
+from transformers import Trainer
+
+# The non-administrative tablets were oversampled 10x
+NON_ADMINISTRATIVE_WEIGHT = 10
+
+
+def example_weights(
+    dataset,
+    genre_weights: Optional[dict[str, float]] = None,
+    period_weights: Optional[dict[str, float]] = None,
+    *,
+    default_genre_weight: float = 1.0,
+    default_period_weight: float = 1.0,
+) -> np.ndarray:
+    """Weight of each tablet: its genre's weight times its period's weight."""
+    genre_weights = genre_weights or {}
+    period_weights = period_weights or {}
+    weights = np.ones(len(dataset))
+    if genre_weights or default_genre_weight != 1.0:
+        weights *= [
+            genre_weights.get(genre, default_genre_weight)
+            for genre in dataset["genre"]
+        ]
+    if period_weights or default_period_weight != 1.0:
+        weights *= [
+            period_weights.get(period, default_period_weight)
+            for period in dataset["period"]
+        ]
+    return weights
+
+
+def draw(weights: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """Shuffled indices, each drawn floor(w) times plus once more w.p. frac(w)."""
+    whole = np.floor(weights).astype(np.int64)
+    extra = rng.random(len(weights)) < weights - whole
+    counts = whole + extra
+    return rng.permutation(np.repeat(np.arange(len(weights)), counts))
+
+
+class WeightedEpochSampler(Sampler[int]):
+    def __init__(self, weights: np.ndarray, seed: int = 42):
+        self.weights = np.asarray(weights, dtype=np.float64)
+        self.seed = seed
+        self.epoch = 0
+        self._indices: Optional[tuple[int, np.ndarray]] = None  # (epoch, ...)
+        self._num_indices: Optional[int] = None
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def indices(self, epoch: int) -> np.ndarray:
+        if self._indices is None or self._indices[0] != epoch:
+            rng = np.random.default_rng((self.seed, epoch))
+            indices = draw(self.weights, rng)
+            if epoch != 0:
+                indices = self._resize(indices, len(self), rng)
+            self._indices = (epoch, indices)
+        return self._indices[1]
+
+    @staticmethod
+    def _resize(
+        indices: np.ndarray, num_indices: int, rng: np.random.Generator
+    ) -> np.ndarray:
+        """Drop or repeat random draws, so that there are num_indices."""
+        if len(indices) == 0 or len(indices) == num_indices:
+            return indices
+        if len(indices) > num_indices:
+            # Without replacement the choice comes out shuffled already
+            return rng.choice(indices, num_indices, replace=False)
+        extra = rng.choice(indices, num_indices - len(indices))
+        return rng.permutation(np.concatenate([indices, extra]))
+
+    def __iter__(self) -> Iterator[int]:
+        # Like TokenBudgetBatchSampler, move on to the next epoch after a pass
+        epoch = self.epoch
+        self.epoch += 1
+        yield from self.indices(epoch).tolist()
+
+    def __len__(self) -> int:
+        if self._num_indices is None:
+            rng = np.random.default_rng((self.seed, 0))
+            self._num_indices = len(draw(self.weights, rng))
+        return self._num_indices
+
+
+class WeightedTrainer(Trainer):
+    """Trainer that draws its training examples with WeightedEpochSampler."""
+
+    def __init__(self, *args, weights: np.ndarray, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.train_sampler = WeightedEpochSampler(weights, seed=self.args.seed)
+
+    def _get_train_sampler(self, *args, **kwargs) -> Sampler:
+        return self.train_sampler
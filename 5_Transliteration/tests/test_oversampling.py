@@ -0,0 +1,45 @@
+"""
+Tests for drawing training examples by weight.
+
+    poetry run pytest 5_Transliteration/tests
+"""
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from oversampling import WeightedEpochSampler, draw  # noqa: E402
+
+
+def test_whole_weights_draw_copies():
+    indices = draw(np.array([1.0, 3.0, 0.0, 2.0]), np.random.default_rng(0))
+    assert sorted(indices.tolist()) == [0, 1, 1, 1, 3, 3]
+
+
+def test_length_is_fixed_across_epochs_with_fractional_weights():
+    weights = np.random.default_rng(0).uniform(0.2, 2.8, size=200)
+    sampler = WeightedEpochSampler(weights, seed=1)
+    num_indices = len(sampler)
+
+    raw_lengths = set()
+    epochs = []
+    for epoch in range(6):
+        rng = np.random.default_rng((1, epoch))
+        raw_lengths.add(len(draw(sampler.weights, rng)))
+        assert len(sampler) == num_indices
+        epochs.append(list(sampler))
+        assert len(epochs[-1]) == num_indices
+        assert set(epochs[-1]) <= set(range(len(weights)))
+    # Without the resize the epochs would differ in length
+    assert len(raw_lengths) > 1
+    # ...and they're still different draws
+    assert epochs[1] != epochs[2]
+
+
+def test_epochs_are_reproducible():
+    weights = np.array([0.5, 1.5, 2.25, 1.0])
+    first, second = WeightedEpochSampler(weights), WeightedEpochSampler(weights)
+    second.set_epoch(3)
+    assert list(second) == first.indices(3).tolist()
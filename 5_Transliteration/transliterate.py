@@ -0,0 +1,512 @@
+"""
+Transliterates glyph tablets with a trained EncoderDecoderModel (from
+`seq2seq.ipynb`), on CPU, writing `transliterations.csv`:
+
+    id | transliteration
+
+Tablets are sorted by length and decoded in batches of similar length, so
+little time goes to padding. Tablets longer than `--max-length` tokens are
+split by surface (as they were for training) and the surfaces' outputs
+joined back together. Each output is at most `--max-new-tokens` tokens; the
+number of outputs cut off there (no end token) is reported at the end. Rows
+are appended as soon as a tablet is done, and ids already in the output file
+are skipped, so an interrupted run picks up where it left off.
+
+- `--num-beams 1` is greedy search; more is beam search.
+- `--quantize` converts the Linear layers to dynamic int8 (weights stored as
+  int8, activations quantized on the fly), which is faster on CPU for a
+  small loss in quality.
+- `--onnx-export DIR` writes the encoder and the decoder (with its LM head)
+  as ONNX graphs, int8-quantized too with `--quantize`. As in `optimum`, the
+  decoder is exported twice: `decoder.onnx` for the first step, which also
+  returns the attention keys/values, and `decoder_with_past.onnx`, which
+  takes them back and only runs the newest token, so each step costs O(L)
+  rather than re-running the whole prefix. `--onnx DIR` then decodes
+  (greedily) with onnxruntime instead of torch, on `--threads` threads.
+  Time both on the machine that will run them: on a small CPU benchmark
+  (256 new tokens), the cache made ONNX decoding ~13x faster, but torch's
+  `generate`, which caches too, was still about as fast.
+
+e.g. the SumTablets test split:
+    poetry run python transliterate.py --model ./models/run/best_model --quantize
+or a file of unlabeled tablets (`id` and `glyphs` columns):
+    poetry run python transliterate.py --model ... --input unlabeled.csv
+"""
+
+import argparse
+import csv
+import os
+import time
+from typing import Iterator, Optional
+
+import datasets
+import numpy as np
+import torch
+from tqdm import tqdm
+from transformers import AutoTokenizer, EncoderDecoderConfig, EncoderDecoderModel
+
+DATASET = "colesimmons/SumTablets"
+ENCODER_TOKENIZER = "colesimmons/SumerianGlyphTokenizer_Roberta"
+DECODER_TOKENIZER = "colesimmons/SumerianTransliterationTokenizer_Roberta"
+OUTPUT_FILE = "transliterations.csv"
+MAX_LENGTH = 256
+SURFACE = "<SURFACE>"
+
+ONNX_ENCODER = "encoder.onnx"
+ONNX_DECODER = "decoder.onnx"
+ONNX_DECODER_WITH_PAST = "decoder_with_past.onnx"
+ONNX_OPSET = 14
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Transliterate glyph tablets.")
+    parser.add_argument("--model", type=str, required=True)
+    parser.add_argument("--encoder-tokenizer", type=str, default=ENCODER_TOKENIZER)
+    parser.add_argument("--decoder-tokenizer", type=str, default=DECODER_TOKENIZER)
+    parser.add_argument(
+        "--input",
+        type=str,
+        default=DATASET,
+        help="CSV/JSON(L)/Parquet file, or a dataset on the Hub",
+    )
+    parser.add_argument("--split", type=str, default="test")
+    parser.add_argument("--id-column", type=str, default="id")
+    parser.add_argument("--glyphs-column", type=str, default="glyphs")
+    parser.add_argument("--output", type=str, default=OUTPUT_FILE)
+    parser.add_argument("--limit", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--num-beams", type=int, default=1, help="1: greedy")
+    parser.add_argument(
+        "--max-length",
+        type=int,
+        default=MAX_LENGTH,
+        help="Max input tokens per tablet or surface",
+    )
+    parser.add_argument(
+        "--max-new-tokens",
+        type=int,
+        default=MAX_LENGTH,
+        help="Max output tokens per tablet or surface",
+    )
+    parser.add_argument("--threads", type=int, default=None)
+    parser.add_argument("--quantize", action="store_true", help="Dynamic int8")
+    parser.add_argument(
+        "--onnx-export", type=str, default=None, help="Write ONNX graphs here"
+    )
+    parser.add_argument(
+        "--onnx", type=str, default=None, help="Decode with ONNX graphs from here"
+    )
+    args = parser.parse_args()
+
+    if args.onnx and args.num_beams > 1:
+        parser.error("--onnx only does greedy search (--num-beams 1)")
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    encoder_tokenizer = AutoTokenizer.from_pretrained(args.encoder_tokenizer)
+    decoder_tokenizer = AutoTokenizer.from_pretrained(args.decoder_tokenizer)
+    if args.onnx_export:
+        model = EncoderDecoderModel.from_pretrained(args.model).eval()
+        export_onnx(model, args.onnx_export, quantize_graphs=args.quantize)
+        return
+
+    done = _done_ids(args.output)
+    tablets = [
+        (id_, glyphs)
+        for id_, glyphs in _read_tablets(args)
+        if id_ not in done and glyphs
+    ]
+    if args.limit is not None:
+        tablets = tablets[: args.limit]
+    print(f"{len(done)} already transliterated, {len(tablets)} to go")
+    if not tablets:
+        return
+
+    if args.onnx:
+        config = EncoderDecoderConfig.from_pretrained(args.model)
+        decoder = OnnxGreedyDecoder(
+            args.onnx,
+            start_token_id=config.decoder_start_token_id,
+            pad_token_id=decoder_tokenizer.pad_token_id,
+            eos_token_id=decoder_tokenizer.eos_token_id,
+            threads=args.threads,
+        )
+    else:
+        model = EncoderDecoderModel.from_pretrained(args.model).eval()
+        if args.quantize:
+            model = quantize(model)
+        decoder = TorchDecoder(model, num_beams=args.num_beams)
+
+    # Split tablets that are too long by surface, then sort all segments by
+    # length so each batch is about the same length
+    segments = []  # (tablet index, segment index, input ids)
+    num_segments = []
+    for i, (_, glyphs) in enumerate(tablets):
+        parts = split_by_surface(glyphs, encoder_tokenizer, args.max_length)
+        num_segments.append(len(parts))
+        segments.extend((i, j, ids) for j, ids in enumerate(parts))
+    segments.sort(key=lambda segment: len(segment[2]))
+
+    outputs: dict[int, list[Optional[str]]] = {}
+    num_tokens = 0
+    num_truncated = 0  # segments that reached max_new_tokens without EOS
+    start = time.monotonic()
+    is_new = not os.path.isfile(args.output)
+    with open(args.output, "a", encoding="utf-8", newline="") as outfile:
+        writer = csv.writer(outfile)
+        if is_new:
+            writer.writerow(["id", "transliteration"])
+        progress = tqdm(total=len(tablets), desc="Transliterating", unit="tablet")
+        for batch in _batches(segments, args.batch_size):
+            input_ids, attention_mask = pad(
+                [ids for _, _, ids in batch], encoder_tokenizer.pad_token_id
+            )
+            num_tokens += int(attention_mask.sum())
+            generated = decoder.generate(
+                input_ids, attention_mask, args.max_new_tokens
+            )
+            is_eos = generated[:, 1:] == decoder_tokenizer.eos_token_id
+            num_truncated += int((~is_eos.any(axis=1)).sum())
+            texts = decoder_tokenizer.batch_decode(generated, skip_special_tokens=True)
+            for (i, j, _), text in zip(batch, texts):
+                parts = outputs.setdefault(i, [None] * num_segments[i])
+                parts[j] = text.strip()
+                if all(part is not None for part in parts):
+                    writer.writerow([tablets[i][0], "\n".join(parts)])
+                    del outputs[i]
+                    progress.update(1)
+            outfile.flush()
+        progress.close()
+
+    seconds = time.monotonic() - start
+    print(
+        f"{len(tablets)} tablets ({len(segments)} segments, {num_tokens} tokens) "
+        f"in {seconds:.1f}s: {len(tablets) / seconds:.2f} tablets/s, "
+        f"{num_tokens / seconds:.0f} input tokens/s"
+    )
+    if num_truncated:
+        print(
+            f"{num_truncated} segments stopped at --max-new-tokens "
+            f"{args.max_new_tokens} without an end token (truncated)"
+        )
+
+
+# ----------------------------------------
+# Input
+# ----------------------------------------
+
+
+def _read_tablets(args) -> Iterator[tuple[str, str]]:
+    extension = os.path.splitext(args.input)[1].lstrip(".")
+    if os.path.isfile(args.input):
+        builder = {"jsonl": "json"}.get(extension, extension)
+        dataset = datasets.load_dataset(builder, data_files=args.input, split="train")
+    else:
+        dataset = datasets.load_dataset(args.input, split=args.split)
+    for example in dataset:
+        yield str(example[args.id_column]), example[args.glyphs_column]
+
+
+def _done_ids(path: str) -> set[str]:
+    if not os.path.isfile(path):
+        return set()
+    with open(path, encoding="utf-8", newline="") as infile:
+        return {row["id"] for row in csv.DictReader(infile)}
+
+
+def split_by_surface(glyphs: str, tokenizer, max_length: int) -> list[list[int]]:
+    """
+    Input ids of a tablet, or of each of its surfaces if the whole tablet is
+    longer than max_length (surfaces that are still too long are truncated).
+    """
+    input_ids = tokenizer(glyphs, truncation=False)["input_ids"]
+    if len(input_ids) <= max_length:
+        return [input_ids]
+    surfaces = [SURFACE + surface for surface in glyphs.split(SURFACE) if surface]
+    encoded = tokenizer(surfaces, truncation=True, max_length=max_length)
+    return encoded["input_ids"]
+
+
+def _batches(items: list, batch_size: int) -> Iterator[list]:
+    for start in range(0, len(items), batch_size):
+        yield items[start : start + batch_size]
+
+
+def pad(
+    sequences: list[list[int]], pad_token_id: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """(input_ids, attention_mask), right-padded to the longest sequence."""
+    lengths = np.array([len(sequence) for sequence in sequences])
+    input_ids = np.full((len(sequences), lengths.max()), pad_token_id, dtype=np.int64)
+    attention_mask = np.arange(lengths.max())[None, :] < lengths[:, None]
+    for row, sequence in enumerate(sequences):
+        input_ids[row, : len(sequence)] = sequence
+    return input_ids, attention_mask.astype(np.int64)
+
+
+# ----------------------------------------
+# Decoding
+# ----------------------------------------
+
+
+def quantize(model: EncoderDecoderModel) -> EncoderDecoderModel:
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+class TorchDecoder:
+    def __init__(self, model: EncoderDecoderModel, num_beams: int = 1):
+        self.model = model
+        self.num_beams = num_beams
+
+    @torch.inference_mode()
+    def generate(
+        self, input_ids: np.ndarray, attention_mask: np.ndarray, max_new_tokens: int
+    ) -> np.ndarray:
+        generated = self.model.generate(
+            input_ids=torch.from_numpy(input_ids),
+            attention_mask=torch.from_numpy(attention_mask),
+            max_new_tokens=max_new_tokens,
+            num_beams=self.num_beams,
+            early_stopping=self.num_beams > 1,
+        )
+        return generated.numpy()
+
+
+class _OnnxEncoder(torch.nn.Module):
+    """Encoder, plus the projection to the decoder's hidden size if any."""
+
+    def __init__(self, model: EncoderDecoderModel):
+        super().__init__()
+        self.encoder = model.encoder
+        self.enc_to_dec_proj = getattr(model, "enc_to_dec_proj", None)
+
+    def forward(self, input_ids, attention_mask):
+        hidden = self.encoder(input_ids=input_ids, attention_mask=attention_mask)[0]
+        if self.enc_to_dec_proj is not None:
+            hidden = self.enc_to_dec_proj(hidden)
+        return hidden
+
+
+# Per decoder layer: self-attention key/value, cross-attention key/value
+_KV_NAMES = ("decoder.key", "decoder.value", "encoder.key", "encoder.value")
+
+
+def _kv_names(prefix: str, num_layers: int, self_only: bool = False) -> list[str]:
+    names = _KV_NAMES[:2] if self_only else _KV_NAMES
+    return [f"{prefix}.{i}.{name}" for i in range(num_layers) for name in names]
+
+
+class _OnnxDecoder(torch.nn.Module):
+    """
+    Decoder with its LM head, for the first step: returns the logits and every
+    layer's keys/values (self- and cross-attention) for the later steps.
+    """
+
+    def __init__(self, model: EncoderDecoderModel):
+        super().__init__()
+        self.decoder = model.decoder
+
+    def forward(self, decoder_input_ids, encoder_hidden_states, encoder_attention_mask):
+        outputs = self.decoder(
+            input_ids=decoder_input_ids,
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            use_cache=True,
+        )
+        presents = (kv for layer in outputs.past_key_values for kv in layer)
+        return (outputs.logits, *presents)
+
+
+class _OnnxDecoderWithPast(torch.nn.Module):
+    """
+    Decoder with its LM head, for the next steps: takes the new tokens and the
+    keys/values so far, and returns the logits and the self-attention
+    keys/values with the new tokens' added (the cross-attention ones don't
+    change).
+    """
+
+    def __init__(self, model: EncoderDecoderModel):
+        super().__init__()
+        self.decoder = model.decoder
+
+    def forward(
+        self, decoder_input_ids, encoder_hidden_states, encoder_attention_mask, *past
+    ):
+        past_key_values = tuple(
+            tuple(past[i : i + len(_KV_NAMES)])
+            for i in range(0, len(past), len(_KV_NAMES))
+        )
+        outputs = self.decoder(
+            input_ids=decoder_input_ids,
+            # Only tells the layers to cross-attend; the keys/values are in past
+            encoder_hidden_states=encoder_hidden_states,
+            encoder_attention_mask=encoder_attention_mask,
+            past_key_values=past_key_values,
+            use_cache=True,
+        )
+        presents = (kv for layer in outputs.past_key_values for kv in layer[:2])
+        return (outputs.logits, *presents)
+
+
+def export_onnx(model: EncoderDecoderModel, out_dir: str, quantize_graphs: bool):
+    """
+    Write the (float) encoder and decoders as ONNX graphs with dynamic batch
+    and sequence axes. A torch-quantized model can't be exported, so with
+    `quantize_graphs` the graphs are quantized with onnxruntime instead.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    num_layers = model.decoder.config.num_hidden_layers
+
+    input_ids = torch.ones((2, 8), dtype=torch.long)
+    attention_mask = torch.ones((2, 8), dtype=torch.long)
+    # With no padding, the mask would be dropped from the traced graph
+    attention_mask[1, -3:] = 0
+    decoder_input_ids = torch.ones((2, 3), dtype=torch.long)
+    # In eval mode, so that export doesn't leave the model in training mode
+    encoder = _OnnxEncoder(model).eval()
+    decoder = _OnnxDecoder(model).eval()
+    # Not inference_mode: its tensors can't be used as example inputs to trace
+    with torch.no_grad():
+        hidden = encoder(input_ids, attention_mask)
+        past = decoder(decoder_input_ids, hidden, attention_mask)[1:]
+    paths = [
+        os.path.join(out_dir, name)
+        for name in (ONNX_ENCODER, ONNX_DECODER, ONNX_DECODER_WITH_PAST)
+    ]
+
+    torch.onnx.export(
+        encoder,
+        (input_ids, attention_mask),
+        paths[0],
+        input_names=["input_ids", "attention_mask"],
+        output_names=["encoder_hidden_states"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "encoder_hidden_states": {0: "batch", 1: "sequence"},
+        },
+        opset_version=ONNX_OPSET,
+    )
+
+    decoder_inputs = [
+        "decoder_input_ids",
+        "encoder_hidden_states",
+        "encoder_attention_mask",
+    ]
+    decoder_axes = {
+        "decoder_input_ids": {0: "batch", 1: "new"},
+        "encoder_hidden_states": {0: "batch", 1: "sequence"},
+        "encoder_attention_mask": {0: "batch", 1: "sequence"},
+        "logits": {0: "batch", 1: "new"},
+    }
+    presents = _kv_names("present", num_layers)
+    torch.onnx.export(
+        decoder,
+        (decoder_input_ids, hidden, attention_mask),
+        paths[1],
+        input_names=decoder_inputs,
+        output_names=["logits", *presents],
+        dynamic_axes={**decoder_axes, **_kv_axes(presents, "decoded")},
+        opset_version=ONNX_OPSET,
+    )
+
+    past_names = _kv_names("past_key_values", num_layers)
+    self_presents = _kv_names("present", num_layers, self_only=True)
+    torch.onnx.export(
+        _OnnxDecoderWithPast(model).eval(),
+        (decoder_input_ids[:, :1], hidden, attention_mask, *past),
+        paths[2],
+        input_names=[*decoder_inputs, *past_names],
+        output_names=["logits", *self_presents],
+        dynamic_axes={
+            **decoder_axes,
+            **_kv_axes(past_names, "past_decoded"),
+            **_kv_axes(self_presents, "decoded"),
+        },
+        opset_version=ONNX_OPSET,
+    )
+
+    if quantize_graphs:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        for path in paths:
+            quantize_dynamic(path, path, weight_type=QuantType.QInt8)
+    print(f"Wrote {', '.join(paths)}")
+
+
+def _kv_axes(names: list[str], decoded_axis: str) -> dict[str, dict[int, str]]:
+    """(batch, heads, length, head size): length is the encoder's for cross
+    attention, else decoded_axis."""
+    return {
+        name: {0: "batch", 2: "sequence" if ".encoder." in name else decoded_axis}
+        for name in names
+    }
+
+
+class OnnxGreedyDecoder:
+    def __init__(
+        self,
+        onnx_dir: str,
+        start_token_id: int,
+        pad_token_id: int,
+        eos_token_id: int,
+        threads: Optional[int] = None,
+    ):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        self.encoder, self.decoder, self.decoder_with_past = (
+            onnxruntime.InferenceSession(os.path.join(onnx_dir, name), options)
+            for name in (ONNX_ENCODER, ONNX_DECODER, ONNX_DECODER_WITH_PAST)
+        )
+        self.start_token_id = start_token_id
+        self.pad_token_id = pad_token_id
+        self.eos_token_id = eos_token_id
+
+    def generate(
+        self, input_ids: np.ndarray, attention_mask: np.ndarray, max_new_tokens: int
+    ) -> np.ndarray:
+        (hidden,) = self.encoder.run(
+            None, {"input_ids": input_ids, "attention_mask": attention_mask}
+        )
+        decoded = np.full((len(input_ids), 1), self.start_token_id, dtype=np.int64)
+        finished = np.zeros(len(input_ids), dtype=bool)
+        inputs = {
+            "decoder_input_ids": decoded,
+            "encoder_hidden_states": hidden,
+            "encoder_attention_mask": attention_mask,
+        }
+        session, past = self.decoder, {}
+        for _ in range(max_new_tokens):
+            outputs = _run(session, {**inputs, **past})
+            next_tokens = outputs["logits"][:, -1].argmax(axis=-1)
+            next_tokens[finished] = self.pad_token_id
+            decoded = np.concatenate([decoded, next_tokens[:, None]], axis=1)
+            finished |= next_tokens == self.eos_token_id
+            if finished.all():
+                break
+            # Next step: only the new token, with the keys/values so far
+            # (the cross-attention ones are the first step's throughout)
+            inputs["decoder_input_ids"] = next_tokens[:, None]
+            past.update(
+                (name.replace("present", "past_key_values", 1), value)
+                for name, value in outputs.items()
+                if name.startswith("present.")
+            )
+            session = self.decoder_with_past
+        return decoded
+
+
+def _run(session, inputs: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+    """Run a session on the inputs it takes (unused ones may be pruned on export)."""
+    names = [node.name for node in session.get_inputs()]
+    outputs = session.run(None, {name: inputs[name] for name in names})
+    return dict(zip((node.name for node in session.get_outputs()), outputs))
+
+
+if __name__ == "__main__":
+    main()